@@ -1,19 +1,24 @@
 # app.py
 from flask import Flask, request, jsonify, send_file, Response, g
+import json
+import math
 import tempfile
 import os
-import shutil
 import logging
-import magic
-import gc
-from pathlib import Path
+import time
 from werkzeug.utils import secure_filename
-from config import MAX_FILE_SIZE, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, MIME_TO_EXT, DOCUMENT_EXTENSIONS
-from utils import ArchiveHandler, can_process_file, sort_files_by_priority
-from processors import (
-    process_image, process_pdf_file, process_video_file, 
-    process_archive, process_doc_file, process_docx_file
-)
+from config import MAX_FILE_SIZE, BATCH_MAX_FILES, DIRECTORY_SCAN_WORKERS, DIRECTORY_SCAN_OUTPUT_DIR
+from processors import model_manager
+from topology import cpu_plan
+from lanes import lane_scheduler
+from detector import APP_DIR, TempFileHandler, validate_path, scan_file, scan_upload, scan_batch
+from upload import UploadRequest
+from chunked import upload_sessions, parse_content_range, UploadSessionError
+from scan import DirectoryScanner
+from watch import start_configured_watcher
+from jobs import job_manager, JobQueueFull
+from context import current_context
+import metrics
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -22,241 +27,141 @@ app = Flask(__name__)
 
 # 文件上传配置
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE  # 从config导入的最大文件大小
+app.request_class = UploadRequest  # 上传文件边接收边计算摘要，小文件不落盘
 app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()  # 使用系统临时目录
-app.request_class.max_form_memory_size = 128 * 1024 * 1024  # 强制所有上传写入磁盘
 
 # Load index.html content
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 with open(os.path.join(CURRENT_DIR, 'index.html'), 'r', encoding='utf-8') as f:
     INDEX_HTML = f.read()
 
-class TempFileHandler:
-    """临时文件管理器"""
-    def __init__(self):
-        self.temp_files = []
-        self.temp_dirs = []
-        
-    def create_temp_file(self, suffix=None):
-        """创建临时文件"""
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        self.temp_files.append(temp_file.name)
-        return temp_file
-        
-    def create_temp_dir(self):
-        """创建临时目录"""
-        temp_dir = tempfile.mkdtemp()
-        self.temp_dirs.append(temp_dir)
-        return temp_dir
-        
-    def cleanup(self):
-        """清理所有临时文件和目录"""
-        # 清理文件
-        for file_path in self.temp_files:
-            try:
-                if os.path.exists(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                logger.error(f"清理临时文件失败 {file_path}: {str(e)}")
-        self.temp_files.clear()
-        
-        # 清理目录
-        for dir_path in self.temp_dirs:
-            try:
-                if os.path.exists(dir_path):
-                    shutil.rmtree(dir_path)
-            except Exception as e:
-                logger.error(f"清理临时目录失败 {dir_path}: {str(e)}")
-        self.temp_dirs.clear()
-        
-        # 强制垃圾回收
-        gc.collect()
+# 登记任务队列长度指标
+metrics.register_queue('jobs', job_manager.queue_depth)
 
-def detect_file_type(file_path):
-    """检测文件类型，使用文件的前2048字节"""
-    try:
-        with open(file_path, 'rb') as f:
-            header = f.read(2048)
-        
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_buffer(header)
-        
-        # 对于RAR文件的特殊处理
-        if mime_type not in MIME_TO_EXT:
-            with open(file_path, 'rb') as f:
-                if f.read(7).startswith(b'Rar!\x1a\x07'):
-                    return 'application/x-rar', '.rar'
-        
-        return mime_type, MIME_TO_EXT.get(mime_type)
-        
-    except Exception as e:
-        logger.error(f"文件类型检测失败: {str(e)}")
-        raise
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-def process_file_by_type(file_path, detected_type, original_filename, temp_handler):
-    """根据文件类型选择处理方法"""
-    mime_type, ext = detected_type
+@app.after_request
+def record_request_metrics(response):
+    """记录每个接口的请求数和耗时（流式响应只计到开始返回为止）"""
+    endpoint = request.endpoint or 'unknown'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+def get_scan_options():
+    """从请求参数中读取扫描选项，参数无效时抛出 ValueError"""
+    options = {}
     
-    # 如果有原始文件扩展名，优先使用
-    if original_filename and '.' in original_filename:
-        original_ext = os.path.splitext(original_filename)[1].lower()
-        if original_ext in IMAGE_EXTENSIONS or original_ext == '.pdf' or \
-           original_ext in VIDEO_EXTENSIONS or original_ext in {'.rar', '.zip', '.7z', '.gz'} or \
-           original_ext in DOCUMENT_EXTENSIONS:
-            ext = original_ext
+    scan_mode = request.form.get('scan_mode')
+    if scan_mode:
+        if scan_mode not in ('full', 'sample'):
+            raise ValueError(f'Invalid scan_mode: {scan_mode}')
+        options['scan_mode'] = scan_mode
     
-    if not ext:
-        logger.error(f"不支持的文件类型: {mime_type}")
-        return {
-            'status': 'error',
-            'message': f'Unsupported file type: {mime_type}'
-        }, 400
+    sample_budget = request.form.get('sample_budget')
+    if sample_budget:
+        try:
+            options['sample_budget'] = int(sample_budget)
+        except ValueError:
+            raise ValueError(f'Invalid sample_budget: {sample_budget}')
+        if options['sample_budget'] <= 0:
+            raise ValueError(f'Invalid sample_budget: {sample_budget}')
     
-    try:
-        if ext in IMAGE_EXTENSIONS:
-            with open(file_path, 'rb') as f:
-                from PIL import Image
-                # 使用with语句确保Image对象正确关闭
-                with Image.open(f) as image:
-                    result = process_image(image)
-                    # 处理完图片后强制垃圾回收
-                    gc.collect()
-                    return {
-                        'status': 'success',
-                        'filename': original_filename,
-                        'result': result
-                    }
-                
-        elif ext == '.pdf':
-            with open(file_path, 'rb') as f:
-                pdf_stream = f.read()
-                result = process_pdf_file(pdf_stream)
-                # 处理完PDF后强制垃圾回收
-                gc.collect()
-                if result:
-                    return {
-                        'status': 'success',
-                        'filename': original_filename,
-                        'result': result
-                    }
-                return {
-                    'status': 'error',
-                    'message': 'No processable content found in PDF'
-                }, 400
-                
-        elif ext in VIDEO_EXTENSIONS:
-            result = process_video_file(file_path)
-            # 处理完视频后强制垃圾回收
-            gc.collect()
-            if result:
-                return {
-                    'status': 'success',
-                    'filename': original_filename,
-                    'result': result
-                }
-            return {
-                'status': 'error',
-                'message': 'No processable content found in video'
-            }, 400
-                
-        elif ext in {'.zip', '.rar', '.7z', '.gz'}:
-            result = process_archive(file_path, original_filename)
-            # 处理完压缩包后强制垃圾回收
-            gc.collect()
-            return result
-            
-        elif ext in DOCUMENT_EXTENSIONS:
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-                if ext == '.doc':
-                    result = process_doc_file(file_content)
-                else:  # .docx
-                    result = process_docx_file(file_content)
-                
-                # 处理完文档后强制垃圾回收
-                gc.collect()
-                    
-                if result:
-                    return {
-                        'status': 'success',
-                        'filename': original_filename,
-                        'result': result
-                    }
-                return {
-                    'status': 'error',
-                    'message': 'No processable content found in document'
-                }, 400
-            
-        else:
-            logger.error(f"不支持的文件扩展名: {ext}")
-            return {
-                'status': 'error',
-                'message': f'Unsupported file extension: {ext}'
-            }, 400
-            
-    except Exception as e:
-        logger.error(f"处理文件时出错: {str(e)}")
-        return {
-            'status': 'error',
-            'message': str(e)
-        }, 500
+    # profile=1 时在响应中返回各处理阶段的耗时树
+    if request.form.get('profile') in ('1', 'true'):
+        options['profile'] = True
     
+    # 按请求指定的扫描预算：视频帧数、PDF 页数、压缩包成员数和总耗时（秒）
+    for param, option in (('max_frames', 'max_frames'), ('max_pages', 'max_pages'), ('max_members', 'max_members')):
+        value = request.form.get(param)
+        if value:
+            try:
+                options[option] = int(value)
+            except ValueError:
+                raise ValueError(f'Invalid {param}: {value}')
+            if options[option] <= 0:
+                raise ValueError(f'Invalid {param}: {value}')
+    
+    max_time = request.form.get('max_time')
+    if max_time:
+        try:
+            options['max_seconds'] = float(max_time)
+        except ValueError:
+            raise ValueError(f'Invalid max_time: {max_time}')
+        if not math.isfinite(options['max_seconds']) or options['max_seconds'] <= 0:
+            raise ValueError(f'Invalid max_time: {max_time}')
+    
+    threshold = request.form.get('threshold')
+    if threshold:
+        try:
+            options['threshold'] = float(threshold)
+        except ValueError:
+            raise ValueError(f'Invalid threshold: {threshold}')
+        if not math.isfinite(options['threshold']) or not 0 <= options['threshold'] <= 1:
+            raise ValueError(f'Invalid threshold: {threshold}')
+    
+    return options
+
 @app.route('/')
 def index():
     """Serve the index.html file"""
     return Response(INDEX_HTML, mimetype='text/html')
 
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能处理请求即返回成功，同时返回启动时计算的推理线程规划"""
+    return jsonify({'status': 'ok', 'inference': cpu_plan.to_dict(), 'lanes': lane_scheduler.status()})
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：模型加载并预热完成后才返回成功"""
+    if model_manager.ready:
+        return jsonify({'status': 'ready'})
+    if model_manager.warmup_error:
+        return jsonify({
+            'status': 'error',
+            'message': model_manager.warmup_error
+        }), 503
+    return jsonify({'status': 'loading'}), 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """以 Prometheus 文本格式导出指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/check', methods=['POST'])
 def check_file():
     """统一的文件检查入口点"""
     temp_handler = TempFileHandler()
     try:
+        # 获取扫描选项
+        try:
+            scan_options = get_scan_options()
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
         # 获取请求中的 path 参数
         path = request.form.get('path')
         
         if path:
             # 处理文件路径
-            abs_path = os.path.abspath(path)
-            app_dir = os.path.abspath(os.path.dirname(__file__))
-            
-            # 安全检查：确保路径不指向程序目录
-            if abs_path.startswith(app_dir):
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Invalid path: cannot access program directory'
-                }), 400
-                
-            # 检查文件是否存在
-            if not os.path.exists(abs_path):
-                return jsonify({
-                    'status': 'error',
-                    'message': 'File not found'
-                }), 404
-                
-            # 检查是否是文件
-            if not os.path.isfile(abs_path):
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Path is not a file'
-                }), 400
-                
-            # 检查文件大小
-            file_size = os.path.getsize(abs_path)
-            if file_size > MAX_FILE_SIZE:
-                return jsonify({
-                    'status': 'error',
-                    'message': 'File too large'
-                }), 400
+            abs_path, error = validate_path(path)
+            if error:
+                return jsonify(error[0]), error[1]
                 
             # 获取原始文件名
             filename = os.path.basename(abs_path)
             
-            # 检测文件类型
-            detected_type = detect_file_type(abs_path)
-            logger.info(f"检测到文件类型: {detected_type}")
-            
             # 处理文件
-            result = process_file_by_type(abs_path, detected_type, filename, temp_handler)
-            return jsonify(result) if isinstance(result, dict) else jsonify(result[0]), result[1] if isinstance(result, tuple) else 200
+            result, status_code = scan_file(abs_path, filename, scan_options, temp_handler, use_index=True)
+            return jsonify(result), status_code
             
         # 文件上传处理逻辑
         elif 'file' not in request.files:
@@ -275,32 +180,349 @@ def check_file():
         filename = secure_filename(file.filename)
         logger.info(f"接收到文件: {filename}")
         
-        temp_file = temp_handler.create_temp_file()
-        file.save(temp_file.name)
+        # 上传内容在接收时已计算摘要并保留文件头（见 upload.UploadSpool）
+        result, status_code = scan_upload(file.stream, filename, scan_options, temp_handler)
+        return jsonify(result), status_code
+
+    except Exception as e:
+        logger.error(f"处理过程发生错误: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+        
+    finally:
+        # 清理所有临时文件
+        temp_handler.cleanup()
+
+@app.route('/check/batch', methods=['POST'])
+def check_batch():
+    """批量检查多个上传文件或本地路径，以 NDJSON 逐行返回每个文件的结果"""
+    try:
+        scan_options = get_scan_options()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    paths = [path for path in request.form.getlist('path') if path]
+    files = [file for file in request.files.getlist('file') if file.filename]
+    if not paths and not files:
+        return jsonify({
+            'status': 'error',
+            'message': 'No file found'
+        }), 400
+    if len(paths) + len(files) > BATCH_MAX_FILES:
+        return jsonify({
+            'status': 'error',
+            'message': f'Too many files in batch (max {BATCH_MAX_FILES})'
+        }), 400
+    
+    temp_handler = TempFileHandler()
+    entries = []  # [(序号, 文件路径, 文件名, 是否使用路径索引)]
+    errors = []  # [(序号, 错误响应, 状态码)]
+    try:
+        for path in paths:
+            index = len(entries) + len(errors)
+            abs_path, error = validate_path(path)
+            if error:
+                errors.append((index, dict(error[0], path=path), error[1]))
+            else:
+                entries.append((index, abs_path, os.path.basename(abs_path), True))
         
-        file_size = os.path.getsize(temp_file.name)
-        if file_size > MAX_FILE_SIZE:
+        for file in files:
+            filename = secure_filename(file.filename)
+            # 流式响应在请求结束后才检查文件，接管接收时写入的临时文件，不再另存一份
+            with metrics.stage_timer('upload_save'):
+                temp_path = file.stream.detach()
+            temp_handler.temp_files.append(temp_path)
+            entries.append((len(entries) + len(errors), temp_path, filename, False))
+        logger.info(f"接收到批量请求: {len(entries)} 个文件")
+    except Exception as e:
+        temp_handler.cleanup()
+        logger.error(f"批量请求处理失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+    
+    def generate():
+        try:
+            for index, result, status_code in errors:
+                yield json.dumps(dict(result, index=index, status_code=status_code)) + '\n'
+            for position, result, status_code in scan_batch([entry[1:] for entry in entries], scan_options):
+                index = entries[position][0]
+                if 'filename' not in result:
+                    result = dict(result, filename=entries[position][2])
+                yield json.dumps(dict(result, index=index, status_code=status_code)) + '\n'
+        finally:
+            temp_handler.cleanup()
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """提交异步检查任务，立即返回任务ID"""
+    try:
+        scan_options = get_scan_options()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    cleanup_path = None
+    try:
+        path = request.form.get('path')
+        
+        if path:
+            abs_path, error = validate_path(path)
+            if error:
+                return jsonify(error[0]), error[1]
+            filename = os.path.basename(abs_path)
+            
+        elif 'file' not in request.files:
             return jsonify({
                 'status': 'error',
-                'message': 'File too large'
+                'message': 'No file found'
             }), 400
+            
+        else:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({
+                    'status': 'error',
+                    'message': 'No file selected'
+                }), 400
+            
+            filename = secure_filename(file.filename)
+            logger.info(f"接收到任务文件: {filename}")
+            
+            # 接管接收时写入的临时文件，由任务执行完毕后删除
+            with metrics.stage_timer('upload_save'):
+                cleanup_path = abs_path = file.stream.detach()
+        
+        # 只有服务器本地路径可以使用路径索引
+        use_index = cleanup_path is None
+        job_id = job_manager.submit(
+            lambda: scan_file(abs_path, filename, use_index=use_index),
+            filename,
+            cleanup_path=cleanup_path,
+            scan_options=scan_options
+        )
+        cleanup_path = None
+        return jsonify({
+            'status': 'queued',
+            'job_id': job_id
+        }), 202
         
-        detected_type = detect_file_type(temp_file.name)
-        logger.info(f"检测到文件类型: {detected_type}")
+    except JobQueueFull as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503
         
-        result = process_file_by_type(temp_file.name, detected_type, filename, temp_handler)
-        return jsonify(result) if isinstance(result, dict) else jsonify(result[0]), result[1] if isinstance(result, tuple) else 200
-
     except Exception as e:
-        logger.error(f"处理过程发生错误: {str(e)}")
+        logger.error(f"提交任务失败: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
         
     finally:
-        # 清理所有临时文件
-        temp_handler.cleanup()
+        # 任务未成功提交时清理上传的临时文件
+        if cleanup_path and os.path.exists(cleanup_path):
+            os.unlink(cleanup_path)
+
+@app.route('/scan', methods=['POST'])
+def scan_directory():
+    """以异步任务递归检查服务器本地目录，结果逐条写入 output 指定的文件
+
+    output 是 DIRECTORY_SCAN_OUTPUT_DIR 下的相对路径（或该目录下的绝对路径），
+    workers 不超过 DIRECTORY_SCAN_WORKERS。
+    """
+    try:
+        scan_options = get_scan_options()
+        workers = request.form.get('workers')
+        workers = int(workers) if workers else None
+        if workers is not None and workers <= 0:
+            raise ValueError(f'Invalid workers: {workers}')
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    if not request.form.get('path') or not request.form.get('output'):
+        return jsonify({
+            'status': 'error',
+            'message': 'Both path and output are required'
+        }), 400
+    root = os.path.abspath(request.form.get('path'))
+    if root.startswith(APP_DIR):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid path: cannot access program directory'
+        }), 400
+    # 结果文件只能写在配置的结果目录下，解析符号链接后再检查前缀
+    output_dir = os.path.realpath(DIRECTORY_SCAN_OUTPUT_DIR)
+    output = os.path.realpath(os.path.join(output_dir, request.form.get('output')))
+    if not output.startswith(output_dir + os.sep):
+        return jsonify({
+            'status': 'error',
+            'message': f'Invalid output: must be inside {DIRECTORY_SCAN_OUTPUT_DIR}'
+        }), 400
+    if not os.path.isdir(root):
+        return jsonify({
+            'status': 'error',
+            'message': 'Path is not a directory'
+        }), 400
+    
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    scanner = DirectoryScanner(
+        root, output,
+        workers=min(workers or DIRECTORY_SCAN_WORKERS, DIRECTORY_SCAN_WORKERS),
+        sniff=request.form.get('sniff') in ('1', 'true'),
+        resume=request.form.get('resume', '1') in ('1', 'true'),
+        scan_options=scan_options
+    )
+    
+    def run_scan():
+        ctx = current_context()
+        scanner.on_progress = lambda stats: ctx.report_progress('files', sum(stats.values()))
+        return dict(scanner.run(), status='success'), 200
+    
+    try:
+        job_id = job_manager.submit(run_scan, root)
+    except JobQueueFull as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503
+    
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id
+    }), 202
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """创建可续传的分块上传会话，之后用 PUT /uploads/<id> 按 Content-Range 上传各分块"""
+    filename = secure_filename(request.form.get('filename', ''))
+    try:
+        size = int(request.form.get('size', ''))
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'size is required'
+        }), 400
+    if not filename:
+        return jsonify({
+            'status': 'error',
+            'message': 'filename is required'
+        }), 400
+    
+    try:
+        return jsonify(dict(upload_sessions.create(filename, size), status='created')), 201
+    except UploadSessionError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), e.status_code
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_session(upload_id):
+    """GET 查询已接收的区间（用于续传），PUT 写入一个分块，DELETE 取消上传"""
+    try:
+        if request.method == 'PUT':
+            start, end, total = parse_content_range(request.headers.get('Content-Range'))
+            session = upload_sessions.write(upload_id, start, end, total, request.stream)
+        elif request.method == 'DELETE':
+            upload_sessions.abort(upload_id)
+            return jsonify({'status': 'aborted', 'upload_id': upload_id})
+        else:
+            session = upload_sessions.status(upload_id)
+        return jsonify(dict(session, status='uploading'))
+    except UploadSessionError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), e.status_code
+
+@app.route('/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    """结束分块上传并检查文件；async=1 时作为异步任务执行并返回任务ID"""
+    try:
+        scan_options = get_scan_options()
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    try:
+        path, filename, preview = upload_sessions.commit(upload_id)
+    except UploadSessionError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), e.status_code
+    
+    try:
+        # 上传期间读取的 ZIP 中央目录已能得出结论时（缓存中已有匹配、超出扫描预算）不再扫描
+        early = upload_sessions.early_result(preview, filename, scan_options)
+        if early is not None:
+            result, status_code = early
+            return jsonify(result), status_code
+        
+        if request.form.get('async') in ('1', 'true'):
+            job_id = job_manager.submit(
+                lambda: scan_file(path, filename),
+                filename,
+                cleanup_path=path,
+                scan_options=scan_options
+            )
+            path = None
+            return jsonify({
+                'status': 'queued',
+                'job_id': job_id
+            }), 202
+        
+        result, status_code = scan_file(path, filename, scan_options)
+        return jsonify(result), status_code
+    
+    except JobQueueFull as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503
+    
+    except Exception as e:
+        logger.error(f"检查分块上传文件失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+    
+    finally:
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步任务的状态、进度和结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job not found'
+        }), 404
+    return jsonify(job)
 
 if __name__ == '__main__':
+    # 后台加载并预热模型，端口无需等待模型加载即可开始监听
+    model_manager.start_warmup()
+    # 配置了 WATCH_DIRS 时在后台监控目录
+    start_configured_watcher()
     app.run(host='0.0.0.0', port=3333)
\ No newline at end of file
@@ -0,0 +1,265 @@
+# cache.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import logging
+from metrics import CACHE_LOOKUPS
+from config import (
+    MEMBER_CACHE_ENABLED, MEMBER_CACHE_PATH, MEMBER_CACHE_MAX_ENTRIES,
+    SCAN_INDEX_ENABLED, SCAN_INDEX_PATH, SCAN_INDEX_MAX_ENTRIES,
+    UPLOAD_CACHE_ENABLED, UPLOAD_CACHE_PATH, UPLOAD_CACHE_MAX_ENTRIES
+)
+import config
+
+logger = logging.getLogger(__name__)
+
+# 会改变检测结果的配置项：模型与阈值、视频抽帧、级联预筛、PDF 页面预判、
+# 优化的推理路径（bf16 等会改变得分）和文档图片过滤
+VERDICT_SETTINGS = (
+    'MODEL_NAME', 'NSFW_THRESHOLD', 'FFMPEG_MAX_FRAMES',
+    'PREFILTER_ENABLED', 'PREFILTER_MIN_SIDE', 'PREFILTER_MIN_STDDEV', 'PREFILTER_MIN_SKIN_RATIO',
+    'PREFILTER_MODEL', 'PREFILTER_MODEL_THRESHOLD',
+    'PDF_PAGE_TRIAGE', 'PDF_TRIAGE_DPI', 'PDF_TRIAGE_MAX_CHROMA', 'PDF_TRIAGE_BLANK_STDDEV',
+    'TORCH_OPTIMIZE', 'TORCH_COMPILE', 'TORCH_BF16',
+    'DOCUMENT_MIN_IMAGE_BYTES', 'DOCUMENT_MIN_IMAGE_SIDE', 'ZIP_MEDIA_DOCUMENT_DIRS'
+)
+
+def verdict_fingerprint():
+    """生成影响检测结果的模型与配置指纹，指纹变化后旧缓存自动失效"""
+    settings = {name: getattr(config, name) for name in VERDICT_SETTINGS}
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{config.MODEL_NAME}|{digest}"
+
+class _SqliteLruCache:
+    """以 SQLite 保存、按 last_used 淘汰的检查结果缓存
+
+    子类只需定义表名、列定义、日志名称、指标标签、开关和默认的路径与容量，
+    并基于 _lookup/_store 实现按各自的键读写。所有记录都带有 verdict_fingerprint，
+    模型或影响结果的配置变化后旧记录自动失效。
+    """
+    table = None
+    columns = None  # CREATE TABLE 的列定义和主键（不含 last_used）
+    label = None  # 日志中使用的名称
+    metric = None  # CACHE_LOOKUPS 的 cache 标签
+    enabled_setting = 0
+    default_path = None
+    default_max_entries = 0
+
+    @classmethod
+    def get_instance(cls):
+        # 每个子类各自一个实例
+        if cls.__dict__.get('_instance') is None:
+            cls._instance = cls(cls.default_path, cls.default_max_entries)
+        return cls._instance
+
+    def __init__(self, db_path, max_entries):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.fingerprint = verdict_fingerprint()
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self._conn = None
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ({self.columns})')
+            self._conn.execute(
+                f'CREATE INDEX IF NOT EXISTS idx_{self.table}_last_used ON {self.table} (last_used)'
+            )
+            self._conn.commit()
+            logger.info(f"{self.label}初始化完成: {db_path}")
+        except Exception as e:
+            logger.error(f"{self.label}初始化失败: {str(e)}")
+            self._conn = None
+
+    @property
+    def enabled(self):
+        return bool(self.enabled_setting) and self._conn is not None
+
+    def _lookup(self, select, where, params):
+        """查询一条当前指纹下的记录并更新其 last_used，未命中或出错时返回 None"""
+        if not self.enabled:
+            return None
+        condition = f'{where} AND fingerprint = ?'
+        params = (*params, self.fingerprint)
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    f'SELECT {select} FROM {self.table} WHERE {condition}', params
+                ).fetchone()
+                if row is None:
+                    CACHE_LOOKUPS.inc(cache=self.metric, result='miss')
+                    return None
+                self._conn.execute(
+                    f'UPDATE {self.table} SET last_used = ? WHERE {condition}', (time.time(), *params)
+                )
+                self._conn.commit()
+            CACHE_LOOKUPS.inc(cache=self.metric, result='hit')
+            return row
+        except Exception as e:
+            logger.error(f"查询{self.label}失败: {str(e)}")
+            return None
+
+    def _store(self, values):
+        """写入一条记录（fingerprint 和 last_used 自动填充），超过容量时淘汰最久未使用的记录"""
+        if not self.enabled:
+            return
+        names = ', '.join([*values, 'fingerprint', 'last_used'])
+        placeholders = ', '.join('?' * (len(values) + 2))
+        try:
+            with self._lock:
+                self._conn.execute(
+                    f'INSERT OR REPLACE INTO {self.table} ({names}) VALUES ({placeholders})',
+                    (*values.values(), self.fingerprint, time.time())
+                )
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= 100:
+                    self._trim()
+                    self._puts_since_trim = 0
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"写入{self.label}失败: {str(e)}")
+
+    def _trim(self):
+        """删除超出容量上限的旧记录（调用方需持有锁）"""
+        count = self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                f'DELETE FROM {self.table} WHERE rowid IN ('
+                f'SELECT rowid FROM {self.table} ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+            logger.info(f"{self.label}淘汰 {excess} 条记录")
+
+class MemberVerdictCache(_SqliteLruCache):
+    """压缩包成员检测结果缓存
+
+    以压缩包头部记录的 (CRC32, 解压后大小, 扩展名) 为键。头部记录可以伪造，
+    MEMBER_CACHE_VERIFY 开启时（默认）调用方在命中后解压成员校验实际 CRC，只省去推理；
+    关闭时命中即直接返回已有结果，无需解压。
+    """
+    table = 'member_verdicts'
+    columns = (
+        'crc INTEGER, size INTEGER, ext TEXT, fingerprint TEXT, '
+        'nsfw REAL, normal REAL, last_used REAL, '
+        'PRIMARY KEY (crc, size, ext, fingerprint)'
+    )
+    label = '成员缓存'
+    metric = 'member'
+    enabled_setting = MEMBER_CACHE_ENABLED
+    default_path = MEMBER_CACHE_PATH
+    default_max_entries = MEMBER_CACHE_MAX_ENTRIES
+
+    def get(self, key, ext):
+        """按 (crc, size) 和扩展名查询缓存结果，未命中返回 None"""
+        if key is None:
+            return None
+        crc, size = key
+        row = self._lookup('nsfw, normal', 'crc = ? AND size = ? AND ext = ?', (crc, size, ext))
+        return None if row is None else {'nsfw': row[0], 'normal': row[1]}
+
+    def peek(self, entries):
+        """批量查询 [((crc, size), 扩展名)] 的缓存结果，返回等长列表，未命中为 None
+
+        只读查询，不更新 last_used，也不计入缓存命中指标，用于上传预览等非检测场景。
+        """
+        if not self.enabled or not entries:
+            return [None] * len(entries)
+        crcs = sorted({key[0] for key, _ in entries if key is not None})
+        found = {}
+        try:
+            with self._lock:
+                # SQLite 默认最多 999 个参数，分批查询
+                for offset in range(0, len(crcs), 500):
+                    batch = crcs[offset:offset + 500]
+                    rows = self._conn.execute(
+                        'SELECT crc, size, ext, nsfw, normal FROM member_verdicts '
+                        f'WHERE fingerprint = ? AND crc IN ({", ".join("?" * len(batch))})',
+                        (self.fingerprint, *batch)
+                    ).fetchall()
+                    for crc, size, ext, nsfw, normal in rows:
+                        found[(crc, size, ext)] = {'nsfw': nsfw, 'normal': normal}
+        except Exception as e:
+            logger.error(f"查询成员缓存失败: {str(e)}")
+            return [None] * len(entries)
+        return [found.get((key[0], key[1], ext)) if key is not None else None for key, ext in entries]
+
+    def put(self, key, ext, result):
+        """写入成员检测结果，超过容量时淘汰最久未使用的记录"""
+        if key is None or not result:
+            return
+        crc, size = key
+        self._store({
+            'crc': crc, 'size': size, 'ext': ext,
+            'nsfw': float(result['nsfw']), 'normal': float(result['normal'])
+        })
+
+class PathScanIndex(_SqliteLruCache):
+    """本地路径检查结果索引
+
+    以文件的 (设备号, inode, 大小, mtime_ns) 为键保存上次的检查结果，
+    文件未变化时直接返回，无需读取文件内容。
+    """
+    table = 'path_verdicts'
+    columns = (
+        'dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, fingerprint TEXT, '
+        'response TEXT, last_used REAL, '
+        'PRIMARY KEY (dev, inode)'
+    )
+    label = '路径索引'
+    metric = 'path'
+    enabled_setting = SCAN_INDEX_ENABLED
+    default_path = SCAN_INDEX_PATH
+    default_max_entries = SCAN_INDEX_MAX_ENTRIES
+
+    def get(self, stat):
+        """按 os.stat 结果查询上次的响应内容，文件变化或未命中时返回 None"""
+        row = self._lookup(
+            'response', 'dev = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        )
+        return None if row is None else json.loads(row[0])
+
+    def put(self, stat, response):
+        """保存文件的检查结果，同一 inode 的旧记录被替换"""
+        self._store({
+            'dev': stat.st_dev, 'inode': stat.st_ino, 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'response': json.dumps(response)
+        })
+
+class ContentVerdictIndex(_SqliteLruCache):
+    """上传文件检查结果索引
+
+    以接收上传时计算的 SHA-256 为键保存检查结果，重复上传的文件无需落盘和处理。
+    """
+    table = 'content_verdicts'
+    columns = (
+        'digest TEXT, fingerprint TEXT, response TEXT, last_used REAL, '
+        'PRIMARY KEY (digest, fingerprint)'
+    )
+    label = '上传结果索引'
+    metric = 'content'
+    enabled_setting = UPLOAD_CACHE_ENABLED
+    default_path = UPLOAD_CACHE_PATH
+    default_max_entries = UPLOAD_CACHE_MAX_ENTRIES
+
+    def get(self, digest):
+        """按内容摘要查询上次的响应内容，未命中时返回 None"""
+        row = self._lookup('response', 'digest = ?', (digest,))
+        return None if row is None else json.loads(row[0])
+
+    def put(self, digest, response):
+        """保存上传文件的检查结果"""
+        self._store({'digest': digest, 'response': json.dumps(response)})
+
+# 初始化成员缓存实例
+member_cache = MemberVerdictCache.get_instance()
+
+# 初始化路径索引实例
+path_index = PathScanIndex.get_instance()
+
+# 初始化上传结果索引实例
+content_index = ContentVerdictIndex.get_instance()
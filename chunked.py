@@ -0,0 +1,453 @@
+# chunked.py
+import json
+import os
+import sqlite3
+import struct
+import subprocess
+import threading
+import time
+import uuid
+import zipfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from cache import member_cache
+from context import ScanBudget
+from detector import detect_header_type, resolve_extension
+from profiling import run_subprocess
+from config import (
+    MAX_FILE_SIZE, VIDEO_EXTENSIONS, ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_TOTAL_BYTES,
+    UPLOAD_SESSION_DIR, UPLOAD_SESSION_TTL, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_MAX_COUNT,
+    UPLOAD_SESSION_MAX_BYTES, NSFW_THRESHOLD, SCAN_MODE
+)
+
+logger = logging.getLogger(__name__)
+
+# 类型检测和视频头部探测所需的文件头长度
+SNIFF_BYTES = 2048
+VIDEO_HEAD_BYTES = 4 * 1024 * 1024
+# ZIP 结束记录（22 字节）加最长 64KB 注释
+ZIP_EOCD_SEARCH = 22 + 65535
+# 清理过期会话的最小间隔（秒）
+PURGE_INTERVAL = 60
+
+class UploadSessionError(Exception):
+    """分块上传请求无效，status_code 为返回给客户端的状态码"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def add_range(ranges, start, end):
+    """把 [start, end) 合并进已排序的区间列表"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+def covers(ranges, start, end):
+    """区间列表是否完整覆盖 [start, end)"""
+    return any(range_start <= start and range_end >= end for range_start, range_end in ranges)
+
+def parse_content_range(header):
+    """解析 'bytes start-end/total'，返回 (start, end, total)，end 不含"""
+    try:
+        unit, spec = header.split(' ', 1)
+        span, total = spec.split('/', 1)
+        start, end = span.split('-', 1)
+        start, end, total = int(start), int(end) + 1, int(total)
+    except (AttributeError, ValueError):
+        raise UploadSessionError('Invalid Content-Range header')
+    if unit != 'bytes' or start < 0 or end <= start:
+        raise UploadSessionError('Invalid Content-Range header')
+    return start, end, total
+
+class UploadSessionManager:
+    """可续传的分块上传会话
+
+    创建会话时按声明的大小预分配数据文件，各分块按偏移写入，已接收的区间保存在
+    SQLite 中，网络中断或服务重启后客户端查询会话即可只补传缺失的部分。
+    数据到达后提前执行能开始的检查：文件头到达时检测类型（不支持的类型立即拒绝，
+    不再继续传输）；视频头部到达时探测视频信息、ZIP 尾部到达时读取中央目录，这两项
+    在后台线程中执行，不阻塞分块上传请求。提交时使用中央目录的结果：超出扫描预算的
+    ZIP 直接返回，成员缓存中已有匹配结果时不再扫描。
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = UploadSessionManager(UPLOAD_SESSION_DIR)
+        return cls._instance
+
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        os.makedirs(session_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(session_dir, 'sessions.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS upload_sessions ('
+            'id TEXT PRIMARY KEY, filename TEXT, size INTEGER, path TEXT, '
+            'ranges TEXT, preview TEXT, created_at REAL, updated_at REAL)'
+        )
+        self._conn.commit()
+        self._last_purge = 0.0
+        # 后台提前检查：同一会话同时只有一个检查在执行，执行期间有新数据到达时再执行一次
+        self._checks = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-check')
+        self._checks_pending = set()
+        self._checks_rerun = set()
+        logger.info(f"分块上传会话管理器初始化完成: {session_dir}")
+
+    def _load(self, upload_id):
+        row = self._conn.execute(
+            'SELECT id, filename, size, path, ranges, preview, created_at, updated_at '
+            'FROM upload_sessions WHERE id = ?',
+            (upload_id,)
+        ).fetchone()
+        if row is None:
+            raise UploadSessionError('Upload session not found', 404)
+        return {
+            'upload_id': row[0],
+            'filename': row[1],
+            'size': row[2],
+            'path': row[3],
+            'ranges': json.loads(row[4]),
+            'preview': json.loads(row[5]),
+            'created_at': row[6],
+            'updated_at': row[7]
+        }
+
+    def _save(self, session):
+        self._conn.execute(
+            'UPDATE upload_sessions SET ranges = ?, preview = ?, updated_at = ? WHERE id = ?',
+            (json.dumps(session['ranges']), json.dumps(session['preview']), time.time(), session['upload_id'])
+        )
+        self._conn.commit()
+
+    def _purge_expired(self):
+        """删除超过 UPLOAD_SESSION_TTL 未更新的会话及其数据文件（调用方需持有锁）"""
+        expired = self._conn.execute(
+            'SELECT id, path FROM upload_sessions WHERE updated_at < ?',
+            (time.time() - UPLOAD_SESSION_TTL,)
+        ).fetchall()
+        for upload_id, path in expired:
+            self._remove(upload_id, path)
+        if expired:
+            logger.info(f"清理过期上传会话 {len(expired)} 个")
+
+    def _maybe_purge(self):
+        """距离上次清理超过 PURGE_INTERVAL 时清理过期会话（调用方需持有锁）
+
+        在创建、查询和写入会话时调用，废弃会话的预分配文件不必等到下次创建会话才删除。
+        """
+        if time.time() - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = time.time()
+            self._purge_expired()
+
+    def _remove(self, upload_id, path):
+        self._conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+        self._conn.commit()
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+    def create(self, filename, size):
+        """创建上传会话并预分配数据文件
+
+        会话数超过 UPLOAD_SESSION_MAX_COUNT 时返回 429，所有会话预留的字节数超过
+        UPLOAD_SESSION_MAX_BYTES 时返回 507。
+        """
+        if size <= 0:
+            raise UploadSessionError('Upload size must be positive')
+        if size > MAX_FILE_SIZE:
+            raise UploadSessionError('File too large', 413)
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.session_dir, f'{upload_id}.part')
+        now = time.time()
+        # 先在锁内检查配额并登记会话，并发创建时不会同时超出配额
+        with self._lock:
+            self._maybe_purge()
+            count, reserved = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM upload_sessions'
+            ).fetchone()
+            if count >= UPLOAD_SESSION_MAX_COUNT:
+                raise UploadSessionError('Too many upload sessions', 429)
+            if reserved + size > UPLOAD_SESSION_MAX_BYTES:
+                raise UploadSessionError('Upload storage quota exceeded', 507)
+            self._conn.execute(
+                'INSERT INTO upload_sessions (id, filename, size, path, ranges, preview, created_at, updated_at) '
+                "VALUES (?, ?, ?, ?, '[]', '{}', ?, ?)",
+                (upload_id, filename, size, path, now, now)
+            )
+            self._conn.commit()
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except (AttributeError, OSError):
+                    # 文件系统不支持预分配时退化为稀疏文件
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            with self._lock:
+                self._remove(upload_id, path)
+            raise UploadSessionError(f'Failed to allocate upload file: {str(e)}', 507)
+        logger.info(f"创建上传会话: {upload_id} ({filename}, {size} 字节)")
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """返回会话状态：已接收区间、缺失字节数和提前检查的结果"""
+        with self._lock:
+            self._maybe_purge()
+            session = self._load(upload_id)
+        received = sum(end - start for start, end in session['ranges'])
+        return {
+            'upload_id': session['upload_id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'received': session['ranges'],
+            'missing_bytes': session['size'] - received,
+            'complete': received == session['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'preview': session['preview']
+        }
+
+    def write(self, upload_id, start, end, total, stream):
+        """把 [start, end) 范围的数据从 stream 写入数据文件
+
+        客户端中途断开时只记录实际写入的部分，续传时只需补传剩余数据。
+        """
+        with self._lock:
+            self._maybe_purge()
+            session = self._load(upload_id)
+        if total != session['size'] or end > session['size']:
+            raise UploadSessionError('Content-Range does not match the upload size', 416)
+        if session['preview'].get('rejected'):
+            raise UploadSessionError(session['preview']['rejected'], 415)
+
+        written = 0
+        fd = os.open(session['path'], os.O_WRONLY)
+        try:
+            while start + written < end:
+                chunk = stream.read(min(1024 * 1024, end - start - written))
+                if not chunk:
+                    break
+                os.pwrite(fd, chunk, start + written)
+                written += len(chunk)
+        finally:
+            os.close(fd)
+            if written:
+                with self._lock:
+                    session = self._load(upload_id)
+                    session['ranges'] = add_range(session['ranges'], start, start + written)
+                    self._save(session)
+
+        if start + written < end:
+            raise UploadSessionError(f'Incomplete chunk: received {written} of {end - start} bytes')
+        self._sniff_type(upload_id)
+        self._schedule_checks(upload_id)
+        return self.status(upload_id)
+
+    def _update_preview(self, upload_id, updates):
+        """合并提前检查的结果，不覆盖其他检查同时写入的字段"""
+        with self._lock:
+            session = self._load(upload_id)
+            session['preview'].update(updates)
+            self._save(session)
+
+    def _sniff_type(self, upload_id):
+        """文件头到达后检测类型，不支持的类型立即拒绝；只读取文件头，在请求线程中执行"""
+        with self._lock:
+            session = self._load(upload_id)
+        if 'type' in session['preview'] or not covers(session['ranges'], 0, min(SNIFF_BYTES, session['size'])):
+            return
+        with open(session['path'], 'rb') as f:
+            detected_type = detect_header_type(f.read(SNIFF_BYTES))
+        ext = resolve_extension(detected_type, session['filename'])
+        updates = {'type': detected_type[0], 'ext': ext}
+        if not ext:
+            updates['rejected'] = f'Unsupported file type: {detected_type[0]}'
+            logger.info(f"上传会话 {upload_id} 类型不受支持，停止接收: {detected_type[0]}")
+        self._update_preview(upload_id, updates)
+
+    def _schedule_checks(self, upload_id):
+        """把视频探测和 ZIP 中央目录读取交给后台线程"""
+        with self._lock:
+            if upload_id in self._checks_pending:
+                self._checks_rerun.add(upload_id)
+                return
+            self._checks_pending.add(upload_id)
+        self._checks.submit(self._check_worker, upload_id)
+
+    def _check_worker(self, upload_id):
+        while True:
+            try:
+                self._run_early_checks(upload_id)
+            except UploadSessionError:
+                # 会话已提交或取消
+                pass
+            except Exception as e:
+                logger.error(f"上传会话 {upload_id} 提前检查失败: {str(e)}")
+            with self._lock:
+                if upload_id in self._checks_rerun:
+                    self._checks_rerun.discard(upload_id)
+                    continue
+                self._checks_pending.discard(upload_id)
+                return
+
+    def _run_early_checks(self, upload_id):
+        """执行尚未完成的视频探测和 ZIP 中央目录读取，结果写入会话的 preview"""
+        with self._lock:
+            session = self._load(upload_id)
+        preview = session['preview']
+        ranges, size, path = session['ranges'], session['size'], session['path']
+        if preview.get('rejected'):
+            return
+        updates = {}
+
+        # 文件头尚未到达时按文件名的扩展名提前检查
+        ext = preview.get('ext', os.path.splitext(session['filename'])[1].lower())
+        if ext in VIDEO_EXTENSIONS and 'video' not in preview and covers(ranges, 0, min(VIDEO_HEAD_BYTES, size)):
+            updates['video'] = self._probe_video(path)
+
+        if ext == '.zip' and 'archive' not in preview:
+            archive = self._read_zip_directory(path, ranges, size)
+            if archive is not None:
+                updates['archive'] = archive
+
+        if updates:
+            self._update_preview(upload_id, updates)
+
+    def _probe_video(self, path):
+        """视频头部到达后用 ffprobe 读取时长和流信息；moov 在文件末尾时头部探测会失败"""
+        try:
+            result = run_subprocess(
+                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration:stream=codec_type,width,height',
+                 '-of', 'json', path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=10
+            )
+            info = json.loads(result.stdout or b'{}')
+        except Exception as e:
+            logger.warning(f"视频头部探测失败: {str(e)}")
+            return {'probed': False}
+        video_streams = [stream for stream in info.get('streams', []) if stream.get('codec_type') == 'video']
+        if not video_streams:
+            return {'probed': False}
+        duration = info.get('format', {}).get('duration')
+        return {
+            'probed': True,
+            'duration': float(duration) if duration else None,
+            'width': video_streams[0].get('width'),
+            'height': video_streams[0].get('height')
+        }
+
+    def _read_zip_directory(self, path, ranges, size):
+        """ZIP 尾部到达后读取中央目录：成员数、解压后总大小和成员缓存命中数
+
+        中央目录尚未完整到达时返回 None，下次写入后重试。
+        """
+        tail_start = max(0, size - ZIP_EOCD_SEARCH)
+        if not covers(ranges, tail_start, size):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(tail_start)
+            tail = f.read()
+        eocd = tail.rfind(b'PK\x05\x06')
+        if eocd >= 0 and len(tail) - eocd >= 22:
+            cd_offset = struct.unpack('<I', tail[eocd + 16:eocd + 20])[0]
+            # ZIP64 的中央目录偏移不在结束记录中，直接尝试读取
+            if cd_offset != 0xFFFFFFFF and not covers(ranges, cd_offset, size):
+                return None
+        try:
+            with zipfile.ZipFile(path) as archive:
+                infos = [info for info in archive.infolist() if not info.is_dir()]
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            # 中央目录可能尚未完整到达，文件接收完整后仍无法读取才视为损坏
+            if not covers(ranges, 0, size):
+                return None
+            logger.warning(f"读取ZIP中央目录失败: {str(e)}")
+            return {'readable': False}
+        total_bytes = sum(info.file_size for info in infos)
+        # 只读查询，不更新 LRU 时间和缓存命中指标
+        cached = member_cache.peek(
+            [((info.CRC, info.file_size), os.path.splitext(info.filename)[1].lower()) for info in infos]
+        )
+        hits = [(info.filename, result) for info, result in zip(infos, cached) if result is not None]
+        summary = {
+            'readable': True,
+            'members': len(infos),
+            'uncompressed_bytes': total_bytes,
+            'cached_members': len(hits),
+            'exceeds_budget': len(infos) > ARCHIVE_MAX_MEMBERS or total_bytes > ARCHIVE_MAX_TOTAL_BYTES
+        }
+        # 得分最高的缓存结果，提交时超过阈值即可直接返回匹配
+        if hits:
+            name, result = max(hits, key=lambda hit: hit[1]['nsfw'])
+            summary['top_cached'] = {'file': name, 'result': result}
+        return summary
+
+    def early_result(self, preview, filename, scan_options=None):
+        """根据提前检查的结果决定提交时能否不扫描直接返回，返回 (响应内容, 状态码) 或 None
+
+        - 成员缓存中已有超过阈值的结果：直接返回匹配（头部 CRC 伪造只会让上传者自己的
+          文件被判为匹配，不需要解压校验）
+        - 全量扫描时中央目录记录的成员数或解压大小超出扫描预算：不再解压，直接返回
+        """
+        archive = (preview or {}).get('archive') or {}
+        if not archive.get('readable'):
+            return None
+        scan_options = scan_options or {}
+        threshold = scan_options.get('threshold')
+        threshold = NSFW_THRESHOLD if threshold is None else threshold
+        top = archive.get('top_cached')
+        if top and top['result']['nsfw'] > threshold:
+            logger.info(f"上传的压缩包命中成员缓存匹配结果: {top['file']}")
+            return {
+                'status': 'success',
+                'filename': filename,
+                'result': top['result'],
+                'cached': True
+            }, 200
+        if (scan_options.get('scan_mode') or SCAN_MODE) == 'full':
+            budget = ScanBudget(max_members=scan_options.get('max_members'))
+            exceeded = []
+            if archive['members'] > budget.max_members:
+                exceeded.append('members')
+            if archive['uncompressed_bytes'] > budget.max_bytes:
+                exceeded.append('decompressed_bytes')
+            if exceeded:
+                return {
+                    'status': 'error',
+                    'message': 'Archive exceeds the scan budget',
+                    'filename': filename,
+                    'budget_exceeded': exceeded
+                }, 413
+        return None
+
+    def commit(self, upload_id):
+        """结束上传，返回 (数据文件路径, 文件名, 提前检查结果)；数据文件的所有权转交给调用方"""
+        with self._lock:
+            session = self._load(upload_id)
+            if session['preview'].get('rejected'):
+                raise UploadSessionError(session['preview']['rejected'], 415)
+            if not covers(session['ranges'], 0, session['size']):
+                raise UploadSessionError('Upload is incomplete', 409)
+            self._conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+            self._conn.commit()
+        logger.info(f"上传会话已提交: {upload_id}")
+        return session['path'], session['filename'], session['preview']
+
+    def abort(self, upload_id):
+        """取消上传并删除已接收的数据"""
+        with self._lock:
+            session = self._load(upload_id)
+            self._remove(upload_id, session['path'])
+        logger.info(f"上传会话已取消: {upload_id}")
+
+# 初始化分块上传会话管理器实例
+upload_sessions = UploadSessionManager.get_instance()
@@ -100,6 +100,12 @@ MIME_TO_EXT = {
     # 文档格式 (新增)
     'application/msword': '.doc',
     'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+    'application/vnd.oasis.opendocument.text': '.odt',
+    'application/vnd.oasis.opendocument.spreadsheet': '.ods',
+    'application/vnd.oasis.opendocument.presentation': '.odp',
+    'application/epub+zip': '.epub',
     
     # 视频和容器格式
     'video/mp4': '.mp4',
@@ -155,19 +161,36 @@ ARCHIVE_EXTENSIONS = {'.7z', '.rar', '.zip', '.gz', '.tar', '.bz2', '.xz',
                      '.lzma', '.zst', '.cab'}
 
 # 添加新的文档扩展名集合
-DOCUMENT_EXTENSIONS = {'.doc', '.docx'}
+DOCUMENT_EXTENSIONS = {'.doc', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub'}
+
+# 基于 ZIP 容器、图片直接存放在容器中的文档格式，及其图片所在目录
+ZIP_MEDIA_DOCUMENT_DIRS = {
+    '.docx': ('word/media/',),
+    '.xlsx': ('xl/media/',),
+    '.pptx': ('ppt/media/',),
+    '.odt': ('Pictures/',),
+    '.ods': ('Pictures/',),
+    '.odp': ('Pictures/',),
+    '.epub': ('',),  # EPUB 图片位置不固定，扫描整个容器
+}
 
 # 添加新的 MIME 类型集合
 DOCUMENT_MIME_TYPES = {
     'application/msword',
-    'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+    'application/vnd.oasis.opendocument.presentation',
+    'application/epub+zip'
 }
 
 # MIME 类型集合
 IMAGE_MIME_TYPES = {mime for mime, ext in MIME_TO_EXT.items() if mime.startswith('image/')}
 VIDEO_MIME_TYPES = {mime for mime, ext in MIME_TO_EXT.items() if mime.startswith('video/')}
 ARCHIVE_MIME_TYPES = {mime for mime, ext in MIME_TO_EXT.items() if 
-    mime.startswith('application/') and 
+    mime.startswith('application/') and mime not in DOCUMENT_MIME_TYPES and 
     any(keyword in mime for keyword in ['zip', 'rar', '7z', 'gzip', 'tar', 
         'bzip2', 'xz', 'lzma', 'zstd', 'cab'])}
 PDF_MIME_TYPES = {'application/pdf'}
@@ -183,6 +206,120 @@ FFMPEG_TIMEOUT = 1800
 CHECK_ALL_FILES = 0
 MAX_INTERVAL_SECONDS = 30
 
+# 压缩包成员检测结果缓存
+MEMBER_CACHE_ENABLED = 1
+MEMBER_CACHE_PATH = '/tmp/nsfw_member_cache.db'
+MEMBER_CACHE_MAX_ENTRIES = 100000
+# 命中成员缓存前解压成员并校验 CRC32 和大小（只省去推理）；设为 0 时直接信任压缩包头部，
+# 伪造头部 CRC 的成员可以冒用已缓存的正常结果
+MEMBER_CACHE_VERIFY = 1
+
+# 本地路径检查结果索引（文件 stat 未变化时直接返回上次结果）
+SCAN_INDEX_ENABLED = 1
+SCAN_INDEX_PATH = '/tmp/nsfw_scan_index.db'
+SCAN_INDEX_MAX_ENTRIES = 1000000
+
+# 流式接收上传：接收时计算 SHA-256 并保留文件头，小文件只保存在内存中
+UPLOAD_MEMORY_LIMIT = 8 * 1024 * 1024  # 请求体不超过此大小时上传文件不落盘
+UPLOAD_CACHE_ENABLED = 1  # 按内容摘要缓存上传文件的检查结果
+UPLOAD_CACHE_PATH = '/tmp/nsfw_upload_cache.db'
+UPLOAD_CACHE_MAX_ENTRIES = 1000000
+
+# 可续传的分块上传
+UPLOAD_SESSION_DIR = '/tmp/nsfw_upload_sessions'  # 预分配的数据文件和会话记录
+UPLOAD_SESSION_TTL = 24 * 3600  # 超过此秒数未更新的会话被删除
+UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024  # 建议客户端使用的分块大小
+UPLOAD_SESSION_MAX_COUNT = 100  # 同时存在的上传会话数，超过时返回 429
+UPLOAD_SESSION_MAX_BYTES = 50 * 1024 * 1024 * 1024  # 所有会话预留的总字节数，超过时返回 507
+
+# 单次请求的解压资源预算
+ARCHIVE_MAX_TOTAL_BYTES = 20 * 1024 * 1024 * 1024  # 解压总字节数
+ARCHIVE_MAX_MEMBERS = 10000  # 处理的成员总数
+ARCHIVE_MAX_DEPTH = 20  # 嵌套压缩包最大深度
+SCAN_MAX_SECONDS = 3600  # 单次请求最长耗时
+
+# 不超过此大小的 ZIP/GZ 嵌套压缩包直接在内存中处理
+NESTED_ARCHIVE_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# 压缩包成员调度：路径关键词及近期命中目录对命中概率的加权
+SCHEDULER_HINT_KEYWORDS = 'nsfw,porn,xxx,nude,sex,hentai,r18,18+'
+SCHEDULER_HINT_BOOST = 3.0
+SCHEDULER_HIT_DIR_BOOST = 2.0
+
+# 压缩包抽样扫描（按请求参数 scan_mode=sample 开启）
+SCAN_MODE = 'full'
+SAMPLE_BUDGET = 500  # 每个压缩包最多抽样检测的成员数
+SAMPLE_MIN_MEMBERS = 50  # 至少检测多少个成员后才允许提前停止
+SAMPLE_MAX_PREVALENCE = 0.01  # 95% 置信度下匹配比例上界低于此值时停止
+SAMPLE_SUSPICIOUS_SCORE = 0.3  # 抽样得分处于 [此值, NSFW_THRESHOLD] 时对所在目录全量扫描
+
+# 批量推理每批图片数
+INFERENCE_BATCH_SIZE = 8
+INFERENCE_BATCH_WAIT_MS = 5  # 跨请求合并批次时最多等待的毫秒数
+
+# 文档内图片过滤：小于此字节数或边长的图片（图标、项目符号等）不检测
+DOCUMENT_MIN_IMAGE_BYTES = 2048
+DOCUMENT_MIN_IMAGE_SIDE = 32
+
+# 异步任务
+JOB_DB_PATH = '/tmp/nsfw_jobs.db'
+JOB_WORKERS = 2
+JOB_QUEUE_SIZE = 100
+JOB_RETENTION_SECONDS = 86400  # 已完成任务的保留时间
+
+# 批量检测接口
+BATCH_WORKERS = 4  # 单个批量请求内并发处理的文件数
+BATCH_MAX_FILES = 1000  # 单个批量请求最多包含的文件数
+
+# 目录扫描
+DIRECTORY_SCAN_WORKERS = 4  # 并发检查的文件数，也是 /scan 接口 workers 参数的上限
+DIRECTORY_SCAN_OUTPUT_DIR = '/tmp/nsfw_scan_results'  # /scan 接口的结果文件只能写在此目录下
+
+# 目录监控（inotify），多个目录用逗号分隔，为空时不启用
+WATCH_DIRS = ''
+WATCH_OUTPUT = '/tmp/nsfw_watch_results.jsonl'  # JSONL/SQLite 文件或 http(s) Webhook 地址
+WATCH_DEBOUNCE_SECONDS = 2.0  # 文件停止写入多少秒后才检查
+WATCH_WORKERS = 2
+
+# 模型名称
+MODEL_NAME = 'Falconsai/nsfw_image_detection'
+
+# 本地模型快照：权重以内存映射方式加载，多进程共享页缓存，冷启动和模型重置更快
+MODEL_SNAPSHOT_ENABLED = 1
+MODEL_SNAPSHOT_DIR = '/tmp/nsfw_model_snapshot'
+
+# 推理线程调度：0 表示根据 cgroup CPU 配额和物理核心数自动计算
+INFERENCE_SLOTS = 0  # 同时执行推理的槽位数
+INFERENCE_THREADS = 0  # 每个槽位的 intra-op 线程数
+INFERENCE_PIN_CPUS = 0  # 设为 1 时把各槽位的推理线程绑定到互不重叠的物理核心
+
+# PyTorch 优化推理路径：inference_mode + channels_last，可选 torch.compile 和 bf16 autocast
+TORCH_OPTIMIZE = 0
+TORCH_COMPILE = 1  # 启动时按各批次大小编译并预热
+TORCH_BF16 = 'auto'  # auto 表示仅在 CPU 支持 AVX512-BF16/AMX 时使用
+TORCH_PARITY_TOLERANCE = 0.02  # 与默认管道的得分误差超过此值时不启用
+
+# 级联预筛：用图片统计量（可选小模型）把明显正常的图片直接判为正常，不经过 ViT
+PREFILTER_ENABLED = 1
+PREFILTER_MIN_SIDE = 32  # 边长小于此值的图片（图标等）
+PREFILTER_MIN_STDDEV = 4.0  # 缩略图灰度标准差小于此值的图片（空白页、纯色帧）
+PREFILTER_MIN_SKIN_RATIO = 0  # 彩色图片肤色像素比例低于此值时判为正常，0 表示不使用
+PREFILTER_MODEL = ''  # 可选的小型蒸馏模型名称，留空表示不使用
+PREFILTER_MODEL_THRESHOLD = 0.01  # 小模型 NSFW 得分低于此值时判为正常
+
+# PDF 页面预判：不含位图且几乎没有颜色的页面（纯文字、空白页）不渲染检测
+PDF_PAGE_TRIAGE = 1
+PDF_TRIAGE_DPI = 24  # 低分辨率预览的 DPI
+PDF_TRIAGE_CHUNK_PAGES = 20  # 每次预览的页数
+PDF_TRIAGE_MAX_CHROMA = 4.0  # 平均色度偏移低于此值的页面视为纯文字页
+PDF_TRIAGE_BLANK_STDDEV = 2.0  # 灰度标准差低于此值的页面视为空白页
+
+# 服务质量通道：图片和小文档走 fast 通道，视频、压缩包和大文件走 heavy 通道
+LANE_FAST_WORKERS = 8  # fast 通道同时处理的文件数
+LANE_HEAVY_WORKERS = 2  # heavy 通道同时处理的文件数
+LANE_FAST_MAX_BYTES = 20 * 1024 * 1024  # 超过此大小的文件走 heavy 通道
+LANE_FAST_INFERENCE_SHARE = 0.8  # 两个通道都有待推理图片时 fast 通道所占的推理份额
+
 # 从文件加载配置并更新全局变量
 file_config = load_config_from_file()
 
@@ -196,5 +333,28 @@ __all__ = [
     'IMAGE_MIME_TYPES', 'VIDEO_MIME_TYPES', 'ARCHIVE_MIME_TYPES', 'PDF_MIME_TYPES',
     'DOCUMENT_MIME_TYPES',  # 新增
     'SUPPORTED_MIME_TYPES', 'MAX_FILE_SIZE', 'NSFW_THRESHOLD', 'FFMPEG_MAX_FRAMES', 
-    'FFMPEG_TIMEOUT', 'CHECK_ALL_FILES', 'MAX_INTERVAL_SECONDS'
+    'FFMPEG_TIMEOUT', 'CHECK_ALL_FILES', 'MAX_INTERVAL_SECONDS',
+    'MEMBER_CACHE_ENABLED', 'MEMBER_CACHE_PATH', 'MEMBER_CACHE_MAX_ENTRIES', 'MEMBER_CACHE_VERIFY',
+    'MODEL_NAME',
+    'ARCHIVE_MAX_TOTAL_BYTES', 'ARCHIVE_MAX_MEMBERS', 'ARCHIVE_MAX_DEPTH', 'SCAN_MAX_SECONDS',
+    'NESTED_ARCHIVE_MEMORY_LIMIT', 'SCHEDULER_HINT_KEYWORDS', 'SCHEDULER_HINT_BOOST',
+    'SCHEDULER_HIT_DIR_BOOST', 'SCAN_MODE', 'SAMPLE_BUDGET', 'SAMPLE_MIN_MEMBERS',
+    'SAMPLE_MAX_PREVALENCE', 'SAMPLE_SUSPICIOUS_SCORE', 'ZIP_MEDIA_DOCUMENT_DIRS',
+    'INFERENCE_BATCH_SIZE', 'DOCUMENT_MIN_IMAGE_BYTES', 'DOCUMENT_MIN_IMAGE_SIDE',
+    'JOB_DB_PATH', 'JOB_WORKERS', 'JOB_QUEUE_SIZE', 'JOB_RETENTION_SECONDS',
+    'INFERENCE_BATCH_WAIT_MS', 'BATCH_WORKERS', 'BATCH_MAX_FILES', 'DIRECTORY_SCAN_WORKERS',
+    'DIRECTORY_SCAN_OUTPUT_DIR',
+    'SCAN_INDEX_ENABLED', 'SCAN_INDEX_PATH', 'SCAN_INDEX_MAX_ENTRIES',
+    'UPLOAD_MEMORY_LIMIT', 'UPLOAD_CACHE_ENABLED', 'UPLOAD_CACHE_PATH', 'UPLOAD_CACHE_MAX_ENTRIES',
+    'UPLOAD_SESSION_DIR', 'UPLOAD_SESSION_TTL', 'UPLOAD_CHUNK_SIZE', 'UPLOAD_SESSION_MAX_COUNT',
+    'UPLOAD_SESSION_MAX_BYTES',
+    'WATCH_DIRS', 'WATCH_OUTPUT', 'WATCH_DEBOUNCE_SECONDS', 'WATCH_WORKERS',
+    'MODEL_SNAPSHOT_ENABLED', 'MODEL_SNAPSHOT_DIR',
+    'INFERENCE_SLOTS', 'INFERENCE_THREADS', 'INFERENCE_PIN_CPUS',
+    'TORCH_OPTIMIZE', 'TORCH_COMPILE', 'TORCH_BF16', 'TORCH_PARITY_TOLERANCE',
+    'PREFILTER_ENABLED', 'PREFILTER_MIN_SIDE', 'PREFILTER_MIN_STDDEV', 'PREFILTER_MIN_SKIN_RATIO',
+    'PREFILTER_MODEL', 'PREFILTER_MODEL_THRESHOLD',
+    'PDF_PAGE_TRIAGE', 'PDF_TRIAGE_DPI', 'PDF_TRIAGE_CHUNK_PAGES', 'PDF_TRIAGE_MAX_CHROMA',
+    'PDF_TRIAGE_BLANK_STDDEV',
+    'LANE_FAST_WORKERS', 'LANE_HEAVY_WORKERS', 'LANE_FAST_MAX_BYTES', 'LANE_FAST_INFERENCE_SHARE'
 ]
\ No newline at end of file
@@ -0,0 +1,204 @@
+# context.py
+import contextvars
+import logging
+import math
+import time
+from contextlib import contextmanager
+from profiling import ScanProfile
+from config import (
+    ARCHIVE_MAX_TOTAL_BYTES, ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_DEPTH, SCAN_MAX_SECONDS,
+    SCAN_MODE, SAMPLE_BUDGET, FFMPEG_MAX_FRAMES, NSFW_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+class BudgetExceeded(Exception):
+    """单次请求的资源预算耗尽"""
+    def __init__(self, budget_name, message):
+        super().__init__(message)
+        self.budget_name = budget_name
+
+# 可按请求指定的扫描预算和阈值，指定任一项时结果不读写路径索引和上传结果索引
+RESULT_OPTIONS = ('max_frames', 'max_pages', 'max_members', 'max_seconds', 'threshold')
+
+def _within(requested, limit):
+    """按请求指定的预算只能收紧服务端配置的上限，无效值（非正数、nan、inf）使用上限"""
+    if requested is None or not math.isfinite(requested) or requested <= 0:
+        return limit
+    return min(requested, limit)
+
+class ScanBudget:
+    """单次请求的资源预算：解压总字节数、成员数、嵌套深度、总耗时、视频帧数和 PDF 页数
+
+    按请求指定的预算不超过服务端配置的 ARCHIVE_MAX_*、SCAN_MAX_SECONDS 和 FFMPEG_MAX_FRAMES。
+    """
+    def __init__(self, max_bytes=None, max_members=None, max_depth=None, max_seconds=None,
+                 max_frames=None, max_pages=None):
+        self.max_bytes = _within(max_bytes, ARCHIVE_MAX_TOTAL_BYTES)
+        self.max_members = _within(max_members, ARCHIVE_MAX_MEMBERS)
+        self.max_depth = _within(max_depth, ARCHIVE_MAX_DEPTH)
+        self.max_seconds = _within(max_seconds, SCAN_MAX_SECONDS)
+        self.max_frames = _within(max_frames, FFMPEG_MAX_FRAMES)
+        self.max_pages = max_pages  # None 表示不限制
+        self.started = time.monotonic()
+        self.decompressed_bytes = 0
+        self.members = 0
+        self.exceeded = None  # 记录首个耗尽的全局预算名称，之后整个扫描停止
+        self.truncated = []  # 所有导致扫描不完整的预算名称
+        self.truncations = 0  # 预算截断的次数，同一预算多次截断时也递增，用于判断某段处理是否完整
+
+    def record_truncation(self, budget_name, message):
+        """记录只截断当前文件、不停止整个扫描的预算（视频帧数、PDF 页数）"""
+        self.truncations += 1
+        if budget_name not in self.truncated:
+            self.truncated.append(budget_name)
+            logger.warning(f"扫描预算耗尽: {message}")
+
+    def _exceed(self, budget_name, message, stop=True):
+        self.record_truncation(budget_name, message)
+        if stop and self.exceeded is None:
+            self.exceeded = budget_name
+        raise BudgetExceeded(budget_name, message)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining_bytes(self):
+        return max(0, self.max_bytes - self.decompressed_bytes)
+
+    def remaining_seconds(self):
+        return max(0.0, self.max_seconds - self.elapsed())
+
+    def timeout(self, default):
+        """返回不超过剩余时间预算的子进程超时时间"""
+        return max(1, min(default, self.remaining_seconds()))
+
+    def consume_bytes(self, count):
+        """记录解压出的字节数，超出预算时抛出 BudgetExceeded"""
+        self.decompressed_bytes += count
+        if self.decompressed_bytes > self.max_bytes:
+            self._exceed('decompressed_bytes',
+                         f'Decompressed size limit ({self.max_bytes} bytes) exceeded')
+
+    def consume_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            self._exceed('members', f'Archive member limit ({self.max_members}) exceeded')
+
+    def check_depth(self, depth):
+        """嵌套过深只跳过当前分支，不影响同级成员的扫描"""
+        if depth > self.max_depth:
+            self._exceed('depth', f'Maximum archive nesting depth ({self.max_depth}) exceeded', stop=False)
+
+    def check_time(self):
+        if self.elapsed() > self.max_seconds:
+            self._exceed('wall_time', f'Scan time limit ({self.max_seconds}s) exceeded')
+
+class ScanContext:
+    """单次扫描请求的上下文，在调用链中通过 contextvars 传递"""
+    def __init__(self, budget=None, scan_mode=None, sample_budget=None, profile=False,
+                 max_frames=None, max_pages=None, max_members=None, max_seconds=None, threshold=None):
+        self.budget = budget or ScanBudget(
+            max_members=max_members, max_seconds=max_seconds, max_frames=max_frames, max_pages=max_pages
+        )
+        self.threshold = NSFW_THRESHOLD if threshold is None or not 0 <= threshold <= 1 else threshold
+        # 按请求指定了预算或阈值，结果与默认配置下的结果不可互换
+        self.custom_limits = any(
+            value is not None for value in (max_frames, max_pages, max_members, max_seconds, threshold)
+        )
+        self.scan_mode = scan_mode or SCAN_MODE  # 'full' 全量扫描，'sample' 抽样扫描
+        self.sample_budget = sample_budget or SAMPLE_BUDGET
+        self.scan_info = None  # 抽样扫描的统计信息，会返回给调用方
+        self.skipped = {}  # 预判后未检测的内容 {单位: 数量}，如空白页和纯文字页
+        self.progress = {}  # 扫描进度 {单位: {'done': 已完成数, 'total': 总数}}
+        self.on_progress = None  # 进度更新回调，异步任务用于持久化进度
+        self.profile = ScanProfile() if profile else None  # 耗时树，profile=1 时返回给调用方
+
+    @property
+    def sampling(self):
+        return self.scan_mode == 'sample'
+
+    def report_progress(self, unit, done, total=None):
+        """记录扫描进度，unit 为 'frames'、'pages' 或 'members'"""
+        entry = {'done': done}
+        if total is not None:
+            entry['total'] = total
+        self.progress[unit] = entry
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self.progress)
+            except Exception as e:
+                logger.error(f"更新扫描进度失败: {str(e)}")
+
+    def record_skipped(self, unit, count=1):
+        """记录预判后跳过检测的内容，unit 如 'pages'"""
+        self.skipped[unit] = self.skipped.get(unit, 0) + count
+
+    def record_sampling(self, members_total, members_scanned, escalated_dirs, stopped_early):
+        """累计各层压缩包的抽样统计"""
+        if self.scan_info is None:
+            self.scan_info = {
+                'mode': 'sampled',
+                'members_total': 0,
+                'members_scanned': 0,
+                'escalated_dirs': 0,
+                'stopped_early': False
+            }
+        self.scan_info['members_total'] += members_total
+        self.scan_info['members_scanned'] += members_scanned
+        self.scan_info['escalated_dirs'] += escalated_dirs
+        self.scan_info['stopped_early'] = self.scan_info['stopped_early'] or stopped_early
+
+    def annotate(self, response):
+        """在响应中标记因预算耗尽而不完整的扫描及抽样信息，支持 dict 或 (dict, 状态码)"""
+        body = response[0] if isinstance(response, tuple) else response
+        if not isinstance(body, dict):
+            return response
+        if self.budget.truncated:
+            body['partial'] = True
+            body['budget_exceeded'] = list(self.budget.truncated)
+        if self.scan_info:
+            body['scan'] = dict(self.scan_info)
+        if self.skipped:
+            body['skipped'] = dict(self.skipped)
+        if self.profile is not None:
+            body['profile'] = self.profile.to_dict()
+        return response
+
+_current_context = contextvars.ContextVar('scan_context', default=None)
+
+def has_custom_limits(scan_options=None):
+    """当前上下文（或将要使用的扫描选项）是否按请求指定了预算或阈值"""
+    ctx = _current_context.get()
+    if ctx is not None:
+        return ctx.custom_limits
+    return any((scan_options or {}).get(name) is not None for name in RESULT_OPTIONS)
+
+def is_profiling(scan_options=None):
+    """当前上下文（或将要使用的扫描选项）是否需要返回耗时树"""
+    ctx = _current_context.get()
+    if ctx is not None:
+        return ctx.profile is not None
+    return bool((scan_options or {}).get('profile'))
+
+def current_context():
+    """返回当前请求的扫描上下文，不在请求中时返回一个临时上下文"""
+    ctx = _current_context.get()
+    return ctx if ctx is not None else ScanContext()
+
+@contextmanager
+def scan_context(**kwargs):
+    """进入扫描上下文，已处于上下文中时复用外层上下文"""
+    ctx = _current_context.get()
+    if ctx is not None:
+        yield ctx
+        return
+    ctx = ScanContext(**kwargs)
+    token = _current_context.set(ctx)
+    profile_token = ctx.profile.activate() if ctx.profile is not None else None
+    try:
+        yield ctx
+    finally:
+        if profile_token is not None:
+            ctx.profile.deactivate(profile_token)
+        _current_context.reset(token)
@@ -0,0 +1,409 @@
+# detector.py
+import tempfile
+import io
+import os
+import shutil
+import logging
+import magic
+import gc
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import (
+    BATCH_WORKERS, MAX_FILE_SIZE, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, MIME_TO_EXT, DOCUMENT_EXTENSIONS,
+    ARCHIVE_EXTENSIONS
+)
+from context import scan_context, has_custom_limits, is_profiling
+from cache import path_index, content_index
+from metrics import FILES, FILE_SECONDS
+from profiling import span, stage
+from scheduler import member_scheduler
+from lanes import lane_scheduler, route_lane
+from processors import (
+    process_image, process_pdf_file, process_video_file, 
+    process_archive, process_doc_file, process_office_file
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 程序所在目录，本地路径检查时禁止访问
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TempFileHandler:
+    """临时文件管理器"""
+    def __init__(self):
+        self.temp_files = []
+        self.temp_dirs = []
+        
+    def create_temp_file(self, suffix=None):
+        """创建临时文件"""
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.temp_files.append(temp_file.name)
+        return temp_file
+        
+    def create_temp_dir(self):
+        """创建临时目录"""
+        temp_dir = tempfile.mkdtemp()
+        self.temp_dirs.append(temp_dir)
+        return temp_dir
+        
+    def cleanup(self):
+        """清理所有临时文件和目录"""
+        # 清理文件
+        for file_path in self.temp_files:
+            try:
+                if os.path.exists(file_path):
+                    os.unlink(file_path)
+            except Exception as e:
+                logger.error(f"清理临时文件失败 {file_path}: {str(e)}")
+        self.temp_files.clear()
+        
+        # 清理目录
+        for dir_path in self.temp_dirs:
+            try:
+                if os.path.exists(dir_path):
+                    shutil.rmtree(dir_path)
+            except Exception as e:
+                logger.error(f"清理临时目录失败 {dir_path}: {str(e)}")
+        self.temp_dirs.clear()
+        
+        # 强制垃圾回收
+        gc.collect()
+
+# libmagic 句柄不能跨线程共享，每个线程复用自己的句柄
+_magic_local = threading.local()
+
+def _get_magic():
+    mime = getattr(_magic_local, 'mime', None)
+    if mime is None:
+        mime = _magic_local.mime = magic.Magic(mime=True)
+    return mime
+
+def detect_file_type(file_path):
+    """检测文件类型，使用文件的前2048字节"""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(2048)
+        return detect_header_type(header)
+    except Exception as e:
+        logger.error(f"文件类型检测失败: {str(e)}")
+        raise
+
+def detect_header_type(header):
+    """根据文件头检测文件类型，返回 (MIME 类型, 扩展名)"""
+    with stage('mime_detect'):
+        mime_type = _get_magic().from_buffer(header)
+    
+    # 对于RAR文件的特殊处理
+    if mime_type not in MIME_TO_EXT and header.startswith(b'Rar!\x1a\x07'):
+        return 'application/x-rar', '.rar'
+    
+    return mime_type, MIME_TO_EXT.get(mime_type)
+
+def get_type_label(detected_type, filename):
+    """返回用于指标统计的文件类别"""
+    ext = detected_type[1]
+    original_ext = os.path.splitext(filename or '')[1].lower()
+    for candidate in (original_ext, ext):
+        if candidate in IMAGE_EXTENSIONS:
+            return 'image'
+        if candidate == '.pdf':
+            return 'pdf'
+        if candidate in VIDEO_EXTENSIONS:
+            return 'video'
+        if candidate in ARCHIVE_EXTENSIONS:
+            return 'archive'
+        if candidate in DOCUMENT_EXTENSIONS:
+            return 'document'
+    return 'unsupported'
+
+def process_file_by_type(file_path, detected_type, original_filename, temp_handler, size=None, content=None):
+    """根据文件类型选择处理方法，并记录单文件处理耗时供成员调度器估计各类型吞吐
+
+    content 不为 None 时为内存中的图片内容（流式接收的小图片），file_path 可为 None。
+    """
+    started = time.monotonic()
+    result = _process_file_by_type(file_path, detected_type, original_filename, temp_handler, content)
+    if not isinstance(result, tuple):
+        if size is None:
+            size = os.path.getsize(file_path)
+        member_scheduler.record_cost(original_filename or '', size, time.monotonic() - started)
+    return result
+
+def resolve_extension(detected_type, original_filename):
+    """返回用于选择处理方法的扩展名，原始文件名的扩展名受支持时优先使用"""
+    ext = detected_type[1]
+    if original_filename and '.' in original_filename:
+        original_ext = os.path.splitext(original_filename)[1].lower()
+        if original_ext in IMAGE_EXTENSIONS or original_ext == '.pdf' or \
+           original_ext in VIDEO_EXTENSIONS or original_ext in {'.rar', '.zip', '.7z', '.gz'} or \
+           original_ext in DOCUMENT_EXTENSIONS:
+            ext = original_ext
+    return ext
+
+def _process_file_by_type(file_path, detected_type, original_filename, temp_handler, content=None):
+    mime_type = detected_type[0]
+    ext = resolve_extension(detected_type, original_filename)
+    
+    if not ext:
+        logger.error(f"不支持的文件类型: {mime_type}")
+        return {
+            'status': 'error',
+            'message': f'Unsupported file type: {mime_type}'
+        }, 400
+    
+    try:
+        if ext in IMAGE_EXTENSIONS:
+            with (io.BytesIO(content) if content is not None else open(file_path, 'rb')) as f:
+                from PIL import Image
+                # 使用with语句确保Image对象正确关闭
+                with Image.open(f) as image:
+                    with stage('decode'):
+                        image.load()
+                    result = process_image(image)
+                    # 处理完图片后强制垃圾回收
+                    gc.collect()
+                    return {
+                        'status': 'success',
+                        'filename': original_filename,
+                        'result': result
+                    }
+                
+        elif ext == '.pdf':
+            # 直接使用磁盘上的文件，避免读入内存后再写一次临时文件
+            result = process_pdf_file(file_path)
+            # 处理完PDF后强制垃圾回收
+            gc.collect()
+            if result:
+                return {
+                    'status': 'success',
+                    'filename': original_filename,
+                    'result': result
+                }
+            return {
+                'status': 'error',
+                'message': 'No processable content found in PDF'
+            }, 400
+                
+        elif ext in VIDEO_EXTENSIONS:
+            result = process_video_file(file_path)
+            # 处理完视频后强制垃圾回收
+            gc.collect()
+            if result:
+                return {
+                    'status': 'success',
+                    'filename': original_filename,
+                    'result': result
+                }
+            return {
+                'status': 'error',
+                'message': 'No processable content found in video'
+            }, 400
+                
+        elif ext in {'.zip', '.rar', '.7z', '.gz'}:
+            result = process_archive(file_path, original_filename)
+            # 处理完压缩包后强制垃圾回收
+            gc.collect()
+            return result
+            
+        elif ext in DOCUMENT_EXTENSIONS:
+            if ext == '.doc':
+                with open(file_path, 'rb') as f:
+                    result = process_doc_file(f.read())
+            else:  # docx/xlsx/pptx/odt/ods/odp/epub 直接从 ZIP 容器读取图片
+                result = process_office_file(file_path, ext)
+            
+            # 处理完文档后强制垃圾回收
+            gc.collect()
+                
+            if result:
+                return {
+                    'status': 'success',
+                    'filename': original_filename,
+                    'result': result
+                }
+            return {
+                'status': 'error',
+                'message': 'No processable content found in document'
+            }, 400
+            
+        else:
+            logger.error(f"不支持的文件扩展名: {ext}")
+            return {
+                'status': 'error',
+                'message': f'Unsupported file extension: {ext}'
+            }, 400
+            
+    except Exception as e:
+        logger.error(f"处理文件时出错: {str(e)}")
+        return {
+            'status': 'error',
+            'message': str(e)
+        }, 500
+    
+def validate_path(path):
+    """检查服务器本地文件路径
+
+    Returns:
+        (绝对路径, None)，路径无效时返回 (None, (错误响应, 状态码))
+    """
+    abs_path = os.path.abspath(path)
+    
+    # 安全检查：确保路径不指向程序目录
+    if abs_path.startswith(APP_DIR):
+        return None, ({
+            'status': 'error',
+            'message': 'Invalid path: cannot access program directory'
+        }, 400)
+        
+    # 检查文件是否存在
+    if not os.path.exists(abs_path):
+        return None, ({
+            'status': 'error',
+            'message': 'File not found'
+        }, 404)
+        
+    # 检查是否是文件
+    if not os.path.isfile(abs_path):
+        return None, ({
+            'status': 'error',
+            'message': 'Path is not a file'
+        }, 400)
+    
+    return abs_path, None
+
+def scan_file(file_path, filename, scan_options=None, temp_handler=None, use_index=False):
+    """检查单个文件：大小检查、类型检测和按类型处理
+
+    use_index 为 True 时（服务器本地路径），文件的 stat 与路径索引中的记录一致则直接
+    返回上次的结果；上传的临时文件会复用 inode，不能使用索引。
+
+    Returns:
+        (响应内容, HTTP 状态码)
+    """
+    temp_handler = temp_handler or TempFileHandler()
+    
+    # 检查文件大小
+    stat = os.stat(file_path)
+    if stat.st_size > MAX_FILE_SIZE:
+        return {
+            'status': 'error',
+            'message': 'File too large'
+        }, 400
+    
+    # 按请求指定了预算或阈值时，结果与默认配置下的结果不可互换，不使用索引；
+    # profile=1 时需要返回本次扫描的耗时树，同样不使用索引
+    use_index = use_index and not has_custom_limits(scan_options) and not is_profiling(scan_options)
+    
+    # 文件未变化时直接返回索引中的结果
+    if use_index:
+        cached = path_index.get(stat)
+        if cached is not None:
+            logger.info(f"命中路径索引: {file_path}")
+            FILES.inc(type='cached', status=200)
+            return dict(cached, filename=filename, cached=True), 200
+    
+    result, status_code = _scan(file_path, stat.st_size, filename, scan_options, temp_handler)
+    
+    # 只保存完整扫描的结果，抽样或预算耗尽的结果不能代表整个文件
+    if use_index and _is_complete(result, status_code):
+        path_index.put(stat, result)
+    return result, status_code
+
+def scan_upload(upload, filename, scan_options=None, temp_handler=None):
+    """检查流式接收的上传文件（upload.UploadSpool）
+
+    接收时已计算内容摘要和保留文件头：摘要命中上传结果索引时直接返回，不落盘也不处理；
+    类型检测使用接收时保留的文件头；仍在内存中的图片直接解码，其他文件最多写入一次磁盘。
+
+    Returns:
+        (响应内容, HTTP 状态码)
+    """
+    temp_handler = temp_handler or TempFileHandler()
+    
+    if upload.size > MAX_FILE_SIZE:
+        return {
+            'status': 'error',
+            'message': 'File too large'
+        }, 400
+    
+    use_index = not has_custom_limits(scan_options) and not is_profiling(scan_options)
+    cached = content_index.get(upload.digest) if use_index else None
+    if cached is not None:
+        logger.info(f"命中上传结果索引: {filename}")
+        FILES.inc(type='cached', status=200)
+        return dict(cached, filename=filename, cached=True), 200
+    
+    detected_type = detect_header_type(upload.header)
+    if upload.in_memory and resolve_extension(detected_type, filename) in IMAGE_EXTENSIONS:
+        file_path, content = None, upload.getvalue()
+    else:
+        with stage('upload_save'):
+            file_path, content = upload.spill(), None
+    
+    result, status_code = _scan(file_path, upload.size, filename, scan_options, temp_handler, detected_type, content)
+    if use_index and _is_complete(result, status_code):
+        content_index.put(upload.digest, result)
+    return result, status_code
+
+def _is_complete(result, status_code):
+    """抽样或预算耗尽的结果不能代表整个文件，带耗时树的结果只属于本次请求，都不写入索引"""
+    return status_code == 200 and not any(key in result for key in ('partial', 'scan', 'profile'))
+
+def _scan(file_path, size, filename, scan_options, temp_handler, detected_type=None, content=None):
+    started = time.perf_counter()
+    
+    with scan_context(**(scan_options or {})) as ctx:
+        # 检测文件类型
+        if detected_type is None:
+            detected_type = detect_file_type(file_path)
+        logger.info(f"检测到文件类型: {detected_type}")
+        type_label = get_type_label(detected_type, filename)
+        
+        # 按类别和大小进入 fast/heavy 通道，heavy 通道排队时不影响 fast 通道
+        lane = route_lane(type_label, size)
+        with lane_scheduler.slot(lane):
+            # 处理文件
+            with span('process', type=type_label, size=size, lane=lane):
+                result = process_file_by_type(file_path, detected_type, filename, temp_handler, size, content)
+        result = ctx.annotate(result)
+    FILE_SECONDS.observe(time.perf_counter() - started, type=type_label)
+    FILES.inc(type=type_label, status=result[1] if isinstance(result, tuple) else 200)
+    if isinstance(result, tuple):
+        return result
+    return result, 200
+
+def scan_batch(entries, scan_options=None):
+    """并发检查多个文件，按完成顺序逐个返回结果
+
+    Args:
+        entries: [(文件路径, 文件名, 是否使用路径索引)] 列表
+        scan_options: 每个文件使用的扫描选项
+
+    Yields:
+        (序号, 响应内容, HTTP 状态码)
+    """
+    def scan_entry(file_path, filename, use_index):
+        try:
+            return scan_file(file_path, filename, scan_options, use_index=use_index)
+        except Exception as e:
+            logger.error(f"批量检查文件 {filename} 失败: {str(e)}")
+            return {
+                'status': 'error',
+                'message': str(e)
+            }, 500
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(entries)))) as executor:
+        futures = {
+            executor.submit(scan_entry, *entry): index
+            for index, entry in enumerate(entries)
+        }
+        try:
+            for future in as_completed(futures):
+                result, status_code = future.result()
+                yield futures[future], result, status_code
+        finally:
+            # 调用方提前结束（如客户端断开）时取消尚未开始的文件
+            for future in futures:
+                future.cancel()
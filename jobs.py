@@ -0,0 +1,168 @@
+# jobs.py
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from config import JOB_DB_PATH, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RETENTION_SECONDS
+from context import scan_context
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+class JobManager:
+    """异步扫描任务管理器
+
+    任务进入有界队列，由固定数量的工作线程执行；任务状态、进度和结果持久化在
+    SQLite 任务表中，请求结束或服务重启后仍可查询。
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = JobManager(JOB_DB_PATH, JOB_WORKERS, JOB_QUEUE_SIZE)
+        return cls._instance
+
+    def __init__(self, db_path, workers, queue_size):
+        self.db_path = db_path
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT, filename TEXT, '
+            'created_at REAL, started_at REAL, finished_at REAL, '
+            'progress TEXT, result TEXT, status_code INTEGER)'
+        )
+        # 上次运行中未完成的任务无法恢复（上传的临时文件可能已不存在）
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, status_code = 500, result = ? "
+            "WHERE status IN ('queued', 'running')",
+            (time.time(), json.dumps({'status': 'error', 'message': 'Job interrupted by service restart'}))
+        )
+        self._conn.commit()
+        logger.info(f"任务管理器初始化完成: {db_path}, 工作线程 {workers} 个")
+
+    def start(self):
+        """启动工作线程（重复调用无副作用）"""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, func, filename, cleanup_path=None, scan_options=None):
+        """提交任务，返回任务ID；队列已满时抛出 JobQueueFull
+
+        Args:
+            func: 在扫描上下文中执行的函数，返回 (响应内容, 状态码)
+            filename: 任务对应的文件名，仅用于展示
+            cleanup_path: 任务结束后需要删除的临时文件
+            scan_options: 传给扫描上下文的选项
+        """
+        self.start()
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, status, filename, created_at, progress) VALUES (?, 'queued', ?, ?, '{}')",
+            (job_id, filename, time.time())
+        )
+        try:
+            self._queue.put_nowait((job_id, func, cleanup_path, scan_options or {}))
+        except queue.Full:
+            self._execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            raise JobQueueFull('Job queue is full')
+        logger.info(f"任务已提交: {job_id} ({filename})")
+        return job_id
+
+    def get(self, job_id):
+        """查询任务状态，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, status, filename, created_at, started_at, finished_at, '
+                'progress, result, status_code FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            'job_id': row[0],
+            'status': row[1],
+            'filename': row[2],
+            'created_at': row[3],
+            'started_at': row[4],
+            'finished_at': row[5],
+            'progress': json.loads(row[6] or '{}'),
+        }
+        if row[7] is not None:
+            job['result'] = json.loads(row[7])
+            job['status_code'] = row[8]
+        return job
+
+    def _purge_expired(self):
+        self._execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - JOB_RETENTION_SECONDS,)
+        )
+
+    def _worker(self):
+        while True:
+            job_id, func, cleanup_path, scan_options = self._queue.get()
+            try:
+                self._run(job_id, func, scan_options)
+            finally:
+                if cleanup_path and os.path.exists(cleanup_path):
+                    try:
+                        os.unlink(cleanup_path)
+                    except Exception as e:
+                        logger.error(f"清理任务临时文件失败 {cleanup_path}: {str(e)}")
+                self._queue.task_done()
+
+    def _run(self, job_id, func, scan_options):
+        self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+        last_saved = [0.0]
+
+        def save_progress(progress):
+            # 进度每秒最多写入一次
+            now = time.monotonic()
+            if now - last_saved[0] >= 1.0:
+                last_saved[0] = now
+                self._execute('UPDATE jobs SET progress = ? WHERE id = ?', (json.dumps(progress), job_id))
+
+        try:
+            with scan_context(**scan_options) as ctx:
+                ctx.on_progress = save_progress
+                result, status_code = func()
+                progress = ctx.progress
+            status = 'done' if status_code < 500 else 'failed'
+        except Exception as e:
+            logger.error(f"任务 {job_id} 执行失败: {str(e)}")
+            result, status_code, status, progress = {'status': 'error', 'message': str(e)}, 500, 'failed', {}
+
+        self._execute(
+            'UPDATE jobs SET status = ?, finished_at = ?, progress = ?, result = ?, status_code = ? WHERE id = ?',
+            (status, time.time(), json.dumps(progress), json.dumps(result), status_code, job_id)
+        )
+        logger.info(f"任务完成: {job_id}, 状态: {status}")
+
+# 初始化任务管理器实例
+job_manager = JobManager.get_instance()
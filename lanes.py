@@ -0,0 +1,91 @@
+# lanes.py
+import contextvars
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from metrics import register_queue, LANE_WAIT_SECONDS
+from config import LANE_FAST_WORKERS, LANE_HEAVY_WORKERS, LANE_FAST_MAX_BYTES, LANE_FAST_INFERENCE_SHARE
+
+logger = logging.getLogger(__name__)
+
+LANES = ('fast', 'heavy')
+
+# 当前扫描所在的通道，推理批处理器据此分配推理份额
+_current_lane = contextvars.ContextVar('lane', default='fast')
+
+def current_lane():
+    return _current_lane.get()
+
+def route_lane(type_label, size):
+    """按检测到的文件类别和大小选择通道
+
+    视频和压缩包以及超过 LANE_FAST_MAX_BYTES 的文件走 heavy 通道，
+    单张图片和较小的 PDF、文档走 fast 通道。
+    """
+    if type_label in ('video', 'archive') or size > LANE_FAST_MAX_BYTES:
+        return 'heavy'
+    return 'fast'
+
+def inference_shares():
+    """各通道的推理份额，两个通道都有待推理图片时按此比例分配"""
+    share = min(max(float(LANE_FAST_INFERENCE_SHARE), 0.01), 0.99)
+    return {'fast': share, 'heavy': 1.0 - share}
+
+class Lane:
+    """一个服务质量通道：限制同时处理的文件数，超出时排队等待"""
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """占用通道中的一个处理位置，期间 current_lane() 返回本通道"""
+        started = time.perf_counter()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.active >= self.workers:
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.active += 1
+        LANE_WAIT_SECONDS.observe(time.perf_counter() - started, lane=self.name)
+        token = _current_lane.set(self.name)
+        try:
+            yield self
+        finally:
+            _current_lane.reset(token)
+            with self._cond:
+                self.active -= 1
+                self._cond.notify()
+
+class LaneScheduler:
+    """按通道调度文件检查，heavy 通道排满时 fast 通道的请求不受影响"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = LaneScheduler({'fast': LANE_FAST_WORKERS, 'heavy': LANE_HEAVY_WORKERS})
+        return cls._instance
+
+    def __init__(self, workers):
+        self.lanes = {name: Lane(name, workers[name]) for name in LANES}
+
+    def slot(self, lane):
+        return self.lanes[lane].slot()
+
+    def status(self):
+        return {
+            name: {'workers': lane.workers, 'active': lane.active, 'waiting': lane.waiting}
+            for name, lane in self.lanes.items()
+        }
+
+# 初始化通道调度器实例
+lane_scheduler = LaneScheduler.get_instance()
+for _name, _lane in lane_scheduler.lanes.items():
+    register_queue(f'lane_{_name}', lambda lane=_lane: lane.waiting)
@@ -0,0 +1,220 @@
+# metrics.py
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 默认的耗时分桶（秒），覆盖从单张图片推理到长视频处理的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class _Metric:
+    """指标基类，按标签值分别保存数据"""
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, key, extra, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [('_total', key, None, value) for key, value in sorted(self._values.items())]
+
+class Gauge(_Metric):
+    """数值指标；设置了 callback 时在导出时调用它获取 {标签值元组: 数值}"""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback):
+        self.callback = callback
+
+    def _samples(self):
+        values = {}
+        with self._lock:
+            values.update(self._values)
+        if self.callback is not None:
+            try:
+                values.update(self.callback())
+            except Exception as e:
+                logger.error(f"采集指标 {self.name} 失败: {str(e)}")
+        return [('', key, None, value) for key, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时（秒），代码块抛出异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', key, ('le', _format_value(bound)), cumulative))
+                samples.append(('_sum', key, None, total))
+                samples.append(('_count', key, None, count))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """以 Prometheus 文本格式导出所有指标"""
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+REGISTRY = Registry()
+
+def _process_rss():
+    """读取 /proc/self/statm 中的常驻内存页数"""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return {(): pages * os.sysconf('SC_PAGE_SIZE')}
+
+# 请求
+REQUESTS = Counter('nsfw_http_requests', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+REQUEST_SECONDS = Histogram('nsfw_http_request_duration_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+FILES = Counter('nsfw_files_scanned', 'Files checked by detected type and status code', ['type', 'status'])
+FILE_SECONDS = Histogram('nsfw_file_scan_duration_seconds', 'Time to check one file by detected type', ['type'])
+
+# 各处理阶段耗时
+STAGE_SECONDS = Histogram(
+    'nsfw_stage_duration_seconds',
+    'Time spent per processing stage (upload_save, mime_detect, decode, inference, ffmpeg, ffprobe, '
+    'pdftoppm, archive_extract)',
+    ['stage']
+)
+
+# 推理
+BATCH_SIZES = Histogram(
+    'nsfw_inference_batch_size', 'Images per model invocation', [],
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+INFERENCE_IMAGES = Counter('nsfw_inference_images', 'Images classified by the model')
+PREFILTER_IMAGES = Counter(
+    'nsfw_cascade_images', 'Images by cascade stage (stats, model, vit) and outcome', ['stage', 'outcome']
+)
+PDF_PAGES = Counter('nsfw_pdf_pages', 'PDF pages by triage outcome (rendered, blank, text)', ['outcome'])
+MODEL_RECYCLES = Counter('nsfw_model_recycles', 'Times the model pipeline was recreated')
+INFERENCE_PLAN = Gauge(
+    'nsfw_inference_plan', 'CPU plan chosen at startup (effective_cpus, inference_slots, intra_op_threads, inter_op_threads)',
+    ['setting']
+)
+
+# 队列与缓存
+LANE_WAIT_SECONDS = Histogram('nsfw_lane_wait_seconds', 'Time a file waited for a slot in its QoS lane', ['lane'])
+QUEUE_DEPTH = Gauge('nsfw_queue_depth', 'Items waiting in internal queues', ['queue'])
+CACHE_LOOKUPS = Counter('nsfw_cache_lookups', 'Verdict cache lookups by cache and result', ['cache', 'result'])
+
+# 进程
+PROCESS_RSS = Gauge('nsfw_process_resident_memory_bytes', 'Resident set size of the service process',
+                    callback=_process_rss)
+
+def stage_timer(stage):
+    """记录一个处理阶段的耗时"""
+    return STAGE_SECONDS.time(stage=stage)
+
+_queues = {}
+
+def register_queue(name, get_depth):
+    """登记一个队列，导出时调用 get_depth() 获取当前长度"""
+    _queues[name] = get_depth
+
+def _queue_depths():
+    return {(name,): get_depth() for name, get_depth in _queues.items()}
+
+QUEUE_DEPTH.set_function(_queue_depths)
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,218 @@
+# ole2.py
+import re
+import struct
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# 特殊扇区编号
+MAXREGSECT = 0xFFFFFFFA
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+
+# 目录项类型
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+
+# OfficeArt 位图 BLIP 记录：recType -> (单 UID 的 recInstance, 双 UID 的 recInstance, 扩展名)
+BLIP_TYPES = {
+    0xF01D: (0x46A, 0x46B, '.jpg'),   # JPEG (RGB)
+    0xF02A: (0x6E2, 0x6E3, '.jpg'),   # JPEG (CMYK)
+    0xF01E: (0x6E0, 0x6E1, '.png'),
+    0xF01F: (0x7A8, 0x7A9, '.bmp'),   # DIB，需要补上 BMP 文件头
+    0xF029: (0x6E4, 0x6E5, '.tiff'),
+}
+
+# 匹配 recType 的低字节 + 0xF0，用于在流中快速定位候选记录头
+_BLIP_TYPE_PATTERN = re.compile(rb'[\x1d\x1e\x1f\x29\x2a]\xf0')
+
+class OleFileError(Exception):
+    """OLE2 复合文件格式错误"""
+
+class OleFile:
+    """OLE2 复合文件（.doc/.xls/.ppt 等旧版 Office 文档）的最小只读解析器
+
+    只实现读取流所需的部分：扇区分配表（FAT/DIFAT）、目录和迷你流。
+    """
+    def __init__(self, data):
+        if len(data) < 512 or not data.startswith(OLE2_SIGNATURE):
+            raise OleFileError("不是有效的 OLE2 复合文件")
+        self.data = data
+
+        (sector_shift, mini_sector_shift) = struct.unpack_from('<HH', data, 0x1E)
+        (num_fat_sectors, first_dir_sector) = struct.unpack_from('<II', data, 0x2C)
+        (self.mini_cutoff, first_minifat_sector, num_minifat_sectors,
+         first_difat_sector, num_difat_sectors) = struct.unpack_from('<IIIII', data, 0x38)
+        if sector_shift not in (9, 12) or mini_sector_shift != 6:
+            raise OleFileError("不支持的扇区大小")
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        self.max_sectors = (len(data) + self.sector_size - 1) // self.sector_size
+
+        self.fat = self._load_fat(num_fat_sectors, first_difat_sector, num_difat_sectors)
+        self.entries = self._load_directory(first_dir_sector)
+
+        root = self.entries[0] if self.entries else None
+        if root is None or root['type'] != STGTY_ROOT:
+            raise OleFileError("缺少根目录项")
+        self.mini_stream = self._read_chain(root['start'], root['size'])
+        self.minifat = []
+        if num_minifat_sectors and first_minifat_sector <= MAXREGSECT:
+            raw = self._read_chain(first_minifat_sector)
+            self.minifat = list(struct.unpack_from(f'<{len(raw) // 4}I', raw))
+
+    def _sector(self, sector_id):
+        offset = (sector_id + 1) * self.sector_size
+        if sector_id > MAXREGSECT or offset >= len(self.data):
+            raise OleFileError(f"扇区编号越界: {sector_id}")
+        return self.data[offset:offset + self.sector_size]
+
+    def _load_fat(self, num_fat_sectors, first_difat_sector, num_difat_sectors):
+        # 头部包含前 109 个 FAT 扇区编号，其余记录在 DIFAT 扇区链中
+        fat_sector_ids = list(struct.unpack_from('<109I', self.data, 0x4C))
+        difat_sector = first_difat_sector
+        per_sector = self.sector_size // 4 - 1
+        # 头部记录的 DIFAT 扇区数不可信，最多遍历文件中的扇区数，并检测循环链
+        visited = set()
+        for _ in range(min(num_difat_sectors, self.max_sectors)):
+            if difat_sector > MAXREGSECT or len(fat_sector_ids) >= num_fat_sectors:
+                break
+            if difat_sector in visited:
+                raise OleFileError("DIFAT 扇区链存在循环")
+            visited.add(difat_sector)
+            values = struct.unpack_from(f'<{per_sector + 1}I', self._sector(difat_sector))
+            fat_sector_ids.extend(values[:per_sector])
+            difat_sector = values[per_sector]
+
+        fat = []
+        for sector_id in fat_sector_ids[:num_fat_sectors]:
+            if sector_id > MAXREGSECT:
+                continue
+            fat.extend(struct.unpack_from(f'<{self.sector_size // 4}I', self._sector(sector_id)))
+        return fat
+
+    def _chain(self, start, table):
+        """按分配表遍历扇区链，防止损坏文件造成死循环"""
+        sector_id = start
+        visited = 0
+        while sector_id <= MAXREGSECT:
+            if sector_id >= len(table) or visited > len(table):
+                raise OleFileError("扇区链损坏")
+            yield sector_id
+            visited += 1
+            sector_id = table[sector_id]
+
+    def _read_chain(self, start, size=None):
+        data = b''.join(self._sector(sector_id) for sector_id in self._chain(start, self.fat))
+        return data if size is None else data[:size]
+
+    def _read_mini_chain(self, start, size):
+        chunks = []
+        for sector_id in self._chain(start, self.minifat):
+            offset = sector_id * self.mini_sector_size
+            chunks.append(self.mini_stream[offset:offset + self.mini_sector_size])
+        return b''.join(chunks)[:size]
+
+    def _load_directory(self, first_dir_sector):
+        raw = self._read_chain(first_dir_sector)
+        entries = []
+        for offset in range(0, len(raw) - 127, 128):
+            name_length = struct.unpack_from('<H', raw, offset + 64)[0]
+            entry_type = raw[offset + 66]
+            start, size_low, size_high = struct.unpack_from('<III', raw, offset + 116)
+            name = raw[offset:offset + max(0, min(name_length, 64) - 2)].decode('utf-16-le', 'replace')
+            # 版本3文件的高32位可能是未定义的值
+            size = size_low if self.sector_size == 512 else size_low | (size_high << 32)
+            entries.append({'name': name, 'type': entry_type, 'start': start, 'size': size})
+        return entries
+
+    def list_streams(self):
+        return [entry['name'] for entry in self.entries if entry['type'] == STGTY_STREAM]
+
+    def read_stream(self, name):
+        """按名称读取流内容（不区分子存储，取第一个同名流）"""
+        for entry in self.entries:
+            if entry['type'] == STGTY_STREAM and entry['name'] == name:
+                if entry['size'] < self.mini_cutoff:
+                    return self._read_mini_chain(entry['start'], entry['size'])
+                return self._read_chain(entry['start'], entry['size'])
+        raise KeyError(name)
+
+def _dib_to_bmp(dib):
+    """为 DIB 数据补上 BITMAPFILEHEADER，便于 PIL 打开"""
+    header_size = struct.unpack_from('<I', dib, 0)[0]
+    if header_size == 12:
+        bit_count = struct.unpack_from('<H', dib, 10)[0]
+        colors = (1 << bit_count) if bit_count <= 8 else 0
+        palette_size = colors * 3
+    else:
+        bit_count, compression = struct.unpack_from('<HI', dib, 14)
+        colors_used = struct.unpack_from('<I', dib, 32)[0]
+        colors = colors_used or ((1 << bit_count) if bit_count <= 8 else 0)
+        palette_size = colors * 4
+        if compression == 3 and header_size == 40:
+            palette_size += 12  # BI_BITFIELDS 的颜色掩码
+    pixel_offset = 14 + header_size + palette_size
+    return b'BM' + struct.pack('<IHHI', 14 + len(dib), 0, 0, pixel_offset) + dib
+
+def _valid_payload(ext, payload):
+    if ext == '.jpg':
+        return payload.startswith(b'\xff\xd8')
+    if ext == '.png':
+        return payload.startswith(b'\x89PNG')
+    if ext == '.tiff':
+        return payload.startswith((b'II*\x00', b'MM\x00*'))
+    if ext == '.bmp':
+        return len(payload) > 40 and struct.unpack_from('<I', payload, 0)[0] in (12, 40, 52, 56, 108, 124)
+    return False
+
+def iter_blip_images(stream):
+    """在流中查找 OfficeArt 位图 BLIP 记录，逐个返回 (扩展名, 图片文件内容)"""
+    for match in _BLIP_TYPE_PATTERN.finditer(stream):
+        offset = match.start() - 2
+        if offset < 0 or offset + 8 > len(stream):
+            continue
+        ver_instance, rec_type, rec_len = struct.unpack_from('<HHI', stream, offset)
+        blip = BLIP_TYPES.get(rec_type)
+        if blip is None or ver_instance & 0x0F != 0:
+            continue
+        instance = ver_instance >> 4
+        if instance == blip[0]:
+            header_size = 17
+        elif instance == blip[1]:
+            header_size = 33
+        else:
+            continue
+        end = offset + 8 + rec_len
+        if rec_len <= header_size or end > len(stream):
+            continue
+        payload = stream[offset + 8 + header_size:end]
+        if not _valid_payload(blip[2], payload):
+            continue
+        if blip[2] == '.bmp':
+            payload = _dib_to_bmp(payload)
+        yield blip[2], payload
+
+def extract_doc_images(data):
+    """从 .doc 文件中提取嵌入的位图，返回去重后的 [(名称, 图片文件内容)]
+
+    图片位于 Data 流（内嵌图片）和 WordDocument 流（BStore 延迟存储的图片）中。
+    """
+    ole = OleFile(data)
+    streams = ole.list_streams()
+    images = []
+    seen = set()
+    for stream_name in ('Data', 'WordDocument'):
+        if stream_name not in streams:
+            continue
+        for ext, payload in iter_blip_images(ole.read_stream(stream_name)):
+            digest = hashlib.sha1(payload).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            images.append((f"{stream_name}/image{len(images) + 1}{ext}", payload))
+    logger.info(f"从 DOC 文件中提取到 {len(images)} 张图片")
+    return images
@@ -0,0 +1,119 @@
+# optimize.py
+import time
+import logging
+from PIL import Image
+from config import INFERENCE_BATCH_SIZE, TORCH_COMPILE, TORCH_BF16, TORCH_PARITY_TOLERANCE
+
+logger = logging.getLogger(__name__)
+
+def cpu_supports_bf16():
+    """CPU 是否有原生 bf16 指令（AVX512-BF16 或 AMX），没有时 bf16 反而更慢"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def batch_buckets(batch_size):
+    """推理时使用的批次大小：不超过 batch_size 的 2 的幂以及 batch_size 本身
+
+    编译后的模型按输入形状特化，批次补齐到这些大小后只需为每个大小编译一次。
+    """
+    buckets = []
+    size = 1
+    while size < batch_size:
+        buckets.append(size)
+        size *= 2
+    buckets.append(batch_size)
+    return buckets
+
+class OptimizedClassifier:
+    """PyTorch 优化推理路径，调用方式与分类管道相同：classifier(images, batch_size=...)
+
+    在 torch.inference_mode 下执行，模型使用 channels_last 内存布局，支持时用
+    bf16 autocast，并可用 torch.compile 融合算子。预处理沿用管道的 image_processor，
+    输出与管道一致，为 [[{'label': ..., 'score': ...}, ...], ...]。
+    """
+    def __init__(self, pipe, compile_model=True, bf16=False, batch_size=INFERENCE_BATCH_SIZE):
+        import torch
+        self.pipe = pipe
+        self.image_processor = pipe.image_processor
+        self.model = pipe.model.eval().to(memory_format=torch.channels_last)
+        self.id2label = self.model.config.id2label
+        self.multi_label = getattr(self.model.config, 'problem_type', None) == 'multi_label_classification'
+        self.bf16 = bf16
+        self.batch_size = max(1, batch_size)
+        self.buckets = batch_buckets(self.batch_size)
+        self.compiled = compile_model
+        self._forward = torch.compile(self.model, dynamic=False) if compile_model else self.model
+
+    def _run(self, pixel_values):
+        import torch
+        count = pixel_values.shape[0]
+        bucket = next(size for size in self.buckets if size >= count)
+        if bucket > count:
+            # 重复最后一张补齐批次，避免为新的形状重新编译
+            padding = pixel_values[-1:].expand(bucket - count, *pixel_values.shape[1:])
+            pixel_values = torch.cat([pixel_values, padding])
+        pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.bf16):
+            logits = self._forward(pixel_values=pixel_values).logits
+        logits = logits[:count].float()
+        return logits.sigmoid() if self.multi_label else logits.softmax(-1)
+
+    def __call__(self, images, batch_size=None):
+        batch_size = min(batch_size or self.batch_size, self.batch_size)
+        outputs = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            pixel_values = self.image_processor(images=chunk, return_tensors='pt')['pixel_values']
+            for row in self._run(pixel_values).tolist():
+                scores = [{'label': self.id2label[index], 'score': score} for index, score in enumerate(row)]
+                outputs.append(sorted(scores, key=lambda item: item['score'], reverse=True))
+        return outputs
+
+    def warmup(self):
+        """为每个批次大小执行一次推理，编译在启动时完成而不是在首个请求中"""
+        started = time.monotonic()
+        for size in self.buckets:
+            self([Image.new('RGB', (224, 224)) for _ in range(size)], batch_size=size)
+        logger.info(f"优化推理路径预热完成（批次 {self.buckets}），耗时 {time.monotonic() - started:.1f} 秒")
+
+def _parity_images():
+    """数值一致性检查使用的固定图片：噪声、渐变和纯色"""
+    gradient = Image.linear_gradient('L').resize((224, 224))
+    return [
+        Image.effect_noise((224, 224), 64).convert('RGB'),
+        Image.merge('RGB', (gradient, gradient.rotate(90), gradient.rotate(180))),
+        Image.new('RGB', (224, 224), (200, 150, 120)),
+        Image.new('RGB', (224, 224))
+    ]
+
+def check_parity(baseline, optimized, tolerance):
+    """比较两条推理路径在固定图片上的得分，返回最大绝对误差"""
+    images = _parity_images()
+    expected = baseline(images, batch_size=len(images))
+    actual = optimized(images, batch_size=len(images))
+    max_diff = 0.0
+    for expected_scores, actual_scores in zip(expected, actual):
+        actual_by_label = {item['label']: item['score'] for item in actual_scores}
+        for item in expected_scores:
+            max_diff = max(max_diff, abs(item['score'] - actual_by_label.get(item['label'], 0.0)))
+    return max_diff
+
+def optimize_pipeline(pipe):
+    """创建优化推理路径并预热，与原管道的得分误差超过 TORCH_PARITY_TOLERANCE 时返回原管道"""
+    bf16 = cpu_supports_bf16() if TORCH_BF16 == 'auto' else bool(TORCH_BF16)
+    try:
+        optimized = OptimizedClassifier(pipe, compile_model=bool(TORCH_COMPILE), bf16=bf16)
+        optimized.warmup()
+        max_diff = check_parity(pipe, optimized, TORCH_PARITY_TOLERANCE)
+    except Exception as e:
+        logger.error(f"创建优化推理路径失败，使用默认管道: {str(e)}")
+        return pipe
+    if max_diff > TORCH_PARITY_TOLERANCE:
+        logger.warning(f"优化推理路径与默认管道的得分误差 {max_diff:.4f} 超过 {TORCH_PARITY_TOLERANCE}，使用默认管道")
+        return pipe
+    logger.info(f"已启用优化推理路径: compile={optimized.compiled}, bf16={bf16}, 最大得分误差 {max_diff:.4f}")
+    return optimized
@@ -0,0 +1,98 @@
+# pdftriage.py
+import subprocess
+import logging
+from PIL import ImageStat
+from prefilter import mean_chroma
+from profiling import children_rusage_stage, run_subprocess
+from config import (
+    DOCUMENT_MIN_IMAGE_SIDE, PDF_TRIAGE_DPI, PDF_TRIAGE_CHUNK_PAGES, PDF_TRIAGE_MAX_CHROMA,
+    PDF_TRIAGE_BLANK_STDDEV
+)
+
+logger = logging.getLogger(__name__)
+
+def list_image_pages(pdf_path, timeout=60):
+    """用 pdfimages -list 找出含有位图的页码，无法获取时返回 None
+
+    只统计边长不小于 DOCUMENT_MIN_IMAGE_SIDE 的位图，不统计遮罩（mask/smask/stencil）。
+    """
+    try:
+        result = run_subprocess(
+            ['pdfimages', '-list', pdf_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=timeout
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"获取PDF图片列表失败: {str(e)}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"获取PDF图片列表失败: {result.stderr.strip()}")
+        return None
+
+    pages = set()
+    # 前两行为表头和分隔线
+    for line in result.stdout.splitlines()[2:]:
+        fields = line.split()
+        if len(fields) < 5 or fields[2] != 'image':
+            continue
+        try:
+            page, width, height = int(fields[0]), int(fields[3]), int(fields[4])
+        except ValueError:
+            continue
+        if min(width, height) >= DOCUMENT_MIN_IMAGE_SIDE:
+            pages.add(page)
+    return pages
+
+class PdfPageTriage:
+    """PDF 页面预判：跳过空白页和纯文字页，不再以 200 DPI 渲染并检测
+
+    含有位图的页面始终检测。没有位图的页面按 PDF_TRIAGE_CHUNK_PAGES 页一组以
+    PDF_TRIAGE_DPI 低分辨率渲染：几乎没有颜色（黑白文字、表格）或几乎空白的页面跳过。
+    pdfimages 不可用时无法确认页面不含图片，只跳过空白页。
+    """
+    def __init__(self, pdf_path, page_count):
+        self.pdf_path = pdf_path
+        self.page_count = page_count
+        self.image_pages = list_image_pages(pdf_path)
+        self._verdicts = {}
+
+    def skip_reason(self, page_num):
+        """返回跳过该页的原因（'blank' 或 'text'），需要检测时返回 None"""
+        if self.image_pages is not None and page_num in self.image_pages:
+            return None
+        if page_num not in self._verdicts:
+            self._render_chunk(page_num)
+        return self._verdicts.get(page_num)
+
+    def _render_chunk(self, first_page):
+        from pdf2image import convert_from_path
+
+        last_page = min(self.page_count, first_page + PDF_TRIAGE_CHUNK_PAGES - 1)
+        # 预先标记为需要检测，渲染失败时不跳过
+        for page_num in range(first_page, last_page + 1):
+            self._verdicts[page_num] = None
+        try:
+            with children_rusage_stage('pdftoppm', triage=True):
+                thumbnails = convert_from_path(
+                    self.pdf_path,
+                    dpi=PDF_TRIAGE_DPI,
+                    thread_count=1,
+                    first_page=first_page,
+                    last_page=last_page
+                )
+        except Exception as e:
+            logger.warning(f"PDF低分辨率预览失败: {str(e)}")
+            return
+        for page_num, thumbnail in zip(range(first_page, last_page + 1), thumbnails):
+            with thumbnail:
+                self._verdicts[page_num] = self._classify(thumbnail)
+
+    def _classify(self, thumbnail):
+        rgb = thumbnail.convert('RGB')
+        if ImageStat.Stat(rgb.convert('L')).stddev[0] < PDF_TRIAGE_BLANK_STDDEV:
+            return 'blank'
+        if self.image_pages is not None and mean_chroma(rgb.convert('YCbCr')) < PDF_TRIAGE_MAX_CHROMA:
+            return 'text'
+        return None
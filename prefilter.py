@@ -0,0 +1,115 @@
+# prefilter.py
+import threading
+import logging
+from PIL import Image, ImageChops, ImageStat
+from metrics import PREFILTER_IMAGES
+from profiling import span
+from config import (
+    PREFILTER_ENABLED, PREFILTER_MIN_SIDE, PREFILTER_MIN_STDDEV, PREFILTER_MIN_SKIN_RATIO,
+    PREFILTER_MODEL, PREFILTER_MODEL_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (64, 64)
+# 平均色度偏移小于此值时视为灰度图片，不按肤色比例过滤
+GRAYSCALE_CHROMA = 6
+
+# 直接判为正常时返回的结果
+NORMAL_RESULT = {'nsfw': 0.0, 'normal': 1.0}
+
+def _skin_ratio(ycbcr):
+    """YCbCr 空间中 Cb∈[77,127]、Cr∈[133,173] 的像素比例"""
+    _, cb, cr = ycbcr.split()
+    cb_mask = cb.point(lambda v: 255 if 77 <= v <= 127 else 0)
+    cr_mask = cr.point(lambda v: 255 if 133 <= v <= 173 else 0)
+    histogram = ImageChops.multiply(cb_mask, cr_mask).histogram()
+    return histogram[255] / (ycbcr.width * ycbcr.height)
+
+def mean_chroma(ycbcr):
+    """Cb/Cr 通道相对中性值 128 的平均偏移"""
+    _, cb, cr = ycbcr.split()
+    neutral = Image.new('L', cb.size, 128)
+    return max(ImageStat.Stat(ImageChops.difference(channel, neutral)).mean[0] for channel in (cb, cr))
+
+def image_statistics_reject(image):
+    """根据图片统计量判断是否可以直接判为正常，返回原因，不能判定时返回 None
+
+    - 边长小于 PREFILTER_MIN_SIDE：图标、项目符号等
+    - 缩略图灰度标准差小于 PREFILTER_MIN_STDDEV：空白页、纯色帧
+    - 彩色图片中肤色像素比例小于 PREFILTER_MIN_SKIN_RATIO：纯文字扫描件、图表等
+      （灰度图片无法按肤色判断，不使用此规则）
+    """
+    if min(image.size) < PREFILTER_MIN_SIDE:
+        return 'small'
+    thumbnail = image.convert('RGB')
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    if ImageStat.Stat(thumbnail.convert('L')).stddev[0] < PREFILTER_MIN_STDDEV:
+        return 'flat'
+    if PREFILTER_MIN_SKIN_RATIO > 0:
+        ycbcr = thumbnail.convert('YCbCr')
+        if mean_chroma(ycbcr) >= GRAYSCALE_CHROMA and _skin_ratio(ycbcr) < PREFILTER_MIN_SKIN_RATIO:
+            return 'no_skin'
+    return None
+
+class PrefilterModel:
+    """可选的小模型预筛：NSFW 得分低于 PREFILTER_MODEL_THRESHOLD 的图片直接判为正常"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = PrefilterModel(PREFILTER_MODEL)
+        return cls._instance
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.pipe = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self.pipe is None:
+                from transformers import pipeline
+                self.pipe = pipeline("image-classification", model=self.model_name, device=-1)
+                logger.info(f"预筛模型加载完成: {self.model_name}")
+
+    def scores(self, images):
+        self._ensure_loaded()
+        outputs = self.pipe(images, batch_size=len(images))
+        return [next((item['score'] for item in output if item['label'] == 'nsfw'), 1.0) for output in outputs]
+
+def prefilter_images(images):
+    """对图片执行级联预筛，返回与输入等长的列表：直接判定的结果，或需要 ViT 检测时为 None"""
+    verdicts = [None] * len(images)
+    if not PREFILTER_ENABLED or not images:
+        return verdicts
+    with span('prefilter', images=len(images)) as node:
+        candidates = []
+        for index, image in enumerate(images):
+            try:
+                reason = image_statistics_reject(image)
+            except Exception as e:
+                logger.error(f"计算图片统计量失败: {str(e)}")
+                reason = None
+            if reason is None:
+                candidates.append(index)
+                PREFILTER_IMAGES.inc(stage='stats', outcome='passed')
+            else:
+                verdicts[index] = dict(NORMAL_RESULT)
+                PREFILTER_IMAGES.inc(stage='stats', outcome=reason)
+
+        if PREFILTER_MODEL and candidates:
+            try:
+                scores = PrefilterModel.get_instance().scores([images[index] for index in candidates])
+                for index, score in zip(candidates, scores):
+                    if score < PREFILTER_MODEL_THRESHOLD:
+                        verdicts[index] = {'nsfw': score, 'normal': 1.0 - score}
+                        PREFILTER_IMAGES.inc(stage='model', outcome='rejected')
+                    else:
+                        PREFILTER_IMAGES.inc(stage='model', outcome='passed')
+            except Exception as e:
+                # 预筛模型不可用时全部交给 ViT
+                logger.error(f"预筛模型推理失败: {str(e)}")
+        node.set(skipped=sum(verdict is not None for verdict in verdicts))
+    return verdicts
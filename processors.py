@@ -1,30 +1,56 @@
 # processors.py
-from transformers import pipeline
 import subprocess
-import numpy as np
 from PIL import Image
 import io
-from docx import Document
 import logging
 import tempfile
 import os
 import shutil
 import glob
 import gc
-from pdf2image import convert_from_path
+import threading
+import hashlib
+import time
+from collections import deque
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from utils import ArchiveHandler, can_process_file, sort_files_by_priority
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
+from utils import ArchiveHandler, can_process_file, sort_files_by_priority, get_file_extension
+from cache import member_cache
+from ole2 import extract_doc_images
+from scheduler import member_scheduler, SamplingPlan
+from context import scan_context, current_context, BudgetExceeded
+from metrics import register_queue, BATCH_SIZES, INFERENCE_IMAGES, MODEL_RECYCLES, PREFILTER_IMAGES, PDF_PAGES
+from snapshot import load_snapshot_pipeline, save_snapshot
+from topology import cpu_plan
+from optimize import optimize_pipeline
+from prefilter import prefilter_images, NORMAL_RESULT
+from pdftriage import PdfPageTriage
+from lanes import LANES, current_lane, inference_shares
+from profiling import span, stage, children_rusage_stage, run_subprocess, record_rusage, ProfiledPopen
 from config import (
     MAX_FILE_SIZE, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, 
-    NSFW_THRESHOLD, FFMPEG_MAX_FRAMES, FFMPEG_TIMEOUT, ARCHIVE_EXTENSIONS
+    FFMPEG_MAX_FRAMES, FFMPEG_TIMEOUT, ARCHIVE_EXTENSIONS,
+    NESTED_ARCHIVE_MEMORY_LIMIT, ZIP_MEDIA_DOCUMENT_DIRS,
+    MODEL_NAME, MODEL_SNAPSHOT_ENABLED, MODEL_SNAPSHOT_DIR, TORCH_OPTIMIZE, PDF_PAGE_TRIAGE,
+    INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS, DOCUMENT_MIN_IMAGE_BYTES, DOCUMENT_MIN_IMAGE_SIDE,
+    MEMBER_CACHE_VERIFY
 )
 
+# 需要检查 moov 位置才能决定能否通过管道读取的视频容器
+SEEKABLE_VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.3gp', '.3g2', '.f4v'}
+# 头部记录了时长、可以通过管道送入 ffmpeg 的视频容器；TS/PS 等容器从管道读取时无法得到时长
+PIPE_VIDEO_EXTENSIONS = SEEKABLE_VIDEO_EXTENSIONS | {'.mkv', '.webm', '.avi', '.flv', '.asf', '.wmv'}
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
 # 模型管理器
 class ModelManager:
+    """模型管理器
+
+    导入时不加载模型（transformers/torch 在首次使用时才导入），服务启动后由
+    start_warmup() 在后台加载并用一批空白图片预热；预热完成前到达的请求会等待加载。
+    """
     _instance = None
     
     @classmethod
@@ -34,23 +60,91 @@ class ModelManager:
         return cls._instance
     
     def __init__(self):
-        self.pipe = pipeline("image-classification", model="Falconsai/nsfw_image_detection", device=-1)
+        self.pipe = None
         self.usage_count = 0
         self.reset_threshold = 10000  # 每处理1万张图片重置一次模型
-        logger.info("模型管理器初始化完成")
+        self.warmup_error = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._warmup_thread = None
+    
+    @property
+    def ready(self):
+        """模型已加载并完成预热"""
+        return self._ready.is_set()
+    
+    def _create_pipeline(self):
+        """创建分类管道；开启 TORCH_OPTIMIZE 时换成编译并预热过的优化推理路径"""
+        cpu_plan.apply_torch()
+        pipe = self._load_pipeline()
+        if TORCH_OPTIMIZE:
+            pipe = optimize_pipeline(pipe)
+        return pipe
+    
+    def _load_pipeline(self):
+        """优先从本地内存映射快照创建管道，没有可用快照时从 HuggingFace 缓存加载并生成快照"""
+        if MODEL_SNAPSHOT_ENABLED:
+            pipe = load_snapshot_pipeline(MODEL_SNAPSHOT_DIR, MODEL_NAME)
+            if pipe is not None:
+                return pipe
+        
+        from transformers import pipeline
+        pipe = pipeline("image-classification", model=MODEL_NAME, device=-1)
+        if MODEL_SNAPSHOT_ENABLED:
+            save_snapshot(pipe, MODEL_SNAPSHOT_DIR, MODEL_NAME)
+            # 改用内存映射的快照，释放刚加载的私有权重副本
+            snapshot_pipe = load_snapshot_pipeline(MODEL_SNAPSHOT_DIR, MODEL_NAME)
+            if snapshot_pipe is not None:
+                del pipe
+                gc.collect()
+                return snapshot_pipe
+        return pipe
+    
+    def _ensure_loaded(self):
+        if self.pipe is not None:
+            return
+        with self._load_lock:
+            if self.pipe is None:
+                started = time.monotonic()
+                self.pipe = self._create_pipeline()
+                logger.info(f"模型加载完成，耗时 {time.monotonic() - started:.1f} 秒")
     
-    def get_pipeline(self):
-        # 增加使用计数
-        self.usage_count += 1
+    def warmup(self):
+        """加载模型并执行一次空白图片的批量推理，使首个请求无需承担冷启动开销"""
+        try:
+            self._ensure_loaded()
+            started = time.monotonic()
+            images = [Image.new('RGB', (224, 224)) for _ in range(INFERENCE_BATCH_SIZE)]
+            self.pipe(images, batch_size=INFERENCE_BATCH_SIZE)
+            logger.info(f"模型预热完成，耗时 {time.monotonic() - started:.1f} 秒")
+            self._ready.set()
+        except Exception as e:
+            self.warmup_error = str(e)
+            logger.error(f"模型预热失败: {str(e)}")
+    
+    def start_warmup(self):
+        """在后台线程中加载并预热模型（重复调用无副作用）"""
+        with self._load_lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self.warmup, name='model-warmup', daemon=True)
+            self._warmup_thread.start()
+    
+    def get_pipeline(self, count=1):
+        self._ensure_loaded()
+        
+        # 增加使用计数（批量推理时按图片数计数）
+        self.usage_count += count
         
         # 检查是否需要重置模型
         if self.usage_count >= self.reset_threshold:
             logger.info(f"模型已处理 {self.usage_count} 张图片，执行重置")
+            MODEL_RECYCLES.inc()
             # 记录旧模型引用
             old_pipe = self.pipe
             
             # 创建新模型
-            self.pipe = pipeline("image-classification", model="Falconsai/nsfw_image_detection", device=-1)
+            self.pipe = self._create_pipeline()
             
             # 删除旧模型
             del old_pipe
@@ -76,14 +170,95 @@ class ModelManager:
 # 初始化模型管理器实例
 model_manager = ModelManager.get_instance()
 
+class StreamDurationUnknown(Exception):
+    """从管道读取的视频无法获取时长，需要改为从文件读取"""
+
 class VideoProcessor:
-    def __init__(self, video_path):
+    def __init__(self, video_path, stream_opener=None):
+        """video_path 为视频文件路径；提供 stream_opener 时改为每次调用它打开新的输入流，
+        通过管道送入 ffprobe/ffmpeg 的标准输入，不再落盘"""
         self.video_path = video_path
+        self.stream_opener = stream_opener
+        self.input_arg = 'pipe:0' if stream_opener else video_path
+        self.fed_bytes = 0  # 已送入管道的最大字节数，每次重新读取时只累计超出的部分
         self.temp_dir = None
         self.duration = None
         self.frame_rate = None
         self.total_frames = None
 
+    def _feed_stdin(self, write_fd, budget, errors):
+        """将输入流写入子进程的标准输入管道
+
+        按实际写入的字节数累计解压预算（头部记录的大小可能被伪造），
+        预算耗尽时停止写入，异常通过 errors 交给调用线程重新抛出。
+        """
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                with self.stream_opener() as stream:
+                    written = 0
+                    while True:
+                        chunk = stream.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if written > self.fed_bytes:
+                            budget.consume_bytes(written - self.fed_bytes)
+                            self.fed_bytes = written
+                        pipe.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffprobe 读完头部后会提前关闭管道，属于正常情况
+            pass
+        except BudgetExceeded as e:
+            errors.append(e)
+        except Exception as e:
+            logger.error(f"向子进程写入视频流失败: {str(e)}")
+
+    def _run(self, cmd, text=False):
+        """运行 ffmpeg/ffprobe，流式输入时通过管道喂入视频内容"""
+        budget = current_context().budget
+        timeout = budget.timeout(FFMPEG_TIMEOUT)
+        if self.stream_opener is None:
+            return run_subprocess(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=timeout,
+                text=text
+            )
+
+        with stage(os.path.basename(cmd[0])) as node:
+            read_fd, write_fd = os.pipe()
+            try:
+                process = ProfiledPopen(
+                    cmd,
+                    stdin=read_fd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=text
+                )
+            except Exception:
+                os.close(write_fd)
+                raise
+            finally:
+                os.close(read_fd)
+
+            # 写入线程不继承 contextvars，预算对象需要显式传入
+            errors = []
+            feeder = threading.Thread(target=self._feed_stdin, args=(write_fd, budget, errors), daemon=True)
+            feeder.start()
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            finally:
+                feeder.join(timeout=5)
+                record_rusage(node, process.rusage)
+            if errors:
+                raise errors[0]
+            return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
     def _get_video_info(self):
         """获取视频基本信息"""
         try:
@@ -95,15 +270,10 @@ class VideoProcessor:
                 '-show_entries', 'stream=r_frame_rate',
                 '-select_streams', 'v',
                 '-of', 'json',
-                self.video_path
+                self.input_arg
             ]
 
-            result = subprocess.run(
-                duration_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=FFMPEG_TIMEOUT
-            )
+            result = self._run(duration_cmd)
 
             if result.returncode != 0:
                 raise Exception(f"Failed to get video info: {result.stderr.decode()}")
@@ -115,20 +285,18 @@ class VideoProcessor:
             # 获取时长
             if 'format' in info and 'duration' in info['format']:
                 self.duration = float(info['format']['duration'])
+            elif self.stream_opener is not None:
+                # 管道输入无法通过完整解码获取时长，由调用方改为从临时文件读取
+                raise StreamDurationUnknown("视频流中没有时长信息")
             else:
                 # 如果无法获取时长，使用替代命令
                 alt_duration_cmd = [
                     'ffmpeg',
-                    '-i', self.video_path,
+                    '-i', self.input_arg,
                     '-f', 'null',
                     '-'
                 ]
-                result = subprocess.run(
-                    alt_duration_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=FFMPEG_TIMEOUT
-                )
+                result = self._run(alt_duration_cmd)
                 # 从stderr中解析时长信息
                 duration_str = result.stderr.decode()
                 import re
@@ -159,6 +327,8 @@ class VideoProcessor:
                        
         except subprocess.TimeoutExpired:
             raise Exception("获取视频信息超时")
+        except (StreamDurationUnknown, BudgetExceeded):
+            raise
         except Exception as e:
             raise Exception(f"获取视频信息失败: {str(e)}")
 
@@ -172,23 +342,27 @@ class VideoProcessor:
             if not self.duration:
                 raise ValueError("视频信息不完整，请先调用 _get_video_info()")
                 
-            # 计算采样帧率，添加安全检查
-            if self.duration < FFMPEG_MAX_FRAMES:
+            # 计算采样帧率，添加安全检查；帧数上限可由请求的 max_frames 指定
+            budget = current_context().budget
+            max_frames = budget.max_frames
+            if self.duration < max_frames:
                 # 如果视频时长小于预期提取的帧数，则每秒提取一帧
                 fps = "1"
-                frames_to_extract = min(int(self.duration), FFMPEG_MAX_FRAMES)
+                frames_to_extract = min(int(self.duration), max_frames)
             else:
                 # 正常情况下的帧率计算
-                interval_seconds = max(1, int(self.duration / FFMPEG_MAX_FRAMES))
+                interval_seconds = max(1, int(self.duration / max_frames))
                 fps = f"1/{interval_seconds}"
-                frames_to_extract = FFMPEG_MAX_FRAMES
+                frames_to_extract = max_frames
+            if frames_to_extract < min(int(self.duration), FFMPEG_MAX_FRAMES):
+                budget.record_truncation('frames', f'Frame limit ({max_frames}) reduced video sampling')
                 
             logger.info(f"视频总长: {self.duration:.2f}秒, FPS: {fps}, 计划提取帧数: {frames_to_extract}")
             
             # 使用 fps filter 提取帧
             extract_cmd = [
                 'ffmpeg',
-                '-i', self.video_path,
+                '-i', self.input_arg,
                 '-vf', f'fps={fps}',         # 使用固定帧率
                 '-frame_pts', '1',           # 输出时间戳
                 '-vframes', str(frames_to_extract),  # 限制提取帧数
@@ -198,13 +372,7 @@ class VideoProcessor:
             ]
                 
             # 执行提取命令
-            result = subprocess.run(
-                extract_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=FFMPEG_TIMEOUT,
-                text=True
-            )
+            result = self._run(extract_cmd, text=True)
             
             if result.returncode != 0:
                 logger.error(f"提取帧失败，FFMPEG输出: {result.stderr}")
@@ -212,7 +380,7 @@ class VideoProcessor:
                 # 如果第一次提取失败，尝试使用更保守的设置
                 conservative_cmd = [
                     'ffmpeg',
-                    '-i', self.video_path,
+                    '-i', self.input_arg,
                     '-r', '1',               # 强制输出帧率为1fps
                     '-vframes', str(frames_to_extract),
                     '-q:v', '2',
@@ -221,13 +389,7 @@ class VideoProcessor:
                 ]
                 
                 logger.info("尝试使用备选提取方法...")
-                result = subprocess.run(
-                    conservative_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=FFMPEG_TIMEOUT,
-                    text=True
-                )
+                result = self._run(conservative_cmd, text=True)
                 
                 if result.returncode != 0:
                     raise Exception(f"提取帧失败（备选方法）: {result.stderr}")
@@ -261,6 +423,8 @@ class VideoProcessor:
         try:
             # 使用with语句确保Image对象正确关闭
             with Image.open(frame_path) as img:
+                with stage('decode'):
+                    img.load()
                 result = process_image(img)
                 frame_num = int(Path(frame_path).stem.split('-')[1])
                 # 处理完单帧后进行垃圾回收
@@ -274,21 +438,30 @@ class VideoProcessor:
         """按顺序处理视频文件"""
         try:
             # 获取视频信息
-            self._get_video_info()
+            with span('video_info'):
+                self._get_video_info()
             
             # 提取关键帧
-            frame_files = self._extract_keyframes()
+            with span('extract_keyframes'):
+                frame_files = self._extract_keyframes()
             if not frame_files:
                 logger.warning("未能提取到任何关键帧")
                 return None
             
             # 按顺序处理帧
             last_result = None
-            for frame in sorted(frame_files):
-                frame_num, result = self._process_frame(frame)
+            ctx = current_context()
+            for index, frame in enumerate(sorted(frame_files), 1):
+                try:
+                    ctx.budget.check_time()
+                except BudgetExceeded:
+                    break
+                with span('frame', index=index):
+                    frame_num, result = self._process_frame(frame)
+                ctx.report_progress('frames', index, len(frame_files))
                 if result is not None:
                     last_result = result
-                    if result['nsfw'] > NSFW_THRESHOLD:
+                    if result['nsfw'] > ctx.threshold:
                         logger.info(f"在帧 {frame_num} 发现匹配内容")
                         return result
                 
@@ -313,52 +486,200 @@ class VideoProcessor:
             # 强制垃圾回收
             gc.collect()
 
+def _scores_from_output(output):
+    """从分类管道的输出中提取 nsfw/normal 得分"""
+    nsfw_score = next((item['score'] for item in output if item['label'] == 'nsfw'), 0)
+    normal_score = next((item['score'] for item in output if item['label'] == 'normal'), 1)
+    return {
+        'nsfw': nsfw_score,
+        'normal': normal_score
+    }
+
+def process_images(images, batch_size=None):
+    """批量处理多张图片，返回与输入顺序一致的检测结果列表"""
+    if not images:
+        return []
+    try:
+        batch_size = batch_size or INFERENCE_BATCH_SIZE
+        logger.info(f"开始批量处理 {len(images)} 张图片")
+        
+        pipe = model_manager.get_pipeline(len(images))
+        BATCH_SIZES.observe(len(images))
+        INFERENCE_IMAGES.inc(len(images))
+        with stage('inference'):
+            outputs = pipe(images, batch_size=batch_size)
+        results = [_scores_from_output(output) for output in outputs]
+        
+        logger.info(f"批量处理完成: 最高NSFW={max(r['nsfw'] for r in results):.3f}")
+        return results
+    except Exception as e:
+        logger.error(f"批量图片处理失败: {str(e)}")
+        raise Exception(f"Image processing failed: {str(e)}")
+
+class InferenceBatcher:
+    """跨请求的推理微批处理器
+
+    各线程提交的图片按通道进入队列，由推理槽位线程合并为批次后统一推理：
+    队列中已有等待的图片时立即凑批，否则最多等待 INFERENCE_BATCH_WAIT_MS 毫秒。
+    fast 和 heavy 通道同时有图片时按 LANE_FAST_INFERENCE_SHARE 分配推理份额。
+    槽位数和每个槽位的线程数由 cpu_plan 决定，同时执行推理的批次不超过槽位数，
+    避免多个请求线程各自使用全部核心推理造成 CPU 超额订阅。
+    """
+    _instance = None
+    
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = InferenceBatcher(INFERENCE_BATCH_SIZE, INFERENCE_BATCH_WAIT_MS / 1000.0, cpu_plan.slots)
+        return cls._instance
+    
+    def __init__(self, batch_size, max_wait, slots=1, shares=None):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.slots = max(1, slots)
+        self.shares = shares or inference_shares()
+        self._pending = {lane: deque() for lane in LANES}  # 各通道待推理的 (图片, Future)
+        self._served = dict.fromkeys(LANES, 0)
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._threads = []
+    
+    def _ensure_started(self):
+        with self._lock:
+            if not self._threads:
+                for slot in range(self.slots):
+                    thread = threading.Thread(target=self._loop, args=(slot,), name=f'inference-slot-{slot}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+    
+    def qsize(self, lane=None):
+        """待推理的图片数，lane 为 None 时返回所有通道的总数"""
+        if lane is not None:
+            return len(self._pending[lane])
+        return sum(len(items) for items in self._pending.values())
+    
+    def classify(self, image):
+        """提交一张图片并等待检测结果"""
+        return self.classify_many([image])[0]
+    
+    def classify_many(self, images):
+        """提交多张图片并等待检测结果，返回与输入顺序一致的结果列表
+
+        图片进入当前扫描所在通道的队列（见 lanes.current_lane）。
+        """
+        self._ensure_started()
+        lane = current_lane()
+        futures = [Future() for _ in images]
+        with self._cond:
+            self._pending[lane].extend(zip(images, futures))
+            self._cond.notify_all()
+        return [future.result() for future in futures]
+    
+    def _take(self):
+        """取出一张图片：多个通道都有图片时，选择已推理数与份额之比最小的通道
+
+        只有一个通道有图片时清零计数，空闲通道不会积累份额，之后也不会长时间独占推理。
+        """
+        lanes = [lane for lane in LANES if self._pending[lane]]
+        if len(lanes) == 1:
+            self._served = dict.fromkeys(LANES, 0)
+        lane = min(lanes, key=lambda name: self._served[name] / self.shares[name])
+        self._served[lane] += 1
+        return self._pending[lane].popleft()
+    
+    def _collect(self):
+        with self._cond:
+            while True:
+                while not self.qsize():
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while self.qsize() < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # 等待期间其他槽位可能已取走图片
+                if self.qsize():
+                    return [self._take() for _ in range(min(self.batch_size, self.qsize()))]
+    
+    def _loop(self, slot):
+        cpu_plan.pin_current_thread(slot)
+        while True:
+            items = self._collect()
+            try:
+                results = process_images([image for image, _ in items], self.batch_size)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result(result)
+
+# 初始化推理批处理器实例
+inference_batcher = InferenceBatcher.get_instance()
+register_queue('inference', inference_batcher.qsize)
+for _lane in LANES:
+    register_queue(f'inference_{_lane}', lambda lane=_lane: inference_batcher.qsize(lane))
+
+def classify_images(images):
+    """级联检测多张图片：预筛能直接判为正常的图片不再经过 ViT，其余合并批量推理"""
+    results = prefilter_images(images)
+    pending = [index for index, result in enumerate(results) if result is None]
+    if pending:
+        with span('inference', images=len(pending)):
+            for index, result in zip(pending, inference_batcher.classify_many([images[index] for index in pending])):
+                results[index] = result
+        PREFILTER_IMAGES.inc(len(pending), stage='vit', outcome='classified')
+    return results
+
 def process_image(image):
-    """处理单张图片并返回检测结果"""
+    """处理单张图片并返回检测结果，并发请求中的图片会被合并批量推理"""
     try:
         logger.info("开始处理图片")
         
-        # 获取模型管理器的管道
-        pipe = model_manager.get_pipeline()
-        
-        # 使用管道处理图像
-        result = pipe(image)
-        nsfw_score = next((item['score'] for item in result if item['label'] == 'nsfw'), 0)
-        normal_score = next((item['score'] for item in result if item['label'] == 'normal'), 1)
-        logger.info(f"图片处理完成: NSFW={nsfw_score:.3f}, Normal={normal_score:.3f}")
+        result = classify_images([image])[0]
+        logger.info(f"图片处理完成: NSFW={result['nsfw']:.3f}, Normal={result['normal']:.3f}")
         
         # 强制垃圾回收
         gc.collect()
         
-        return {
-            'nsfw': nsfw_score,
-            'normal': normal_score
-        }
+        return result
     except Exception as e:
         logger.error(f"图片处理失败: {str(e)}")
         raise Exception(f"Image processing failed: {str(e)}")
     
 def process_pdf_file(pdf_stream):
-    """使用 pdf2image 处理 PDF 文件并检查内容"""
+    """使用 pdf2image 处理 PDF 文件并检查内容
+
+    pdf_stream 可以是 PDF 内容的 bytes，也可以是磁盘上的 PDF 文件路径（直接使用，不再复制）
+    """
+    from pdf2image import convert_from_path
+    
     try:
         logger.info("开始处理PDF文件")
         
-        # 创建临时文件保存 PDF 内容
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_pdf:
-            tmp_pdf.write(pdf_stream)
-            tmp_pdf_path = tmp_pdf.name
+        if isinstance(pdf_stream, str):
+            tmp_pdf_path = pdf_stream
+            owns_tmp_pdf = False
+        else:
+            # 创建临时文件保存 PDF 内容
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_pdf:
+                tmp_pdf.write(pdf_stream)
+                tmp_pdf_path = tmp_pdf.name
+            owns_tmp_pdf = True
 
         try:
             # 首先获取PDF页数，只加载第一页
             first_page = None
             first_page_count = 0
             try:
-                first_page = convert_from_path(
-                    tmp_pdf_path,
-                    dpi=72,  # 低DPI只用于获取页数
-                    first_page=1,
-                    last_page=1
-                )
+                with children_rusage_stage('pdftoppm'):
+                    first_page = convert_from_path(
+                        tmp_pdf_path,
+                        dpi=72,  # 低DPI只用于获取页数
+                        first_page=1,
+                        last_page=1
+                    )
                 if first_page:
                     first_page_count = len(first_page)
                     # 立即释放first_page资源
@@ -375,8 +696,7 @@ def process_pdf_file(pdf_stream):
             
             # 使用pdfinfo获取页数
             try:
-                import subprocess
-                result = subprocess.run(
+                result = run_subprocess(
                     ['pdfinfo', tmp_pdf_path],
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
@@ -403,49 +723,73 @@ def process_pdf_file(pdf_stream):
             logger.info(f"PDF共有 {page_count} 页")
             
             last_result = None
+            skipped_pages = 0
+            ctx = current_context()
+            triage = PdfPageTriage(tmp_pdf_path, page_count) if PDF_PAGE_TRIAGE else None
             
             # 一次只处理一页以减少内存使用
             for page_num in range(1, page_count + 1):
+                if ctx.budget.max_pages and page_num > ctx.budget.max_pages:
+                    ctx.budget.record_truncation('pages', f'Page limit ({ctx.budget.max_pages}) reached')
+                    break
+                try:
+                    ctx.budget.check_time()
+                except BudgetExceeded:
+                    break
                 page_images = None
                 try:
                     logger.info(f"正在处理第 {page_num}/{page_count} 页")
                     
-                    # 只转换当前页
-                    page_images = convert_from_path(
-                        tmp_pdf_path,
-                        dpi=200,
-                        fmt='jpeg',
-                        thread_count=1,  # 减少线程数降低内存使用
-                        first_page=page_num,
-                        last_page=page_num
-                    )
+                    with span('page', number=page_num) as page_span:
+                        # 空白页和纯文字页不渲染检测
+                        skip_reason = triage.skip_reason(page_num) if triage is not None else None
+                        if skip_reason:
+                            page_span.set(skipped=skip_reason)
+                            PDF_PAGES.inc(outcome=skip_reason)
+                            ctx.record_skipped('pages')
+                            skipped_pages += 1
+                            continue
+                        PDF_PAGES.inc(outcome='rendered')
+                        
+                        # 只转换当前页
+                        with children_rusage_stage('pdftoppm'):
+                            page_images = convert_from_path(
+                                tmp_pdf_path,
+                                dpi=200,
+                                fmt='jpeg',
+                                thread_count=1,  # 减少线程数降低内存使用
+                                first_page=page_num,
+                                last_page=page_num
+                            )
                     
-                    if not page_images:
-                        continue
+                        if not page_images:
+                            continue
                         
-                    # 确保所有图像都被正确处理和关闭
-                    for idx, img in enumerate(page_images):
-                        try:
-                            with img:
-                                if idx == 0:  # 只处理第一张图片
-                                    result = process_image(img)
-                                    last_result = result
-                                    if result['nsfw'] > NSFW_THRESHOLD:
-                                        logger.info(f"在第 {page_num} 页发现匹配内容")
-                                        return result
-                        except Exception as img_err:
-                            logger.error(f"处理PDF第 {page_num} 页图像 {idx} 时出错: {str(img_err)}")
-                        finally:
-                            # 确保每张图片都被显式关闭
-                            if hasattr(img, 'close') and callable(img.close):
-                                try:
-                                    img.close()
-                                except Exception:
-                                    pass
+                        # 确保所有图像都被正确处理和关闭
+                        for idx, img in enumerate(page_images):
+                            try:
+                                with img:
+                                    if idx == 0:  # 只处理第一张图片
+                                        result = process_image(img)
+                                        last_result = result
+                                        if result['nsfw'] > ctx.threshold:
+                                            logger.info(f"在第 {page_num} 页发现匹配内容")
+                                            return result
+                            except Exception as img_err:
+                                logger.error(f"处理PDF第 {page_num} 页图像 {idx} 时出错: {str(img_err)}")
+                            finally:
+                                # 确保每张图片都被显式关闭
+                                if hasattr(img, 'close') and callable(img.close):
+                                    try:
+                                        img.close()
+                                    except Exception:
+                                        pass
                                     
                 except Exception as e:
                     logger.error(f"处理PDF第 {page_num} 页时出错: {str(e)}")
                 finally:
+                    ctx.report_progress('pages', page_num, page_count)
+                    
                     # 显式删除图像列表并强制垃圾回收
                     if page_images is not None:
                         for img in page_images:
@@ -456,15 +800,19 @@ def process_pdf_file(pdf_stream):
                         del page_images
                         gc.collect()
             
-            logger.info("PDF处理完成")
+            logger.info(f"PDF处理完成，跳过 {skipped_pages} 页空白或纯文字页")
+            if last_result is None and skipped_pages:
+                # 所有页面均被预判为空白或纯文字
+                return dict(NORMAL_RESULT)
             return last_result  # 返回最后一次处理结果
             
         finally:
             # 清理临时PDF文件
-            try:
-                os.unlink(tmp_pdf_path)
-            except Exception as e:
-                logger.error(f"清理临时PDF文件失败: {str(e)}")
+            if owns_tmp_pdf:
+                try:
+                    os.unlink(tmp_pdf_path)
+                except Exception as e:
+                    logger.error(f"清理临时PDF文件失败: {str(e)}")
             
             # 强制垃圾回收
             gc.collect()
@@ -474,128 +822,253 @@ def process_pdf_file(pdf_stream):
         raise Exception(f"PDF processing failed: {str(e)}")
     
 def process_doc_file(file_content):
-    """处理 .doc 文件"""
-    try:
-        # 创建临时文件来存储 .doc 内容
-        with tempfile.NamedTemporaryFile(suffix='.doc', delete=False) as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file_path = tmp_file.name
-
-        try:
-            # 使用 antiword 将 .doc 转换为文本
-            result = subprocess.run(
-                ['antiword', '-i', '1', tmp_file_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=300
-            )
-
-            # 创建临时目录提取图片
-            img_dir = tempfile.mkdtemp()
-            try:
-                # 检查是否包含图片（使用 antiword 的图片提取模式）
-                subprocess.run(
-                    ['antiword', '-i', '2', '-o', img_dir, tmp_file_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=300
-                )
-
-                # 检查提取的图片
-                last_result = None
-                for img_file in os.listdir(img_dir):
-                    if img_file.endswith(('.png', '.jpg', '.jpeg')):
-                        img_path = os.path.join(img_dir, img_file)
-                        # 使用with语句确保图像被关闭
-                        with Image.open(img_path) as img:
-                            result = process_image(img)
-                            last_result = result
-                            if result['nsfw'] > NSFW_THRESHOLD:
-                                return result
-                        
-                        # 处理完一张图片后强制垃圾回收
-                        gc.collect()
+    """处理 .doc 文件
 
+    在进程内解析 OLE2 复合文件，一次性取出 Data/WordDocument 流中的位图 BLIP 记录，
+    不再调用外部工具，图片按 INFERENCE_BATCH_SIZE 分批推理。
+    """
+    try:
+        last_result = None
+        batch = []
+        for name, content in extract_doc_images(file_content):
+            if len(content) < DOCUMENT_MIN_IMAGE_BYTES:
+                continue
+            img = _load_document_image(name, content)
+            if img is None:
+                continue
+            batch.append((name, img))
+            if len(batch) < INFERENCE_BATCH_SIZE:
+                continue
+            last_result, matched = _classify_image_batch(batch)
+            batch = []
+            if matched:
                 return last_result
-            finally:
-                # 清理临时图片目录
-                if os.path.exists(img_dir):
-                    shutil.rmtree(img_dir)
-
-        finally:
-            # 清理临时文件
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
-            
-            # 强制垃圾回收
-            gc.collect()
+        
+        if batch:
+            last_result, _ = _classify_image_batch(batch)
+        
+        return last_result
 
     except Exception as e:
         logger.error(f"处理 DOC 文件失败: {str(e)}")
         raise Exception(f"DOC processing failed: {str(e)}")
 
-def process_docx_file(file_content):
-    """处理 .docx 文件"""
+def _classify_image_batch(batch):
+    """批量检测 [(名称, 图片)]，返回 (结果, 是否匹配)
+
+    有匹配时返回第一个超过阈值的结果，否则返回最后一个结果。检测后关闭所有图片。
+    """
     try:
-        # 创建临时文件来存储 .docx 内容
-        with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file_path = tmp_file.name
+        results = classify_images([img for _, img in batch])
+    finally:
+        for _, img in batch:
+            img.close()
+    
+    for (name, _), result in zip(batch, results):
+        if result['nsfw'] > current_context().threshold:
+            logger.info(f"在文档图片 {name} 中发现匹配内容")
+            return result, True
+    return results[-1], False
 
-        try:
-            # 使用 python-docx 加载文档
-            doc = Document(tmp_file_path)
-            
-            # 提取和处理所有图片
-            last_result = None
-            for rel in doc.part.rels.values():
-                if "image" in rel.target_ref:
-                    try:
-                        image_data = rel.target_part.blob
-                        # 使用with语句确保图像被关闭
-                        with Image.open(io.BytesIO(image_data)) as img:
-                            result = process_image(img)
-                            last_result = result
-                            if result['nsfw'] > NSFW_THRESHOLD:
-                                return result
-                        
-                        # 处理完一张图片后强制垃圾回收
-                        gc.collect()
-                    except Exception as img_error:
-                        logger.error(f"处理 DOCX 中的图片失败: {str(img_error)}")
-                        continue
+def _load_document_image(name, content):
+    """解码文档中的图片，边长过小或无法解码时返回 None"""
+    try:
+        with stage('decode'), Image.open(io.BytesIO(content)) as raw:
+            if min(raw.size) < DOCUMENT_MIN_IMAGE_SIDE:
+                return None
+            return raw.convert('RGB')
+    except Exception as img_error:
+        logger.error(f"读取文档中的图片 {name} 失败: {str(img_error)}")
+        return None
 
-            return last_result
+def _iter_document_images(handler, ext):
+    """逐个返回文档容器中需要检测的图片
 
-        finally:
-            # 清理临时文件
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
+    只读取 ZIP_MEDIA_DOCUMENT_DIRS 指定目录下的图片，按中央目录记录的大小跳过过小的图片，
+    相同内容的图片（SHA1 相同）只检测一次；中央目录记录的 CRC 可以伪造，不用于去重。
+    """
+    prefixes = ZIP_MEDIA_DOCUMENT_DIRS.get(ext, ('',))
+    seen_hashes = set()
+    for name in handler.list_files():
+        if not name.startswith(prefixes) or get_file_extension(name) not in IMAGE_EXTENSIONS:
+            continue
+        if handler.get_file_info(name) < DOCUMENT_MIN_IMAGE_BYTES:
+            continue
+        
+        content = handler.extract_file(name)
+        digest = hashlib.sha1(content).digest()
+        if digest in seen_hashes:
+            continue
+        seen_hashes.add(digest)
+        
+        img = _load_document_image(name, content)
+        if img is not None:
+            yield name, img
+
+def process_office_file(source, ext):
+    """处理基于 ZIP 容器的文档（docx/xlsx/pptx/odt/ods/odp/epub）
+
+    直接从容器的媒体目录读取图片，不解析文档结构，图片按 INFERENCE_BATCH_SIZE 分批推理。
+
+    Args:
+        source: 文档文件路径，或文档内容的可定位文件对象
+        ext: 文档扩展名，决定图片所在目录
+    """
+    try:
+        with ArchiveHandler(source, f"document{ext}") as handler:
+            if handler.type != 'zip':
+                raise Exception("文档不是有效的 ZIP 容器")
             
-            # 强制垃圾回收
-            gc.collect()
+            last_result = None
+            batch = []
+            for item in _iter_document_images(handler, ext):
+                batch.append(item)
+                if len(batch) < INFERENCE_BATCH_SIZE:
+                    continue
+                last_result, matched = _classify_image_batch(batch)
+                batch = []
+                if matched:
+                    return last_result
+            
+            if batch:
+                last_result, _ = _classify_image_batch(batch)
+            
+            return last_result
 
+    except BudgetExceeded:
+        raise
     except Exception as e:
-        logger.error(f"处理 DOCX 文件失败: {str(e)}")
-        raise Exception(f"DOCX processing failed: {str(e)}")
+        logger.error(f"处理 {ext} 文档失败: {str(e)}")
+        raise Exception(f"Document processing failed: {str(e)}")
 
-def process_video_file(video_path):
-    """处理视频文件的入口函数"""
-    processor = VideoProcessor(video_path)
+def process_docx_file(file_content):
+    """处理 .docx 文件"""
+    return process_office_file(io.BytesIO(file_content), '.docx')
+
+def process_video_file(video_path, stream_opener=None):
+    """处理视频文件的入口函数
+
+    Args:
+        video_path: 视频文件路径
+        stream_opener: 可选，返回视频内容只读流的函数，提供时通过管道送入 ffmpeg
+    """
+    processor = VideoProcessor(video_path, stream_opener)
     result = processor.process()
     # 处理完视频后强制垃圾回收
     gc.collect()
     return result
 
-def process_archive(filepath, filename, depth=0, max_depth=100):
+class _NestedArchiveSpool:
+    """嵌套压缩包的写入目标：内容不超过 memory_limit 时保存在内存中，超过后转存到临时文件
+
+    是否超限按实际写入的字节数判断，不依赖压缩包头部记录的大小（GZ 的 ISIZE 可被伪造）。
+    """
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.size = 0
+        self.path = None
+        self._file = io.BytesIO()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.path is None and self.size > self.memory_limit:
+            spool = tempfile.NamedTemporaryFile(delete=False)
+            spool.write(self._file.getbuffer())
+            self._file = spool
+            self.path = spool.name
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    @property
+    def name(self):
+        return self.path
+
+    def close(self):
+        """关闭临时文件；内容仍在内存中时保留，供 getvalue() 读取"""
+        if self.path is not None:
+            self._file.close()
+
+    def getvalue(self):
+        return self._file.getvalue()
+
+def _needs_seekable_input(stream, ext):
+    """判断视频是否必须从可定位的文件读取
+
+    MP4/MOV 系列若 moov 位于 mdat 之后（未做 faststart），ffmpeg 无法从管道解析，
+    这里只读取开头几个顶层 atom 的头部进行判断。
+    """
+    if ext not in SEEKABLE_VIDEO_EXTENSIONS:
+        return False
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            return True
+        size = int.from_bytes(header[:4], 'big')
+        atom = header[4:]
+        if atom == b'moov':
+            return False
+        if atom == b'mdat':
+            return True
+        if size == 1:
+            size = int.from_bytes(stream.read(8), 'big') - 8
+        elif size == 0:
+            return True
+        skip = size - 8
+        # 开头出现较大的未知 atom 时按需要定位处理
+        if skip < 0 or skip > 1024 * 1024:
+            return True
+        stream.read(skip)
+
+def _process_media_member(handler, inner_filename, ext, budget):
+    """处理压缩包中的 PDF 和视频成员，尽量避免整体读入内存和重复落盘
+
+    RAR/7z 成员已解压在磁盘上，直接使用其路径；ZIP/GZ 中头部记录了时长的视频通过管道
+    送入 ffmpeg，其他容器、需要定位读取的 MP4 和 PDF（poppler 需要随机访问）流式写入
+    一个临时文件；管道输入探测不到时长时同样改为临时文件。
+    """
+    member_path = handler.get_member_path(inner_filename)
+    if member_path:
+        if ext == '.pdf':
+            return process_pdf_file(member_path)
+        return process_video_file(member_path)
+
+    if ext in PIPE_VIDEO_EXTENSIONS:
+        with handler.open_member(inner_filename) as probe:
+            needs_seek = _needs_seekable_input(probe, ext)
+        if not needs_seek:
+            try:
+                return process_video_file(None, lambda: handler.open_member(inner_filename))
+            except StreamDurationUnknown:
+                logger.info(f"管道输入无法获取时长，改为临时文件: {inner_filename}")
+
+    temp_media = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
+    try:
+        with temp_media:
+            handler.extract_to_file(inner_filename, temp_media)
+        if ext == '.pdf':
+            return process_pdf_file(temp_media.name)
+        return process_video_file(temp_media.name)
+    finally:
+        if os.path.exists(temp_media.name):
+            os.unlink(temp_media.name)
+
+def process_archive(filepath, filename, depth=0):
     """处理压缩文件，支持嵌套压缩包
     
+    解压字节数、成员数、嵌套深度和耗时受当前请求的扫描预算限制，
+    预算耗尽时返回已处理部分的结果。
+    
     Args:
-        filepath: 压缩文件路径
+        filepath: 压缩文件路径，或内存中 ZIP/GZ 内容的可定位文件对象
         filename: 原始文件名
         depth: 当前递归深度
-        max_depth: 最大递归深度，防止过深的嵌套
     """
+    with scan_context() as ctx:
+        return _scan_archive(filepath, filename, depth, ctx.budget)
+
+def _scan_archive(filepath, filename, depth, budget):
     temp_dir = None
     try:
         # 确保 filename 正确编码
@@ -605,26 +1078,29 @@ def process_archive(filepath, filename, depth=0, max_depth=100):
                 encoded_filename = temp_handler.__encode_filename(filename)
                 
         # 检查递归深度
-        if depth > max_depth:
-            logger.warning(f"达到最大递归深度 {max_depth}")
+        try:
+            budget.check_depth(depth)
+        except BudgetExceeded as e:
             return {
                 'status': 'error',
-                'message': f'Maximum archive nesting depth ({max_depth}) exceeded'
+                'message': str(e)
             }, 400
 
         # 创建临时目录
         temp_dir = tempfile.mkdtemp()
-        logger.info(f"处理压缩文件: {encoded_filename}, 深度: {depth}, 临时文件路径: {filepath}")
+        source_desc = filepath if isinstance(filepath, str) else '内存'
+        logger.info(f"处理压缩文件: {encoded_filename}, 深度: {depth}, 临时文件路径: {source_desc}")
         
-        # 检查文件大小
-        file_size = os.path.getsize(filepath)
-        if file_size > MAX_FILE_SIZE:
-            return {
-                'status': 'error',
-                'message': 'File too large'
-            }, 400
+        # 检查文件大小（内存中的嵌套压缩包已受 NESTED_ARCHIVE_MEMORY_LIMIT 限制）
+        if isinstance(filepath, str):
+            file_size = os.path.getsize(filepath)
+            if file_size > MAX_FILE_SIZE:
+                return {
+                    'status': 'error',
+                    'message': 'File too large'
+                }, 400
 
-        with ArchiveHandler(filepath) as handler:
+        with ArchiveHandler(filepath, filename) as handler:
             # 获取文件列表
             files = handler.list_files()
             
@@ -649,77 +1125,107 @@ def process_archive(filepath, filename, depth=0, max_depth=100):
                     'message': 'No processable files found in archive'
                 }, 400
 
+            last_result = None
+            
             # 先处理可直接处理的文件
             if processable_files:
-                sorted_files = sort_files_by_priority(handler, processable_files)
-                last_result = None
+                ctx = current_context()
+                if ctx.sampling:
+                    # 抽样模式：成员数超过样本预算时返回 SamplingPlan，否则仍按优先级全量扫描
+                    sorted_files = member_scheduler.plan(
+                        processable_files, handler.get_file_info, ctx.sample_budget, ctx.threshold
+                    )
+                else:
+                    sorted_files = sort_files_by_priority(handler, processable_files)
+                sampling_plan = sorted_files if isinstance(sorted_files, SamplingPlan) else None
                 matched_content = None
                 
                 for inner_filename in sorted_files:
                     try:
+                        budget.check_time()
+                        budget.consume_member()
+                        current_context().report_progress('members', budget.members)
+                        
                         # 确保内部文件名已正确编码
                         if isinstance(inner_filename, bytes):
                             inner_filename = handler.__encode_filename(inner_filename)
                             
-                        content = handler.extract_file(inner_filename)
                         ext = os.path.splitext(inner_filename)[1].lower()
                         
-                        if ext in IMAGE_EXTENSIONS:
-                            # 使用with语句确保图像被关闭
-                            with Image.open(io.BytesIO(content)) as img:
-                                result = process_image(img)
-                                last_result = {
-                                    'matched_file': inner_filename,
-                                    'result': result
-                                }
-                                
-                                if result['nsfw'] > NSFW_THRESHOLD:
-                                    matched_content = last_result
-                                    break
+                        with span('member', path=inner_filename) as member_span:
+                            # 先按头部记录的 CRC 和大小查询成员缓存；头部可以伪造，命中后默认解压
+                            # 校验实际内容的 CRC，一致才使用缓存结果（省去推理）
+                            member_key = handler.get_member_key(inner_filename)
+                            result = member_cache.get(member_key, ext)
+                            if result is not None and MEMBER_CACHE_VERIFY and \
+                                    not handler.verify_member(inner_filename, member_key):
+                                logger.warning(f"成员 {inner_filename} 的内容与头部 CRC 不一致，不使用缓存结果")
+                                result = None
+                            if result is not None:
+                                logger.info(f"命中成员缓存: {inner_filename}")
+                                member_span.set(cached=True)
+                            else:
+                                started = time.monotonic()
+                                truncations_before = budget.truncations
+                                if ext in IMAGE_EXTENSIONS:
+                                    content = handler.extract_file(inner_filename)
+                                    # 使用with语句确保图像被关闭
+                                    with Image.open(io.BytesIO(content)) as img:
+                                        with stage('decode'):
+                                            img.load()
+                                        result = process_image(img)
+                                    del content
                             
-                            # 处理完一张图片后强制垃圾回收
-                            gc.collect()
-                        
-                        elif ext == '.pdf':
-                            result = process_pdf_file(content)
-                            if result:
-                                last_result = {
-                                    'matched_file': inner_filename,
-                                    'result': result
-                                }
-                                if result['nsfw'] > NSFW_THRESHOLD:
-                                    matched_content = last_result
-                                    break
+                                elif ext == '.pdf' or ext in VIDEO_EXTENSIONS:
+                                    result = _process_media_member(handler, inner_filename, ext, budget)
+                            
+                                elif ext in ZIP_MEDIA_DOCUMENT_DIRS:
+                                    result = process_office_file(io.BytesIO(handler.extract_file(inner_filename)), ext)
                             
-                            # 处理完PDF后强制垃圾回收
-                            gc.collect()
+                                elif ext == '.doc':
+                                    result = process_doc_file(handler.extract_file(inner_filename))
+                            
+                                # 按请求缩减预算得到的结果，或处理该成员期间预算耗尽（视频帧、PDF 页未处理完）
+                                # 得到的部分结果不能代表该成员，不写入缓存
+                                if not ctx.custom_limits and not budget.exceeded and \
+                                        budget.truncations == truncations_before:
+                                    member_cache.put(member_key, ext, result)
+                                member_scheduler.record_cost(
+                                    inner_filename,
+                                    handler.get_file_info(inner_filename),
+                                    time.monotonic() - started
+                                )
                         
-                        elif ext in VIDEO_EXTENSIONS:
-                            temp_video = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-                            try:
-                                with open(temp_video.name, 'wb') as f:
-                                    f.write(content)
-                                
-                                result = process_video_file(temp_video.name)
-                                if result:
-                                    last_result = {
-                                        'matched_file': inner_filename,
-                                        'result': result
-                                    }
-                                    if result['nsfw'] > NSFW_THRESHOLD:
-                                        matched_content = last_result
-                                        break
-                            finally:
-                                if os.path.exists(temp_video.name):
-                                    os.unlink(temp_video.name)
-                                
-                                # 处理完视频后强制垃圾回收
-                                gc.collect()
+                        if sampling_plan is not None:
+                            sampling_plan.observe(inner_filename, result)
+                        
+                        if result:
+                            last_result = {
+                                'matched_file': inner_filename,
+                                'result': result
+                            }
+                            if result['nsfw'] > ctx.threshold:
+                                member_scheduler.record_hit(inner_filename)
+                                matched_content = last_result
+                                break
+                        
+                        # 处理完一个文件后强制垃圾回收
+                        gc.collect()
                                     
+                    except BudgetExceeded:
+                        break
                     except Exception as e:
                         logger.error(f"处理文件 {inner_filename} 时出错: {str(e)}")
                         continue
 
+                if sampling_plan is not None:
+                    ctx.record_sampling(
+                        sampling_plan.members_total,
+                        sampling_plan.scanned,
+                        len(sampling_plan.escalated_dirs),
+                        sampling_plan.stopped_early
+                    )
+                
                 if matched_content:
                     logger.info(f"在压缩包 {encoded_filename} 中发现匹配内容: {matched_content['matched_file']}")
                     return {
@@ -730,24 +1236,51 @@ def process_archive(filepath, filename, depth=0, max_depth=100):
 
             # 处理嵌套的压缩包
             for nested_archive in nested_archives:
+                if budget.exceeded:
+                    break
+                temp_nested = None
                 try:
+                    budget.check_time()
+                    budget.consume_member()
+                    current_context().report_progress('members', budget.members)
+                    
                     # 确保嵌套压缩包文件名已正确编码
                     if isinstance(nested_archive, bytes):
                         nested_archive = handler.__encode_filename(nested_archive)
                         
-                    temp_nested = tempfile.NamedTemporaryFile(delete=False)
-                    content = handler.extract_file(nested_archive)
+                    # RAR/7z 成员已解压在磁盘上，直接使用其路径
+                    nested_source = handler.get_member_path(nested_archive)
                     
-                    with open(temp_nested.name, 'wb') as f:
-                        f.write(content)
+                    # 较小的 ZIP/GZ 嵌套压缩包直接在内存中打开，解压超过内存上限时转存到临时文件
+                    if nested_source is None:
+                        spool = _NestedArchiveSpool(NESTED_ARCHIVE_MEMORY_LIMIT)
+                        try:
+                            handler.extract_to_file(nested_archive, spool)
+                        finally:
+                            spool.close()
+                            if spool.path:
+                                temp_nested = spool
+                        if spool.path:
+                            nested_source = spool.path
+                        else:
+                            content = spool.getvalue()
+                            if content.startswith((b'PK\x03\x04', b'PK\x05\x06', b'\x1f\x8b')):
+                                nested_source = io.BytesIO(content)
+                            else:
+                                temp_nested = tempfile.NamedTemporaryFile(delete=False)
+                                with temp_nested:
+                                    temp_nested.write(content)
+                                nested_source = temp_nested.name
+                            del content
                     
                     # 递归处理嵌套压缩包
-                    nested_result = process_archive(
-                        temp_nested.name,
-                        nested_archive,
-                        depth + 1,
-                        max_depth
-                    )
+                    with span('nested_archive', path=nested_archive):
+                        nested_result = process_archive(
+                            nested_source,
+                            nested_archive,
+                            depth + 1
+                        )
+                    del nested_source
                     
                     # 如果找到匹配内容，直接返回
                     if isinstance(nested_result, tuple):
@@ -760,11 +1293,13 @@ def process_archive(filepath, filename, depth=0, max_depth=100):
                     # 处理完一个嵌套压缩包后强制垃圾回收
                     gc.collect()
                         
+                except BudgetExceeded:
+                    break
                 except Exception as e:
                     logger.error(f"处理嵌套压缩包 {nested_archive} 时出错: {str(e)}")
                     continue
                 finally:
-                    if os.path.exists(temp_nested.name):
+                    if temp_nested is not None and os.path.exists(temp_nested.name):
                         os.unlink(temp_nested.name)
 
             # 如果所有文件都处理完还没有返回，返回最后一个结果
@@ -776,11 +1311,22 @@ def process_archive(filepath, filename, depth=0, max_depth=100):
                     'result': last_result['result']
                 }
             
+            if budget.exceeded:
+                return {
+                    'status': 'error',
+                    'message': f'Scan budget exceeded before any file was processed: {budget.exceeded}'
+                }, 400
+            
             return {
                 'status': 'error',
                 'message': 'No files could be processed successfully'
             }, 400
 
+    except BudgetExceeded as e:
+        return {
+            'status': 'error',
+            'message': str(e)
+        }, 400
     except Exception as e:
         logger.error(f"处理压缩包时出错: {str(e)}")
         return {
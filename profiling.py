@@ -0,0 +1,152 @@
+# profiling.py
+import contextvars
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from metrics import stage_timer
+
+# 当前线程所在的 (ScanProfile, ProfileSpan)，未开启性能分析时为 None
+_current_span = contextvars.ContextVar('profile_span', default=None)
+
+class ProfileSpan:
+    """性能分析树中的一个节点"""
+    __slots__ = ('name', 'attrs', 'seconds', 'children', '_lock')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.seconds = None
+        self.children = []
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, child):
+        with self._lock:
+            self.children.append(child)
+
+    def to_dict(self):
+        node = {'name': self.name}
+        if self.seconds is not None:
+            node['seconds'] = round(self.seconds, 6)
+        node.update(self.attrs)
+        if self.children:
+            node['children'] = [child.to_dict() for child in self.children]
+        return node
+
+class _NullSpan:
+    """未开启性能分析时使用的空节点"""
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class ScanProfile:
+    """单次请求的耗时树（profile=1 时返回给调用方）"""
+    def __init__(self):
+        self.root = ProfileSpan('scan')
+        self._started = time.perf_counter()
+
+    def activate(self):
+        return _current_span.set((self, self.root))
+
+    def deactivate(self, token):
+        _current_span.reset(token)
+
+    def to_dict(self):
+        self.root.seconds = time.perf_counter() - self._started
+        return self.root.to_dict()
+
+@contextmanager
+def _span(profile, parent, name, attrs):
+    node = ProfileSpan(name, attrs)
+    parent.add(node)
+    token = _current_span.set((profile, node))
+    started = time.perf_counter()
+    try:
+        yield node
+    finally:
+        node.seconds = time.perf_counter() - started
+        _current_span.reset(token)
+
+def span(name, **attrs):
+    """在耗时树中记录一个节点；未开启性能分析时返回空节点，几乎没有开销"""
+    current = _current_span.get()
+    if current is None:
+        return _NULL_SPAN
+    return _span(current[0], current[1], name, attrs)
+
+@contextmanager
+def stage(name, **attrs):
+    """记录处理阶段：同时写入阶段耗时指标和耗时树"""
+    with stage_timer(name), span(name, **attrs) as node:
+        yield node
+
+def record_rusage(node, rusage):
+    """把子进程的 CPU 时间和峰值内存写入节点"""
+    if rusage is None:
+        return
+    node.set(
+        cpu_user=round(rusage.ru_utime, 6),
+        cpu_system=round(rusage.ru_stime, 6),
+        max_rss_kb=rusage.ru_maxrss
+    )
+
+@contextmanager
+def children_rusage_stage(name, **attrs):
+    """记录由第三方库启动的子进程（如 pdf2image 调用的 pdftoppm）
+
+    无法取得这类子进程的 pid，CPU 时间取自本进程已回收子进程的 rusage 差值，
+    同时有其他子进程结束时会一并计入。
+    """
+    with stage(name, **attrs) as node:
+        if node is _NULL_SPAN:
+            yield node
+            return
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield node
+        finally:
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            node.set(
+                cpu_user=round(after.ru_utime - before.ru_utime, 6),
+                cpu_system=round(after.ru_stime - before.ru_stime, 6)
+            )
+
+class ProfiledPopen(subprocess.Popen):
+    """回收子进程时使用 wait4，保留该子进程自身的 rusage"""
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # 与 Popen._try_wait 一致：子进程已被回收时按正常退出处理
+            return self.pid, 0
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, sts
+
+def run_subprocess(cmd, timeout=None, **kwargs):
+    """与 subprocess.run 相同，并在耗时树中记录子进程的墙钟时间和 CPU 时间"""
+    with stage(os.path.basename(cmd[0])) as node:
+        with ProfiledPopen(cmd, **kwargs) as process:
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            finally:
+                record_rusage(node, process.rusage)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
@@ -0,0 +1,226 @@
+# scan.py
+import argparse
+import json
+import os
+import sqlite3
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import ARCHIVE_EXTENSIONS, NSFW_THRESHOLD, DIRECTORY_SCAN_WORKERS
+from utils import can_process_file, get_file_extension
+from detector import scan_file, detect_file_type
+
+logger = logging.getLogger(__name__)
+
+# 结果文件扩展名为以下之一时写入 SQLite，否则写入 JSONL
+SQLITE_OUTPUT_EXTENSIONS = {'.db', '.sqlite', '.sqlite3'}
+
+def is_scan_candidate(filename):
+    """按扩展名判断文件是否需要检查（可直接处理的文件或压缩包）"""
+    return can_process_file(filename) or get_file_extension(filename) in ARCHIVE_EXTENSIONS
+
+def iter_directory(root, sniff=False):
+    """用 os.scandir 非递归地遍历目录树，返回需要检查的文件路径
+
+    不跟随符号链接；sniff 为 True 时返回所有普通文件，由检查时的类型嗅探决定是否处理。
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error(f"无法读取目录 {directory}: {str(e)}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and (sniff or is_scan_candidate(entry.name)):
+                    yield entry.path
+            except OSError as e:
+                logger.error(f"无法读取 {entry.path}: {str(e)}")
+        stack.extend(reversed(subdirs))
+
+class JsonlResultWriter:
+    """以 JSONL 追加写入检查结果，已写入的路径作为断点续扫的依据"""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def completed_paths(self):
+        completed = set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    # 中断时可能留下不完整的最后一行
+                    continue
+        return completed
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class SqliteResultWriter:
+    """将检查结果写入 SQLite 的 scan_results 表，按路径去重"""
+    def __init__(self, path, commit_interval=100):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS scan_results ('
+            'path TEXT PRIMARY KEY, status TEXT, status_code INTEGER, '
+            'nsfw REAL, normal REAL, record TEXT, scanned_at REAL)'
+        )
+        self._conn.commit()
+
+    def completed_paths(self):
+        return {row[0] for row in self._conn.execute('SELECT path FROM scan_results')}
+
+    def write(self, record):
+        result = record.get('result') or {}
+        self._conn.execute(
+            'INSERT OR REPLACE INTO scan_results '
+            '(path, status, status_code, nsfw, normal, record, scanned_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (record['path'], record.get('status'), record.get('status_code'),
+             result.get('nsfw'), result.get('normal'),
+             json.dumps(record, ensure_ascii=False), record.get('scanned_at'))
+        )
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+def open_result_writer(path):
+    """按输出文件扩展名选择结果写入器"""
+    if get_file_extension(path) in SQLITE_OUTPUT_EXTENSIONS:
+        return SqliteResultWriter(path)
+    return JsonlResultWriter(path)
+
+class DirectoryScanner:
+    """目录扫描器
+
+    遍历目录树，把文件分发给线程池检查（线程共享同一个模型，图片推理由批处理器合并），
+    结果逐条写入输出文件。输出文件同时作为断点：重新运行时跳过已有结果的路径。
+    """
+    def __init__(self, root, output, workers=None, sniff=False, resume=True, scan_options=None):
+        self.root = os.path.abspath(root)
+        self.output = output
+        self.workers = max(1, workers or DIRECTORY_SCAN_WORKERS)
+        self.sniff = sniff
+        self.resume = resume
+        self.scan_options = scan_options or {}
+        self.on_progress = None  # 每写入一条结果后回调，参数为统计信息
+        self.stats = {'scanned': 0, 'matched': 0, 'errors': 0, 'skipped': 0, 'resumed': 0}
+
+    def _scan_one(self, path):
+        record = {'path': path}
+        try:
+            if self.sniff and not is_scan_candidate(path):
+                mime_type, ext = detect_file_type(path)
+                if not ext:
+                    record.update({'status': 'skipped', 'message': f'Unsupported file type: {mime_type}'})
+                    return record
+            result, status_code = scan_file(path, os.path.basename(path), self.scan_options, use_index=True)
+            record.update(result)
+            record['status_code'] = status_code
+        except Exception as e:
+            logger.error(f"检查文件 {path} 失败: {str(e)}")
+            record.update({'status': 'error', 'message': str(e), 'status_code': 500})
+        return record
+
+    def _record(self, writer, futures):
+        for future in futures:
+            record = future.result()
+            record['scanned_at'] = time.time()
+            writer.write(record)
+
+            if record['status'] == 'skipped':
+                self.stats['skipped'] += 1
+            elif record['status'] != 'success':
+                self.stats['errors'] += 1
+            else:
+                self.stats['scanned'] += 1
+                if record['result']['nsfw'] > self.scan_options.get('threshold', NSFW_THRESHOLD):
+                    self.stats['matched'] += 1
+
+            if self.on_progress is not None:
+                self.on_progress(self.stats)
+
+    def run(self):
+        """执行扫描，返回统计信息"""
+        writer = open_result_writer(self.output)
+        try:
+            completed = writer.completed_paths() if self.resume else set()
+            self.stats['resumed'] = len(completed)
+            logger.info(f"开始扫描目录 {self.root}，已完成 {len(completed)} 个文件，工作线程 {self.workers} 个")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = set()
+                for path in iter_directory(self.root, self.sniff):
+                    if path in completed:
+                        continue
+                    pending.add(executor.submit(self._scan_one, path))
+                    # 限制排队的文件数，避免遍历大目录时积压过多任务
+                    if len(pending) >= self.workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._record(writer, done)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._record(writer, done)
+        finally:
+            writer.close()
+
+        logger.info(f"目录扫描完成: {self.stats}")
+        return dict(self.stats, root=self.root, output=self.output)
+
+def main():
+    parser = argparse.ArgumentParser(description='Recursively check a directory tree')
+    parser.add_argument('root', help='directory to scan')
+    parser.add_argument('-o', '--output', required=True,
+                        help='result file (.jsonl, or .db/.sqlite for SQLite); also used as the resume checkpoint')
+    parser.add_argument('-w', '--workers', type=int, default=DIRECTORY_SCAN_WORKERS,
+                        help='number of files checked in parallel')
+    parser.add_argument('--sniff', action='store_true',
+                        help='also sniff files whose extension is not recognised')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='rescan files that already have a result in the output file')
+    parser.add_argument('--scan-mode', choices=['full', 'sample'], help='archive scan mode')
+    parser.add_argument('--sample-budget', type=int, help='members sampled per archive in sample mode')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f'not a directory: {args.root}')
+
+    scan_options = {}
+    if args.scan_mode:
+        scan_options['scan_mode'] = args.scan_mode
+    if args.sample_budget:
+        scan_options['sample_budget'] = args.sample_budget
+
+    scanner = DirectoryScanner(
+        args.root, args.output,
+        workers=args.workers,
+        sniff=args.sniff,
+        resume=not args.no_resume,
+        scan_options=scan_options
+    )
+    print(json.dumps(scanner.run(), ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
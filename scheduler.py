@@ -0,0 +1,187 @@
+# scheduler.py
+import os
+import random
+import threading
+import logging
+import zlib
+from collections import OrderedDict, deque
+from pathlib import Path
+from config import (
+    IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, DOCUMENT_EXTENSIONS,
+    SCHEDULER_HINT_KEYWORDS, SCHEDULER_HINT_BOOST, SCHEDULER_HIT_DIR_BOOST,
+    NSFW_THRESHOLD, SAMPLE_MIN_MEMBERS, SAMPLE_MAX_PREVALENCE, SAMPLE_SUSPICIOUS_SCORE
+)
+
+logger = logging.getLogger(__name__)
+
+# 各类型的初始估计：单个文件最低耗时（毫秒）、每MB耗时（毫秒）、命中先验概率
+DEFAULT_COST_MODEL = {
+    'image': (60.0, 40.0, 0.30),
+    'pdf': (400.0, 300.0, 0.15),
+    'video': (3000.0, 60.0, 0.30),
+    'document': (300.0, 150.0, 0.15),
+}
+
+def get_media_kind(filename):
+    """按扩展名返回调度使用的文件类别，不可处理的文件返回 None"""
+    ext = Path(filename).suffix.lower()
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    elif ext == '.pdf':
+        return 'pdf'
+    elif ext in VIDEO_EXTENSIONS:
+        return 'video'
+    elif ext in DOCUMENT_EXTENSIONS:
+        return 'document'
+    return None
+
+class MemberScheduler:
+    """压缩包成员调度器
+
+    按 "预计耗时 / 命中概率" 从小到大排序成员（Smith 规则），使含有匹配内容的
+    压缩包尽快得到第一个命中结果。耗时按运行中实测的各类型每MB处理时间估计，
+    命中概率由类型先验、路径关键词和近期命中过的目录共同决定。
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = MemberScheduler()
+        return cls._instance
+
+    def __init__(self, ema_alpha=0.2, max_hit_dirs=1000):
+        self.ema_alpha = ema_alpha
+        self.max_hit_dirs = max_hit_dirs
+        self.ms_per_mb = {kind: model[1] for kind, model in DEFAULT_COST_MODEL.items()}
+        self.hint_keywords = [k.strip().lower() for k in str(SCHEDULER_HINT_KEYWORDS).split(',') if k.strip()]
+        self._hit_dirs = OrderedDict()  # 近期产生命中的目录名，LRU
+        self._lock = threading.Lock()
+
+    def record_cost(self, filename, size, seconds):
+        """记录一次实际处理耗时，用于更新该类型的每MB耗时估计"""
+        kind = get_media_kind(filename)
+        if kind is None or size <= 0 or seconds <= 0:
+            return
+        sample = seconds * 1000.0 / max(size / (1024 * 1024), 0.01)
+        with self._lock:
+            current = self.ms_per_mb[kind]
+            self.ms_per_mb[kind] = current + self.ema_alpha * (sample - current)
+
+    def record_hit(self, filename):
+        """记录产生命中的成员所在目录，后续同名目录中的成员优先处理"""
+        directory = self._normalize_dir(filename)
+        if not directory:
+            return
+        with self._lock:
+            self._hit_dirs[directory] = True
+            self._hit_dirs.move_to_end(directory)
+            while len(self._hit_dirs) > self.max_hit_dirs:
+                self._hit_dirs.popitem(last=False)
+
+    def _normalize_dir(self, filename):
+        return os.path.dirname(filename.replace('\\', '/')).strip('/').lower()
+
+    def estimate_cost_ms(self, filename, size):
+        kind = get_media_kind(filename)
+        if kind is None:
+            return float('inf')
+        min_ms = DEFAULT_COST_MODEL[kind][0]
+        return max(min_ms, self.ms_per_mb[kind] * size / (1024 * 1024))
+
+    def estimate_probability(self, filename):
+        kind = get_media_kind(filename)
+        if kind is None:
+            return 0.0
+        probability = DEFAULT_COST_MODEL[kind][2]
+        path = filename.replace('\\', '/').lower()
+        if any(keyword in path for keyword in self.hint_keywords):
+            probability *= SCHEDULER_HINT_BOOST
+        directory = self._normalize_dir(filename)
+        if directory and directory in self._hit_dirs:
+            probability *= SCHEDULER_HIT_DIR_BOOST
+        return min(probability, 1.0)
+
+    def order(self, files, get_size):
+        """按预计耗时与命中概率之比排序，比值相同时保持原顺序"""
+        def score(filename):
+            probability = self.estimate_probability(filename)
+            if probability <= 0:
+                return float('inf')
+            return self.estimate_cost_ms(filename, get_size(filename)) / probability
+        return sorted(files, key=score)
+
+    def plan(self, files, get_size, sample_budget=None, threshold=None):
+        """返回成员的扫描顺序；指定 sample_budget 且成员数超过预算时返回抽样计划"""
+        if sample_budget and len(files) > sample_budget:
+            return SamplingPlan(self, files, get_size, sample_budget, threshold)
+        return self.order(files, get_size)
+
+class SamplingPlan:
+    """压缩包成员的分层抽样扫描计划
+
+    按目录分层，在样本预算内按各目录成员数比例随机抽样（每个目录至少一个），
+    抽样结果按调度器排序依次检测。得分落入可疑区间时，对该目录剩余成员全量扫描；
+    没有可疑结果且已检测成员数足以在 95% 置信度下认为匹配比例低于
+    SAMPLE_MAX_PREVALENCE 时提前停止。
+    """
+    def __init__(self, scheduler, files, get_size, sample_budget, threshold=None):
+        self.scheduler = scheduler
+        self.get_size = get_size
+        self.threshold = NSFW_THRESHOLD if threshold is None else threshold
+        self.members_total = len(files)
+        self.scanned = 0
+        self.stopped_early = False
+        self.escalated_dirs = set()
+        self._escalation_queue = deque()
+
+        # 按目录分层
+        self._strata = OrderedDict()
+        for filename in files:
+            self._strata.setdefault(scheduler._normalize_dir(filename), []).append(filename)
+
+        # 以成员列表为种子，同一压缩包重复上传时抽到相同的成员，便于命中成员缓存
+        rng = random.Random(zlib.crc32('\n'.join(sorted(files)).encode('utf-8', 'replace')))
+        sampled = []
+        for directory, members in self._strata.items():
+            quota = max(1, round(sample_budget * len(members) / max(len(files), 1)))
+            sampled.extend(rng.sample(members, min(quota, len(members))))
+        if len(sampled) > sample_budget:
+            sampled = rng.sample(sampled, sample_budget)
+        self._sampled = set(sampled)
+        self._queue = deque(scheduler.order(sampled, get_size))
+
+    def _confident_clean(self):
+        """零命中时匹配比例的 95% 置信上界：1 - 0.05^(1/n)"""
+        if self.scanned < SAMPLE_MIN_MEMBERS:
+            return False
+        return 1 - 0.05 ** (1.0 / self.scanned) <= SAMPLE_MAX_PREVALENCE
+
+    def observe(self, filename, result):
+        """记录一个成员的检测结果，可疑得分会触发对所在目录的加密扫描"""
+        self.scanned += 1
+        if not result:
+            return
+        if SAMPLE_SUSPICIOUS_SCORE <= result['nsfw'] <= self.threshold:
+            directory = self.scheduler._normalize_dir(filename)
+            if directory in self.escalated_dirs:
+                return
+            self.escalated_dirs.add(directory)
+            remaining = [f for f in self._strata.get(directory, []) if f not in self._sampled]
+            logger.info(f"抽样发现可疑内容，对目录 '{directory}' 的 {len(remaining)} 个剩余成员全量扫描")
+            self._sampled.update(remaining)
+            self._escalation_queue.extend(self.scheduler.order(remaining, self.get_size))
+
+    def __iter__(self):
+        while self._escalation_queue or self._queue:
+            if self._escalation_queue:
+                yield self._escalation_queue.popleft()
+                continue
+            if self._confident_clean():
+                self.stopped_early = True
+                logger.info(f"抽样检测 {self.scanned} 个成员未发现匹配，提前停止")
+                return
+            yield self._queue.popleft()
+
+# 初始化调度器实例
+member_scheduler = MemberScheduler.get_instance()
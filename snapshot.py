@@ -0,0 +1,134 @@
+# snapshot.py
+import json
+import os
+import shutil
+import tempfile
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_META = 'snapshot.json'
+SNAPSHOT_WEIGHTS = 'weights.pt'
+# 被替换的旧版本快照目录的保留时间
+SNAPSHOT_RETENTION_SECONDS = 600
+
+def _snapshot_fingerprint(model_name):
+    """模型名称与 torch/transformers 版本，任一变化时快照失效"""
+    import torch
+    import transformers
+    return {
+        'model': model_name,
+        'torch': torch.__version__,
+        'transformers': transformers.__version__
+    }
+
+def _snapshot_valid(snapshot_dir, model_name):
+    """快照存在且与当前模型和依赖版本一致"""
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_META)) as f:
+            return json.load(f) == _snapshot_fingerprint(model_name)
+    except (OSError, ValueError):
+        return False
+
+def _remove_old_versions(snapshot_dir, current):
+    """删除不再被引用且超过保留时间的旧版本目录（含保存失败残留的目录）
+
+    旧版本保留一段时间，正在按旧路径加载快照的进程不会读到被删除的文件；
+    已经 mmap 的权重在删除后仍然有效。
+    """
+    parent = os.path.dirname(snapshot_dir)
+    prefix = f'.{os.path.basename(snapshot_dir)}-'
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if not name.startswith(prefix) or name == current or os.path.islink(path) or not os.path.isdir(path):
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) > SNAPSHOT_RETENTION_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def save_snapshot(pipe, snapshot_dir, model_name):
+    """把已加载管道的配置、预处理配置和权重保存为本地快照
+
+    每次保存写入一个新的版本目录，写完后用 os.replace 原子替换指向它的符号链接
+    snapshot_dir：其他进程读取快照时总能看到一个完整的版本，多个进程同时保存时
+    最后一个替换生效。已存在一致的快照时（其他进程刚刚保存）不再保存。
+    """
+    import torch
+    snapshot_dir = os.path.abspath(snapshot_dir)
+    if _snapshot_valid(snapshot_dir, model_name):
+        logger.info(f"模型快照已存在: {snapshot_dir}")
+        return
+    parent = os.path.dirname(snapshot_dir)
+    os.makedirs(parent, exist_ok=True)
+    version_dir = tempfile.mkdtemp(prefix=f'.{os.path.basename(snapshot_dir)}-', dir=parent)
+    try:
+        started = time.monotonic()
+        pipe.model.config.save_pretrained(version_dir)
+        pipe.image_processor.save_pretrained(version_dir)
+        state_dict = {name: tensor.contiguous() for name, tensor in pipe.model.state_dict().items()}
+        torch.save(state_dict, os.path.join(version_dir, SNAPSHOT_WEIGHTS))
+        with open(os.path.join(version_dir, SNAPSHOT_META), 'w') as f:
+            json.dump(_snapshot_fingerprint(model_name), f)
+        os.chmod(version_dir, 0o755)
+
+        if os.path.isdir(snapshot_dir) and not os.path.islink(snapshot_dir):
+            # 旧版本的快照是普通目录，先移到版本目录的位置，之后按保留时间清理
+            os.rename(snapshot_dir, f'{version_dir}.old')
+        link = f'{version_dir}.link'
+        os.symlink(os.path.basename(version_dir), link)
+        os.replace(link, snapshot_dir)
+        _remove_old_versions(snapshot_dir, os.path.basename(version_dir))
+        logger.info(f"模型快照已保存: {snapshot_dir}，耗时 {time.monotonic() - started:.1f} 秒")
+    except Exception as e:
+        logger.error(f"保存模型快照失败: {str(e)}")
+        shutil.rmtree(version_dir, ignore_errors=True)
+
+def load_snapshot_pipeline(snapshot_dir, model_name):
+    """从本地快照创建分类管道，快照不存在或已失效时返回 None
+
+    权重通过 torch.load(mmap=True) 映射到内存，参数直接使用页缓存中的数据：
+    同一节点上的多个进程共享同一份物理内存，模型重置时也无需重新读取权重。
+    模型结构在 meta 设备上创建，跳过随机初始化。
+    """
+    # 只解析一次符号链接，加载过程中快照被替换时仍读取同一个版本
+    snapshot_dir = os.path.realpath(snapshot_dir)
+    meta_path = os.path.join(snapshot_dir, SNAPSHOT_META)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        import torch
+        from transformers import AutoConfig, AutoImageProcessor, AutoModelForImageClassification, pipeline
+
+        with open(meta_path) as f:
+            if json.load(f) != _snapshot_fingerprint(model_name):
+                logger.info("模型快照与当前模型或依赖版本不一致，重新生成")
+                return None
+
+        started = time.monotonic()
+        config = AutoConfig.from_pretrained(snapshot_dir, local_files_only=True)
+        with torch.device('meta'):
+            model = AutoModelForImageClassification.from_config(config)
+        state_dict = torch.load(
+            os.path.join(snapshot_dir, SNAPSHOT_WEIGHTS),
+            map_location='cpu',
+            mmap=True,
+            weights_only=True
+        )
+        model.load_state_dict(state_dict, strict=True, assign=True)
+
+        # 不在 state_dict 中的缓冲区仍在 meta 设备上时无法推理，改为完整加载
+        if any(tensor.is_meta for tensor in list(model.parameters()) + list(model.buffers())):
+            logger.warning("模型快照缺少部分张量，改为完整加载")
+            return None
+        model.eval()
+
+        image_processor = AutoImageProcessor.from_pretrained(snapshot_dir, local_files_only=True)
+        pipe = pipeline("image-classification", model=model, image_processor=image_processor, device=-1)
+        logger.info(f"已从快照加载模型，耗时 {time.monotonic() - started:.2f} 秒")
+        return pipe
+    except Exception as e:
+        logger.error(f"加载模型快照失败: {str(e)}")
+        return None
@@ -0,0 +1,132 @@
+# topology.py
+import math
+import os
+import logging
+from metrics import INFERENCE_PLAN
+from config import INFERENCE_SLOTS, INFERENCE_THREADS, INFERENCE_PIN_CPUS
+
+logger = logging.getLogger(__name__)
+
+def read_cgroup_cpu_limit():
+    """读取 cgroup 的 CPU 配额（可用核数，可为小数），未限制时返回 None"""
+    try:
+        # cgroup v2: "<quota> <period>" 或 "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+def read_core_groups(cpus):
+    """按物理核心分组可用的逻辑 CPU（超线程的兄弟线程在同一组）"""
+    groups = {}
+    for cpu in sorted(cpus):
+        base = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        try:
+            with open(f'{base}/physical_package_id') as f:
+                package = int(f.read())
+            with open(f'{base}/core_id') as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        groups.setdefault((package, core), []).append(cpu)
+    return list(groups.values())
+
+class CpuPlan:
+    """推理线程规划
+
+    根据 cgroup 配额、CPU 亲和性和物理核心数决定：每个推理槽位的 intra-op 线程数、
+    inter-op 线程数、同时推理的槽位数，以及开启绑核时每个槽位使用的 CPU 集合。
+    超线程通常不能提升矩阵运算吞吐，线程数按物理核心计算。
+    """
+    def __init__(self, slots=None, threads=None, pin=None):
+        self.cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        self.cgroup_limit = read_cgroup_cpu_limit()
+        core_groups = read_core_groups(self.cpus)
+        self.physical_cores = len(core_groups)
+
+        # 可用核数：亲和性、物理核心数和 cgroup 配额中的最小值
+        effective = min(len(self.cpus), self.physical_cores)
+        if self.cgroup_limit is not None:
+            effective = min(effective, max(1, math.floor(self.cgroup_limit)))
+        self.effective_cpus = max(1, effective)
+
+        slots = INFERENCE_SLOTS if slots is None else slots
+        threads = INFERENCE_THREADS if threads is None else threads
+        if not slots:
+            # 每个槽位约 4 个线程时单批延迟和总吞吐比较均衡
+            slots = max(1, self.effective_cpus // 4)
+        self.slots = max(1, min(int(slots), self.effective_cpus))
+        self.intra_op_threads = max(1, int(threads) if threads else self.effective_cpus // self.slots)
+        self.inter_op_threads = 1
+
+        self.pin = bool(INFERENCE_PIN_CPUS if pin is None else pin)
+        self.slot_cpus = self._partition(core_groups) if self.pin else [None] * self.slots
+
+    def _partition(self, core_groups):
+        """把物理核心平均分给各槽位，同一物理核心的兄弟线程分在一起"""
+        per_slot = max(1, len(core_groups) // self.slots)
+        partitions = []
+        for index in range(self.slots):
+            groups = core_groups[index * per_slot:(index + 1) * per_slot] or core_groups
+            partitions.append(sorted(cpu for group in groups for cpu in group))
+        return partitions
+
+    def apply_environment(self):
+        """在导入 torch 之前设置 OpenMP/MKL 线程数"""
+        for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ.setdefault(name, str(self.intra_op_threads))
+
+    def apply_torch(self):
+        """设置 torch 的线程数；inter-op 线程数只能在首次并行计算之前设置"""
+        try:
+            import torch
+            torch.set_num_threads(self.intra_op_threads)
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                pass
+        except ImportError:
+            pass
+
+    def pin_current_thread(self, slot):
+        """把当前线程绑定到槽位对应的 CPU 集合"""
+        cpus = self.slot_cpus[slot % self.slots]
+        if not cpus:
+            return
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"推理线程绑核失败: {str(e)}")
+
+    def to_dict(self):
+        return {
+            'cpus': len(self.cpus),
+            'physical_cores': self.physical_cores,
+            'cgroup_limit': self.cgroup_limit,
+            'effective_cpus': self.effective_cpus,
+            'inference_slots': self.slots,
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads,
+            'pinned_cpus': self.slot_cpus if self.pin else None
+        }
+
+# 启动时计算推理线程规划
+cpu_plan = CpuPlan()
+cpu_plan.apply_environment()
+for setting in ('effective_cpus', 'inference_slots', 'intra_op_threads', 'inter_op_threads'):
+    INFERENCE_PLAN.set(cpu_plan.to_dict()[setting], setting=setting)
+logger.info(f"推理线程规划: {cpu_plan.to_dict()}")
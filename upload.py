@@ -0,0 +1,128 @@
+# upload.py
+import hashlib
+import io
+import os
+import tempfile
+import logging
+from flask import Request
+from config import UPLOAD_MEMORY_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# 类型检测使用的文件头长度，与 detect_file_type 一致
+SNIFF_BYTES = 2048
+
+class UploadSpool:
+    """接收上传文件内容的流
+
+    werkzeug 解析 multipart 请求时把文件内容逐块写入此对象：写入的同时计算 SHA-256
+    并保留文件头用于类型检测；内容不超过 memory_limit 时只保存在内存中，超过后一次性
+    转存到临时文件，之后的数据直接写入该文件。请求结束时关闭并删除临时文件。
+    """
+    def __init__(self, memory_limit=UPLOAD_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.size = 0
+        self.header = b''
+        self.path = None
+        self._detached = False
+        self._hash = hashlib.sha256()
+        self._file = io.BytesIO()
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        if len(self.header) < SNIFF_BYTES:
+            self.header += bytes(data[:SNIFF_BYTES - len(self.header)])
+        self.size += len(data)
+        if self.path is None and self.size > self.memory_limit:
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        """把内存中已接收的内容转存到临时文件"""
+        spool = tempfile.NamedTemporaryFile(delete=False)
+        spool.write(self._file.getbuffer())
+        self._file = spool
+        self.path = spool.name
+
+    def getvalue(self):
+        """返回内存中的全部内容，只能在 in_memory 时调用"""
+        return self._file.getvalue()
+
+    def spill(self):
+        """返回保存上传内容的文件路径，内容仍在内存中时写入临时文件"""
+        if self.path is None:
+            self._rollover()
+        self._file.flush()
+        return self.path
+
+    def detach(self):
+        """把上传内容转交给调用方：返回临时文件路径，之后 close() 不再删除该文件
+
+        用于请求结束后才处理的上传（批量检查的流式响应、异步任务），
+        直接使用接收时写入的临时文件，不再另存一份。
+        """
+        path = self.spill()
+        self._file.close()
+        self.path = None
+        self._detached = True
+        return path
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+        if self.path is not None and not self._detached:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"清理上传临时文件失败 {self.path}: {str(e)}")
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+class UploadRequest(Request):
+    """上传文件写入 UploadSpool，不再由 werkzeug 先整体保存到临时文件
+
+    整个请求体超过 UPLOAD_MEMORY_LIMIT 时（大文件或多文件批量上传）直接写入临时文件，
+    单个请求占用的内存不超过该限制。
+    """
+    # 非文件表单字段（路径、扫描参数等）在内存中解析的大小上限，与文件内容无关
+    max_form_memory_size = 128 * 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length > UPLOAD_MEMORY_LIMIT:
+            return UploadSpool(memory_limit=0)
+        return UploadSpool()
@@ -8,7 +8,11 @@ import tempfile
 import subprocess
 import shutil
 import uuid
+import zlib
 from pathlib import Path
+from context import current_context, BudgetExceeded
+from scheduler import member_scheduler
+from profiling import span, stage, run_subprocess, record_rusage, ProfiledPopen
 from config import (
     IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, DOCUMENT_EXTENSIONS,  # 添加 DOCUMENT_EXTENSIONS
     ARCHIVE_EXTENSIONS
@@ -16,18 +20,36 @@ from config import (
 
 logger = logging.getLogger(__name__)
 
+class _Crc32Sink:
+    """只计算写入内容的 CRC32 和字节数，不保存内容"""
+    def __init__(self):
+        self.crc = 0
+        self.size = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
 class ArchiveHandler:
-    def __init__(self, filepath):
+    def __init__(self, filepath, name=None):
+        # filepath 可以是文件路径，也可以是 ZIP/GZ 内容的可定位文件对象（用于内存中的嵌套压缩包）
         self.filepath = filepath
+        self.is_stream = not isinstance(filepath, (str, os.PathLike))
+        self.name = name or ('content' if self.is_stream else str(filepath))
         self.archive = None
         self.type = self._determine_type()
         self.temp_dir = None
         self._extracted_files = {}  # 存储解压文件的映射 {原始文件名: 临时文件路径}
+        self._member_info = {}  # 从压缩包头部读取的成员信息 {文件名: (CRC32, 解压后大小)}
+        self._extracted = False
         
     def _determine_type(self):
         try:
             if zipfile.is_zipfile(self.filepath):
                 return 'zip'
+            elif self.is_stream:
+                # RAR/7z 依赖命令行工具解压，只能从磁盘文件打开
+                return 'gz' if self._is_valid_gzip(self.filepath) else None
             elif rarfile.is_rarfile(self.filepath):
                 return 'rar'
             elif self._is_7z_file(self.filepath):
@@ -41,7 +63,7 @@ class ArchiveHandler:
 
     def _is_7z_file(self, filepath):
         try:
-            result = subprocess.run(
+            result = run_subprocess(
                 ['7z', 'l', filepath], 
                 stdout=subprocess.PIPE, 
                 stderr=subprocess.PIPE,
@@ -54,8 +76,14 @@ class ArchiveHandler:
 
     def _is_valid_gzip(self, filepath):
         try:
-            with gzip.open(filepath, 'rb') as f:
-                f.read(1)
+            if self.is_stream:
+                filepath.seek(0)
+                with gzip.GzipFile(fileobj=filepath) as f:
+                    f.read(1)
+                filepath.seek(0)
+            else:
+                with gzip.open(filepath, 'rb') as f:
+                    f.read(1)
             return True
         except Exception:
             return False
@@ -65,6 +93,91 @@ class ArchiveHandler:
         ext = Path(original_filename).suffix
         return f"{str(uuid.uuid4())}{ext}"
 
+    def _get_dir_size(self, path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for filename in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    pass
+        return total
+
+    def _run_extract(self, extract_cmd):
+        """运行解压命令，解压过程中按请求预算检查已写出字节数和耗时，超出时终止解压"""
+        budget = current_context().budget
+        declared = sum(size for _, size in self._member_info.values())
+        if declared > budget.remaining_bytes():
+            budget.consume_bytes(declared)
+
+        with span(os.path.basename(extract_cmd[0])) as node:
+            process = ProfiledPopen(
+                extract_cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                encoding='utf-8'
+            )
+            try:
+                while True:
+                    try:
+                        _, stderr = process.communicate(timeout=0.5)
+                        break
+                    except subprocess.TimeoutExpired:
+                        # 压缩包头部可能伪造大小，按实际写出的字节数检查
+                        written = self._get_dir_size(self.temp_dir)
+                        if written > budget.remaining_bytes():
+                            budget.consume_bytes(written)
+                        budget.check_time()
+            except BudgetExceeded:
+                process.kill()
+                process.communicate()
+                raise
+            finally:
+                record_rusage(node, process.rusage)
+
+        budget.consume_bytes(self._get_dir_size(self.temp_dir))
+        return subprocess.CompletedProcess(extract_cmd, process.returncode, None, stderr)
+
+    def _copy_member_stream(self, stream, dest, declared_size=0):
+        """分块复制成员内容到目标文件对象，复制过程中按请求预算累计解压字节数"""
+        budget = current_context().budget
+        if declared_size > budget.remaining_bytes():
+            budget.consume_bytes(declared_size)
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            budget.consume_bytes(len(chunk))
+            dest.write(chunk)
+
+    def verify_member(self, filename, key):
+        """解压成员并校验实际内容的 CRC32 和大小是否与 key (CRC32, 大小) 一致
+
+        头部记录的 CRC 可以伪造，成员缓存命中后需要校验才能使用缓存结果。
+        """
+        if key is None:
+            return False
+        sink = _Crc32Sink()
+        try:
+            with stage('member_verify'), self.open_member(filename) as member:
+                self._copy_member_stream(member, sink, key[1])
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            # ZIP/GZ 在读到结尾时自行校验 CRC，不一致时抛出异常
+            logger.warning(f"校验成员 {filename} 失败: {str(e)}")
+            return False
+        if self.type == 'gz':
+            # gzip 尾部记录的是模 2^32 的大小
+            return sink.crc == key[0] and sink.size % (1 << 32) == key[1]
+        return sink.crc == key[0] and sink.size == key[1]
+
+    def _read_member_stream(self, stream, declared_size=0):
+        """分块读取成员内容，读取过程中按请求预算累计解压字节数"""
+        buffer = io.BytesIO()
+        self._copy_member_stream(stream, buffer, declared_size)
+        return buffer.getvalue()
+
     def _extract_rar_all(self):
         """使用unrar命令行工具完整解压RAR文件"""
         if not self.temp_dir:
@@ -73,12 +186,7 @@ class ArchiveHandler:
         try:
             # 使用unrar命令行工具解压
             extract_cmd = ['unrar', 'x', '-y', self.filepath, self.temp_dir + os.sep]
-            result = subprocess.run(
-                extract_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8'
-            )
+            result = self._run_extract(extract_cmd)
 
             if result.returncode != 0:
                 raise Exception(f"RAR解压失败: {result.stderr}")
@@ -100,6 +208,8 @@ class ArchiveHandler:
             logger.info(f"成功解压 {len(self._extracted_files)} 个文件到临时目录")
             return True
 
+        except BudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"RAR完整解压失败: {str(e)}")
             return False
@@ -112,12 +222,7 @@ class ArchiveHandler:
         try:
             # 使用 7z 命令行工具解压所有文件
             extract_cmd = ['7z', 'x', '-y', self.filepath, f'-o{self.temp_dir}']
-            result = subprocess.run(
-                extract_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8'
-            )
+            result = self._run_extract(extract_cmd)
 
             if result.returncode != 0:
                 raise Exception(f"7z解压失败: {result.stderr}")
@@ -139,30 +244,99 @@ class ArchiveHandler:
             logger.info(f"成功解压 {len(self._extracted_files)} 个文件到临时目录")
             return True
 
+        except BudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"7z完整解压失败: {str(e)}")
             return False
 
+    def _list_rar_members(self):
+        """从RAR头部读取成员列表及CRC，无需解压"""
+        try:
+            for info in self.archive.infolist():
+                if info.isdir():
+                    continue
+                self._member_info[info.filename] = (info.CRC, info.file_size)
+            return bool(self._member_info)
+        except Exception as e:
+            logger.error(f"读取RAR成员列表失败: {str(e)}")
+            self._member_info = {}
+            return False
+
+    def _list_7z_members(self):
+        """使用 7z l -slt 从头部读取成员列表及CRC，无需解压"""
+        try:
+            result = run_subprocess(
+                ['7z', 'l', '-slt', self.filepath],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding='utf-8'
+            )
+            if result.returncode != 0:
+                raise Exception(result.stderr)
+
+            # 成员信息位于分隔线之后，每个成员以空行分隔
+            _, sep, body = result.stdout.partition('\n----------\n')
+            if not sep:
+                return False
+            for block in body.split('\n\n'):
+                fields = {}
+                for line in block.splitlines():
+                    key, eq, value = line.partition(' = ')
+                    if eq:
+                        fields[key.strip()] = value.strip()
+                path = fields.get('Path')
+                if not path or fields.get('Folder') == '+' or 'D' in fields.get('Attributes', ''):
+                    continue
+                crc = int(fields['CRC'], 16) if fields.get('CRC') else None
+                size = int(fields['Size']) if fields.get('Size', '').isdigit() else 0
+                self._member_info[path] = (crc, size)
+            return bool(self._member_info)
+        except Exception as e:
+            logger.error(f"读取7z成员列表失败: {str(e)}")
+            self._member_info = {}
+            return False
+
+    def _ensure_extracted(self):
+        """RAR/7z 仅在确实需要读取成员内容时才完整解压"""
+        if self._extracted:
+            return
+        self._extracted = True
+        with stage('archive_extract'):
+            if self.type == 'rar':
+                if not self._extract_rar_all():
+                    raise Exception("RAR文件解压失败")
+            elif self.type == '7z':
+                if not self._extract_7z_all():
+                    raise Exception("7z文件解压失败")
+
     def __enter__(self):
+        with span('archive_open', type=self.type):
+            return self._open()
+
+    def _open(self):
         try:
             if self.type == 'zip':
+                # 成员读取时会校验CRC，这里不再预先解压整个文件做 testzip
                 self.archive = zipfile.ZipFile(self.filepath)
-                if self.archive.testzip() is not None:
-                    raise zipfile.BadZipFile("ZIP文件损坏")
             elif self.type == 'rar':
                 self.archive = rarfile.RarFile(self.filepath)
                 if self.archive.needs_password():
                     raise Exception("RAR文件有密码保护")
-                # 直接解压所有RAR文件
-                if not self._extract_rar_all():
-                    raise Exception("RAR文件解压失败")
+                # 优先从头部读取成员列表，读取失败时直接完整解压
+                if not self._list_rar_members():
+                    self._ensure_extracted()
             elif self.type == '7z':
-                # 直接解压所有7z文件
-                if not self._extract_7z_all():
-                    raise Exception("7z文件解压失败")
+                if not self._list_7z_members():
+                    self._ensure_extracted()
             elif self.type == 'gz':
-                self.archive = gzip.GzipFile(self.filepath)
+                if self.is_stream:
+                    self.archive = gzip.GzipFile(fileobj=self.filepath)
+                else:
+                    self.archive = gzip.GzipFile(self.filepath)
             return self
+        except BudgetExceeded:
+            raise
         except (zipfile.BadZipFile, rarfile.BadRarFile) as e:
             raise Exception(f"无效的压缩文件: {str(e)}")
         except Exception as e:
@@ -181,14 +355,14 @@ class ArchiveHandler:
         try:
             if self.type == 'zip':
                 files = [f for f in self.archive.namelist() if not f.endswith('/')]
-            elif self.type == 'rar':
-                # 对于RAR文件，直接返回已解压的文件列表
-                files = list(self._extracted_files.keys())
-            elif self.type == '7z':
-                # 直接返回已解压的文件列表
-                files = list(self._extracted_files.keys())
+            elif self.type == 'rar' or self.type == '7z':
+                # 优先使用头部记录的成员列表，否则返回已解压的文件列表
+                if self._member_info:
+                    files = list(self._member_info.keys())
+                else:
+                    files = list(self._extracted_files.keys())
             elif self.type == 'gz':
-                base_name = os.path.basename(self.filepath)
+                base_name = os.path.basename(self.name)
                 if base_name.endswith('.gz'):
                     files = [base_name[:-3]]
                 else:
@@ -209,33 +383,117 @@ class ArchiveHandler:
             if self.type == 'zip':
                 return self.archive.getinfo(filename).file_size
             elif self.type == 'rar' or self.type == '7z':
-                # 对于RAR和7z文件，直接获取解压后文件的大小
+                # 优先使用头部记录的大小，避免逐个 stat 解压后的文件
+                if filename in self._member_info:
+                    return self._member_info[filename][1]
                 if filename in self._extracted_files:
                     return os.path.getsize(self._extracted_files[filename])
                 return 0
             elif self.type == 'gz':
-                return self.archive.size
+                key = self.get_member_key(filename)
+                return key[1] if key else 0
             return 0
         except Exception as e:
             logger.error(f"获取文件信息失败: {str(e)}")
             return 0
 
+    def get_member_key(self, filename):
+        """返回压缩包头部记录的 (CRC32, 解压后大小)，无法获取时返回 None"""
+        try:
+            if self.type == 'zip':
+                info = self.archive.getinfo(filename)
+                key = (info.CRC, info.file_size)
+            elif self.type == 'rar' or self.type == '7z':
+                key = self._member_info.get(filename)
+            elif self.type == 'gz':
+                # gzip 尾部8字节记录 CRC32 和原始大小（模 2^32）
+                if self.is_stream:
+                    position = self.filepath.tell()
+                    self.filepath.seek(-8, os.SEEK_END)
+                    trailer = self.filepath.read(8)
+                    self.filepath.seek(position)
+                else:
+                    with open(self.filepath, 'rb') as f:
+                        f.seek(-8, os.SEEK_END)
+                        trailer = f.read(8)
+                key = (int.from_bytes(trailer[:4], 'little'), int.from_bytes(trailer[4:], 'little'))
+            else:
+                key = None
+            if not key or key[0] is None or not key[1]:
+                return None
+            return key
+        except Exception as e:
+            logger.error(f"获取成员校验信息失败: {str(e)}")
+            return None
+
+    def get_member_path(self, filename):
+        """RAR/7z 成员已解压到临时目录，返回其路径以避免再次复制；其他格式返回 None"""
+        if self.type == 'rar' or self.type == '7z':
+            self._ensure_extracted()
+            return self._extracted_files.get(filename)
+        return None
+
+    def open_member(self, filename):
+        """打开成员内容的只读流，供外部工具通过管道读取"""
+        if self.type == 'zip':
+            return self.archive.open(filename)
+        elif self.type == 'rar' or self.type == '7z':
+            member_path = self.get_member_path(filename)
+            if member_path is None:
+                raise Exception(f"文件 {filename} 未在提取列表中")
+            return open(member_path, 'rb')
+        elif self.type == 'gz':
+            if self.is_stream:
+                return gzip.GzipFile(fileobj=io.BytesIO(self.filepath.getvalue()))
+            return gzip.open(self.filepath, 'rb')
+        raise Exception("不支持的压缩格式")
+
+    def extract_to_file(self, filename, dest):
+        """将成员内容流式写入目标文件对象，不在内存中保留完整内容"""
+        try:
+            if self.type == 'zip':
+                with stage('archive_extract'), self.archive.open(filename) as member:
+                    self._copy_member_stream(member, dest, self.archive.getinfo(filename).file_size)
+            elif self.type == 'rar' or self.type == '7z':
+                member_path = self.get_member_path(filename)
+                if member_path is None:
+                    raise Exception(f"文件 {filename} 未在提取列表中")
+                with open(member_path, 'rb') as f:
+                    shutil.copyfileobj(f, dest, 1024 * 1024)
+            elif self.type == 'gz':
+                with stage('archive_extract'):
+                    self.archive.seek(0)
+                    self._copy_member_stream(self.archive, dest)
+            else:
+                raise Exception("不支持的压缩格式")
+            dest.flush()
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            raise Exception(f"提取文件失败: {str(e)}")
+
     def extract_file(self, filename):
         try:
             base_name = os.path.basename(filename)
             logger.info(f"正在检测文件: {base_name}")
             
             if self.type == 'zip':
-                return self.archive.read(filename)
+                with stage('archive_extract'), self.archive.open(filename) as member:
+                    return self._read_member_stream(member, self.archive.getinfo(filename).file_size)
             elif self.type == 'rar' or self.type == '7z':
                 # 对于RAR和7z文件，直接返回已解压文件的内容
+                self._ensure_extracted()
                 if filename in self._extracted_files:
                     with open(self._extracted_files[filename], 'rb') as f:
                         return f.read()
                 raise Exception(f"文件 {filename} 未在提取列表中")
             elif self.type == 'gz':
-                return self.archive.read()
+                with stage('archive_extract'):
+                    self.archive.seek(0)
+                    return self._read_member_stream(self.archive)
             raise Exception("不支持的压缩格式")
+        except BudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"提取文件失败: {str(e)}")
 
@@ -250,21 +508,8 @@ def can_process_file(filename):
             ext in DOCUMENT_EXTENSIONS) 
 
 def sort_files_by_priority(handler, files):
-    def get_priority_and_size(filename):
-        ext = get_file_extension(filename)
-        size = handler.get_file_info(filename)
-        
-        if ext in IMAGE_EXTENSIONS:
-            priority = 0
-        elif ext == '.pdf':
-            priority = 1
-        elif ext in VIDEO_EXTENSIONS:
-            priority = 2
-        elif ext in DOCUMENT_EXTENSIONS:  # 添加文档文件的优先级
-            priority = 1  # 与 PDF 相同的优先级
-        else:
-            priority = 3
-            
-        return (priority, size)
-    
-    return sorted(files, key=get_priority_and_size)
\ No newline at end of file
+    """按预计耗时与命中概率排序成员，尽快找到第一个匹配项
+
+    大小取自压缩包头部记录，不需要解压或 stat 文件。
+    """
+    return member_scheduler.order(files, handler.get_file_info)
@@ -0,0 +1,283 @@
+# watch.py
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import threading
+import time
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from config import WATCH_DIRS, WATCH_OUTPUT, WATCH_DEBOUNCE_SECONDS, WATCH_WORKERS
+from detector import scan_file
+from scan import is_scan_candidate, iter_directory, open_result_writer
+
+logger = logging.getLogger(__name__)
+
+# inotify 事件掩码（linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    """通过 ctypes 调用 libc 的 inotify 接口"""
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1 failed: {os.strerror(err)}')
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_add_watch failed for {path}: {os.strerror(err)}')
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """等待最多 timeout 秒，返回 [(wd, mask, cookie, name)]"""
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(max(0, int(timeout * 1000))):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class WebhookResultSink:
+    """将检查结果以 JSON POST 到指定地址"""
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def write(self, record):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(record, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except Exception as e:
+            logger.error(f"发送检查结果到 {self.url} 失败: {str(e)}")
+
+    def close(self):
+        pass
+
+def open_result_sink(target):
+    """http(s) 地址使用 Webhook，其余按文件扩展名写入 JSONL 或 SQLite"""
+    if target.startswith(('http://', 'https://')):
+        return WebhookResultSink(target)
+    return open_result_writer(target)
+
+class DirectoryWatcher:
+    """递归监控目录，把新写入或移入的文件送入检查流程
+
+    同一文件的 close-write/moved-to 事件合并为一次检查；文件在 debounce 秒内
+    再次被修改时推迟检查，避免检查仍在写入的文件。事件队列溢出时重新遍历所有目录，
+    未变化的文件会直接命中路径索引。
+    """
+    def __init__(self, roots, output, workers=None, debounce=None, scan_options=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.workers = max(1, workers or WATCH_WORKERS)
+        self.debounce = WATCH_DEBOUNCE_SECONDS if debounce is None else debounce
+        self.scan_options = scan_options or {}
+        self.output = output
+        self._sink = None
+        self._running = set()  # 检查中的文件，结果由监控线程统一写入
+        self._inotify = None
+        self._watches = {}  # wd -> 目录路径
+        self._pending = {}  # 文件路径 -> 到期时间
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _add_tree(self, root, enqueue_existing=False):
+        """为目录树中的每个目录添加监控；新出现的目录中已有的文件同时加入检查"""
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self._inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    logger.error("inotify 监控数量达到上限，请调大 fs.inotify.max_user_watches")
+                else:
+                    logger.error(f"无法监控目录 {directory}: {str(e)}")
+                continue
+            self._watches[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif enqueue_existing and entry.is_file(follow_symlinks=False):
+                            self._schedule(entry.path)
+            except OSError as e:
+                logger.error(f"无法读取目录 {directory}: {str(e)}")
+
+    def _schedule(self, path):
+        if is_scan_candidate(path):
+            self._pending[path] = time.monotonic() + self.debounce
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify 事件队列溢出，重新遍历监控目录")
+            for root in self.roots:
+                for path in iter_directory(root):
+                    self._schedule(path)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+
+        directory = self._watches.get(wd)
+        if directory is None or not name:
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path, enqueue_existing=True)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._schedule(path)
+        elif mask & IN_MODIFY and path in self._pending:
+            # 仍在写入，推迟检查
+            self._schedule(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._pending.pop(path, None)
+
+    def _scan(self, path):
+        record = {'path': path}
+        try:
+            result, status_code = scan_file(path, os.path.basename(path), self.scan_options, use_index=True)
+            record.update(result)
+            record['status_code'] = status_code
+        except Exception as e:
+            logger.error(f"检查文件 {path} 失败: {str(e)}")
+            record.update({'status': 'error', 'message': str(e), 'status_code': 500})
+        record['scanned_at'] = time.time()
+        return record
+
+    def _dispatch_due(self, executor):
+        now = time.monotonic()
+        due = [path for path, deadline in self._pending.items() if deadline <= now]
+        for path in due:
+            del self._pending[path]
+            if os.path.isfile(path):
+                self._running.add(executor.submit(self._scan, path))
+
+    def _write_finished(self):
+        finished = [future for future in self._running if future.done()]
+        for future in finished:
+            self._running.discard(future)
+            self._sink.write(future.result())
+
+    def run(self):
+        """在当前线程中监控，直到调用 stop()"""
+        # SQLite 连接只能在创建它的线程中使用，结果写入器在监控线程中打开和写入
+        self._sink = open_result_sink(self.output)
+        self._inotify = Inotify()
+        try:
+            for root in self.roots:
+                self._add_tree(root)
+            logger.info(f"开始监控 {len(self._watches)} 个目录: {', '.join(self.roots)}")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while not self._stop.is_set():
+                    if self._pending:
+                        timeout = max(0.0, min(self._pending.values()) - time.monotonic())
+                        timeout = min(timeout, 1.0)
+                    else:
+                        timeout = 1.0
+                    if self._running:
+                        # 有文件在检查中时缩短等待，及时写入结果
+                        timeout = min(timeout, 0.2)
+                    for wd, mask, _, name in self._inotify.read_events(timeout):
+                        self._handle(wd, mask, name)
+                    self._dispatch_due(executor)
+                    self._write_finished()
+            self._write_finished()
+        finally:
+            self._inotify.close()
+            self._sink.close()
+            logger.info("目录监控已停止")
+
+    def start(self):
+        """在后台线程中开始监控"""
+        self._thread = threading.Thread(target=self.run, name='directory-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+def start_configured_watcher():
+    """按 WATCH_DIRS 配置启动后台监控，未配置时返回 None"""
+    roots = [root.strip() for root in str(WATCH_DIRS).split(',') if root.strip()]
+    if not roots:
+        return None
+    watcher = DirectoryWatcher(roots, WATCH_OUTPUT)
+    watcher.start()
+    return watcher
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch directories and check new files as they are written')
+    parser.add_argument('roots', nargs='+', help='directories to watch recursively')
+    parser.add_argument('-o', '--output', default=WATCH_OUTPUT,
+                        help='result sink: .jsonl or .db/.sqlite file, or an http(s) webhook URL')
+    parser.add_argument('-w', '--workers', type=int, default=WATCH_WORKERS,
+                        help='number of files checked in parallel')
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE_SECONDS,
+                        help='seconds a file must stay unmodified before it is checked')
+    args = parser.parse_args()
+
+    watcher = DirectoryWatcher(args.roots, args.output, workers=args.workers, debounce=args.debounce)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()